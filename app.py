@@ -8,21 +8,46 @@ if getattr(sys, 'frozen', False):
 else:
     application_path = os.path.dirname(__file__)
 
-# 同梱したGraphviz/binへのパスを通す (フォルダ名は適宜変更)
-graphviz_path = os.path.join(application_path, "Graphviz", "bin")
-os.environ["PATH"] += os.pathsep + graphviz_path
+# 同梱したGraphviz/binへのパスは graphviz の初回使用時に通す (utils.load_graphviz)
 import streamlit as st
-import graphviz
 import math
 import pandas as pd
 import json
 import io
-import matplotlib.pyplot as plt
+import sqlite3
+from utils import get_pipe_catalog, load_graphviz
+from diagram import build_diagram, render_source, render_with_layout, layout_options, LAYOUT_CACHE
+from viewer import viewer_data, show_viewer, selected_node_id, VIEWER_NODE_THRESHOLD
+from node_index import NodeIndex, page_bounds, PAGE_SIZE, BREADCRUMB_DEPTH
+from editor_tables import result_arrays, editor_frame, apply_edits, BATCH_FIELDS, CHILD_FIELDS
+from builders import build_riser
+from importer import import_edge_list
+from tree_arrays import LoadTable
+from optimizer import optimize_sizes, changes_table
+from pressures import residual_pressures, summarize, DEFAULT_MAX_PRESSURE_MPA
+from sensitivity import upsize_sensitivity
+from network import has_loops, solve_network
+from montecarlo import simulate, FIXTURE_USAGE, DEFAULT_TRIALS, DEFAULT_PERCENTILES
+from timeseries import evaluate_profile, DEMAND_PATTERNS
+from history import History
+from store import ProjectStore, DEFAULT_DB_PATH
+from reports import excel_from_rows, critical_route_rows, total_dynamic_head as total_dynamic_head_of
+from jobs import JobQueue, content_key, DONE
+from pumps import load_pump_catalog, select_pumps
+from friction import is_darcy, darcy_loss, apply_darcy_weisbach, DARCY_WEISBACH, DEFAULT_TEMPERATURE_C
+from templates import make_template, new_template_id, link_templates, detach_template, sync_template_fields, pack_project, unpack_project, repeat_count
+from diagnostics import RunTimer, merge_cache_counters, log_run, HISTORY_SIZE
 
 # --- 0. 初期設定データ ---
 
-# グラフの日本語フォント設定
-plt.rcParams['font.family'] = 'Meiryo'
+BUILDING_TYPES = ["一般・事務所 (負荷単位法)", "集合住宅 (BL基準)", "集合住宅 (人数基準)", "一戸建て (総水栓数法)"]
+LOSS_MODELS = ["ヘーゼン・ウィリアムス", "ダルシー・ワイスバッハ"]
+# 設計条件の入力欄 (キー → 初期値)。プロジェクトDBから開くときは保存時の値で上書きする
+SETTING_DEFAULTS = {
+    "toilet_type": "洗浄弁式", "person_C1": 26.0, "person_k1": 0.36, "person_C2": 13.0, "person_k2": 0.56,
+    "max_velocity_setting": 2.0, "loss_model": LOSS_MODELS[0], "hw_c_value": 130.0,
+    "water_temperature": DEFAULT_TEMPERATURE_C, "roughness_setting": 0.0, "fitting_ratio": 1.2,
+}
 
 # 器具データ（負荷単位LU, 標準接続口径A）
 FIXTURE_SPECS = {
@@ -117,11 +142,6 @@ PIPE_DATABASES = {
 }
 PIPE_DATABASES["HIVP (耐衝撃性硬質塩化ビニル管)"] = PIPE_DATABASES["VP (硬質ポリ塩化ビニル管)"]
 
-# カラー定義
-PIPE_COLORS = {
-    "SGP": "#1976D2", "VP": "#757575", "HIVP": "#1565C0", "SU": "#00796B", "PE": "#388E3C"
-}
-
 # SU管の許容流量テーブル
 SU_FLOW_CAPACITY = {
     "13Su": 18.0, "20Su": 45.0, "25Su": 85.0, "30Su": 120.0,
@@ -149,7 +169,7 @@ FLOW_TABLE_FT = { 1: 16.8, 2: 18.8, 5: 24.9, 10: 34.8, 15: 44.3, 20: 53.5, 30: 7
 
 # --- 1. 計算クラス ---
 class PipeSection:
-    def __init__(self, id, name, type, fixtures=None, manual_size=None, dwelling_count=1, person_count=0, specific_pipe_type=None, length=2.0, is_fixed_flow=False, fixed_flow_val=0.0, is_manual_critical=False, static_head=0.0, required_pressure=0.0, equivalent_length=0.0, inner_pipe_length=2.0, fixture_type=None):
+    def __init__(self, id, name, type, fixtures=None, manual_size=None, dwelling_count=1, person_count=0, specific_pipe_type=None, length=2.0, is_fixed_flow=False, fixed_flow_val=0.0, is_manual_critical=False, static_head=0.0, required_pressure=0.0, equivalent_length=0.0, inner_pipe_length=2.0, fixture_type=None, repeat=1, template_id=None, template_cache=None):
         self.id = id
         self.name = name
         self.type = type # 'branch', 'system', 'fixture'
@@ -167,6 +187,11 @@ class PipeSection:
         self.is_fixed_flow = is_fixed_flow
         self.fixed_flow_val = fixed_flow_val
         self.is_manual_critical = is_manual_critical
+        self.repeat = repeat # 同一系統の台数 (テンプレート繰り返し)
+        self.template_id = template_id
+        self.template_cache = template_cache # 同じテンプレートのノードで共有
+        self.load_table = None # 器具構成の行列表現 (ノードマップ構築時に設定)
+        self.row = None
         self.children = []
         self.parent_name = ""
         self.parent_id = None
@@ -180,6 +205,7 @@ class PipeSection:
         self.size = "-"
         self.velocity = 0.0
         self.head_loss = 0.0
+        self.inner_diameter = 0.0
         self.cum_head_loss = 0.0
         self.cum_length = 0.0
         self.is_manual = False
@@ -196,22 +222,29 @@ class PipeSection:
         child_node.parent_id = self.id
 
     def calculate_self_stats(self, building_type):
-        load = 0.0
-        count = 0
-        
-        # 1. 簡易入力
-        for fname_key, qty in self.fixtures.items():
-            if qty > 0:
-                count += qty
-                if fname_key in FIXTURE_DATA:
-                    load += qty * FIXTURE_DATA[fname_key]
-        
-        # 2. 個別器具ノード
-        if self.type == "fixture" and self.fixture_type:
-            spec = FIXTURE_SPECS.get(self.fixture_type)
-            if spec:
-                load = spec["lu"]
-                count = 1
+        if self.load_table is not None:
+            table = self.load_table.stats(FIXTURE_SPECS)
+            load, count = table["load"][self.row], table["count"][self.row]
+        elif self.template_cache is not None and "stats" in self.template_cache:
+            load, count = self.template_cache["stats"]
+        else:
+            load = 0.0
+            count = 0
+
+            # 1. 簡易入力
+            for fname_key, qty in self.fixtures.items():
+                if qty > 0:
+                    count += qty
+                    if fname_key in FIXTURE_DATA:
+                        load += qty * FIXTURE_DATA[fname_key]
+
+            # 2. 個別器具ノード
+            if self.type == "fixture" and self.fixture_type:
+                spec = FIXTURE_SPECS.get(self.fixture_type)
+                if spec:
+                    load = spec["lu"]
+                    count = 1
+            if self.template_cache is not None: self.template_cache["stats"] = (load, count)
         
         self.load_units = load
         self.fixture_count = count
@@ -245,6 +278,11 @@ class PipeSection:
         self.system_total = self.system_count + child_system_sum
         self.person_total = self.person_count_val + child_person_sum
         self.fixture_total = self.fixture_count + child_fixture_sum
+        if self.load_table is not None:
+            # 負荷単位・器具数の配下合計はツリー集約で一括計算済み
+            table = self.load_table.stats(FIXTURE_SPECS)
+            self.total_load = table["subtree_load"][self.row]
+            self.fixture_total = table["subtree_count"][self.row]
         
         # 流量計算
         auto_flow = 0.0
@@ -290,16 +328,15 @@ class PipeSection:
         q_m3s = self.flow_lpm / 60000
         target_pipe_type = self.specific_pipe_type if self.specific_pipe_type else default_pipe_type
         self.used_pipe_type = target_pipe_type
-        current_specs_df = pd.DataFrame(all_pipe_db.get(target_pipe_type, []))
+        size_to_dmm, sizes_by_diameter = get_pipe_catalog(all_pipe_db, target_pipe_type)
         d_mm_actual = 0.0
         
         if self.manual_size and self.manual_size != "自動計算":
             self.size = self.manual_size
             self.is_manual = True
-            if not current_specs_df.empty:
-                row = current_specs_df[current_specs_df["サイズ"] == self.manual_size]
-                if not row.empty and q_m3s > 0:
-                    d_mm_actual = row.iloc[0]["内径(mm)"]
+            if size_to_dmm:
+                if self.manual_size in size_to_dmm and q_m3s > 0:
+                    d_mm_actual = size_to_dmm[self.manual_size]
                     area = math.pi * ((d_mm_actual/1000)/2)**2
                     self.velocity = round(q_m3s / area, 2)
                 else: self.velocity = 0.0
@@ -315,24 +352,21 @@ class PipeSection:
                 for size_name, cap_lpm in sorted_capacity:
                     if self.flow_lpm <= cap_lpm:
                         best_size = size_name
-                        row = current_specs_df[current_specs_df["サイズ"] == size_name]
-                        if not row.empty:
-                            d_mm_actual = row.iloc[0]["内径(mm)"]
+                        if size_name in size_to_dmm:
+                            d_mm_actual = size_to_dmm[size_name]
                             area = math.pi * ((d_mm_actual/1000)/2)**2
                             best_vel = round(q_m3s / area, 2) if area > 0 else 0.0
                         found_su = True
                         break
                 if not found_su and self.flow_lpm > 0: best_size = "規格外(過大)"
             else:
-                if not current_specs_df.empty:
-                    sorted_specs = current_specs_df.sort_values("内径(mm)")
-                    for _, row in sorted_specs.iterrows():
-                        d_mm = row["内径(mm)"]
+                if sizes_by_diameter:
+                    for size_name, d_mm in sizes_by_diameter:
                         area = math.pi * ((d_mm/1000)/2)**2
                         if area <= 0: continue
                         vel = q_m3s / area
                         if vel <= max_velocity:
-                            best_size = row["サイズ"]
+                            best_size = size_name
                             best_vel = round(vel, 2)
                             d_mm_actual = d_mm
                             break
@@ -340,9 +374,11 @@ class PipeSection:
             self.velocity = best_vel
             
         self.head_loss = 0.0
+        self.inner_diameter = d_mm_actual
         self.loss_params_used = loss_params.copy() if loss_params else {}
         
-        if loss_params and d_mm_actual > 0 and q_m3s > 0:
+        # ダルシー・ワイスバッハ式はルートの計算の最後に全区間まとめて求める
+        if loss_params and d_mm_actual > 0 and q_m3s > 0 and not is_darcy(loss_params):
             C_val = loss_params.get("C", 130.0)
             fit_rate = loss_params.get("fitting", 1.2)
             D_m = d_mm_actual / 1000.0
@@ -351,7 +387,10 @@ class PipeSection:
             self.head_loss = round(h, 3)
         
         self.critical_inner_loss = 0.0
-        if self.type == "system" and self.fixtures:
+        inner_key = ("inner", self.used_pipe_type, is_fv, tuple(sorted(loss_params.items())) if loss_params else None)
+        if self.template_cache is not None and inner_key in self.template_cache:
+            self.critical_inner_loss = self.template_cache[inner_key]
+        elif self.type == "system" and self.fixtures:
             max_inner_loss = 0.0
             for f_name, qty in self.fixtures.items():
                 if qty <= 0: continue
@@ -360,11 +399,10 @@ class PipeSection:
                 
                 f_size_a = spec["size_a"]
                 f_d_mm = 16.0 
-                specs_df = pd.DataFrame(all_pipe_db.get(self.used_pipe_type, []))
-                if not specs_df.empty:
+                inner_sizes, _ = get_pipe_catalog(all_pipe_db, self.used_pipe_type)
+                if inner_sizes:
                     search_str = get_display_size(f_size_a, self.used_pipe_type)
-                    row = specs_df[specs_df["サイズ"] == search_str]
-                    if not row.empty: f_d_mm = row.iloc[0]["内径(mm)"]
+                    if search_str in inner_sizes: f_d_mm = inner_sizes[search_str]
                 
                 if f_d_mm > 0 and loss_params:
                     f_lu = spec["lu"]
@@ -372,11 +410,19 @@ class PipeSection:
                     f_q_m3s = f_flow_lpm / 60000
                     f_D_m = f_d_mm / 1000.0
                     f_L_eq = self.inner_pipe_length * loss_params.get("fitting", 1.2)
-                    f_h = 10.666 * (loss_params.get("C", 130.0) ** -1.852) * (f_D_m ** -4.87) * (f_q_m3s ** 1.852) * f_L_eq
+                    if is_darcy(loss_params):
+                        f_h = darcy_loss(f_q_m3s, f_d_mm, f_L_eq, self.used_pipe_type, loss_params)
+                    else:
+                        f_h = 10.666 * (loss_params.get("C", 130.0) ** -1.852) * (f_D_m ** -4.87) * (f_q_m3s ** 1.852) * f_L_eq
                     if f_h > max_inner_loss: max_inner_loss = f_h
             self.critical_inner_loss = max_inner_loss
+            if self.template_cache is not None: self.template_cache[inner_key] = max_inner_loss
 
-        return self.total_load, self.system_total, self.person_total, self.fixture_total
+        if self.parent_id is None and is_darcy(loss_params):
+            apply_darcy_weisbach(self, loss_params)
+        # 繰り返しノードは repeat 台分を上流へ渡す (自区間は1台分で選定)
+        r = self.repeat
+        return self.total_load * r, self.system_total * r, self.person_total * r, self.fixture_total * r
 
     def calculate_cumulative_loss(self, parent_cum_loss=0.0, parent_cum_len=0.0):
         self.cum_head_loss = parent_cum_loss + self.head_loss
@@ -403,8 +449,9 @@ class PipeSection:
     def get_excel_data(self):
         data = []
         if self.id != "root":
-            section_name = f"{self.parent_name} → {self.name}"
-            c_val = self.loss_params_used.get("C", "")
+            end_name = f"{self.name} ×{self.repeat}" if self.repeat > 1 else self.name
+            section_name = f"{self.parent_name} → {end_name}"
+            c_val = "-" if is_darcy(self.loss_params_used) else self.loss_params_used.get("C", "")
             fit_val = self.loss_params_used.get("fitting", "")
             
             node_type_str = "分岐"
@@ -414,7 +461,7 @@ class PipeSection:
             row = {
                 "区間名称": section_name,
                 "始点": self.parent_name,
-                "終点": self.name,
+                "終点": end_name,
                 "種別": node_type_str,
                 "流量 (L/min)": round(self.flow_lpm, 1),
                 "管種": self.used_pipe_type,
@@ -540,15 +587,260 @@ def reset_all():
     st.session_state["branch_counter"] = 0
     st.session_state["system_counter"] = 0
     st.session_state["selected_id"] = "root"
+    st.session_state["templates"] = {}
     if "chart_image" in st.session_state: del st.session_state["chart_image"]
-    if "excel_bytes" in st.session_state: del st.session_state["excel_bytes"]
-    if "pdf_bytes" in st.session_state: del st.session_state["pdf_bytes"]
+    if "excel_job" in st.session_state: del st.session_state["excel_job"]
+    if "pdf_job" in st.session_state: del st.session_state["pdf_job"]
 
 def set_parent(node_id):
     st.session_state["selected_id"] = node_id
 
+def select_from_viewer():
+    node_id = selected_node_id("diagram_viewer")
+    if node_id: set_parent(node_id)
+
+def turn_page(key, step):
+    st.session_state[key] = st.session_state.get(key, 0) + step
+
+def reset_page(key):
+    st.session_state[key] = 0
+
+def show_pager(key, total, page_size=PAGE_SIZE):
+    """前へ / 次へ のページ送り。表示する範囲 (開始, 終了) を返す"""
+    start, end, page, pages = page_bounds(total, st.session_state.get(key, 0), page_size)
+    st.session_state[key] = page
+    if pages > 1:
+        pg_col1, pg_col2, pg_col3 = st.columns([0.25, 0.5, 0.25])
+        pg_col1.button("◀", key=f"{key}_prev", on_click=turn_page, args=(key, -1), disabled=page == 0, width="stretch")
+        pg_col2.caption(f"{start + 1}–{end} / {total} 件")
+        pg_col3.button("▶", key=f"{key}_next", on_click=turn_page, args=(key, 1), disabled=page >= pages - 1, width="stretch")
+    return start, end
+
+def make_template_from_node(node_id):
+    node = next((p for p in st.session_state["pipes"] if p["id"] == node_id), None)
+    if not node or node["type"] != "system": return
+    templates = st.session_state["templates"]
+    tid = new_template_id(templates)
+    templates[tid] = make_template(node)
+    node["template"] = tid
+    link_templates([node], templates)
+
+def detach_template_node(node_id):
+    node = next((p for p in st.session_state["pipes"] if p["id"] == node_id), None)
+    if node: detach_template(node, st.session_state["templates"])
+
+def add_template_node(template_id):
+    tpl = st.session_state["templates"][template_id]
+    add_node("system", {"fixtures": tpl["fixtures"], "dw": tpl["dwelling_count"], "person": tpl["person_count"], "name": tpl["name"]})
+    new_node = st.session_state["pipes"][-1]
+    new_node["template"] = template_id
+    link_templates([new_node], st.session_state["templates"])
+
+def add_riser_bulk():
+    # 立管と各階の系統をまとめて生成し、pipes へは1回だけ追加する
+    pname = st.session_state["riser_preset"]
+    pdata = st.session_state["custom_presets"].get(pname)
+    if not pdata: return
+    templates = st.session_state["templates"]
+    template_id = None
+    if st.session_state["riser_use_template"]:
+        template_id = new_template_id(templates)
+        templates[template_id] = {"name": pname, "fixtures": dict(pdata["fixtures"]), "dwelling_count": pdata.get("dw", 1),
+                                  "person_count": pdata.get("person", 1), "inner_pipe_length": 2.0}
+    new_nodes, b_count, s_count, top_id = build_riser(
+        st.session_state["selected_id"], int(st.session_state["riser_floors"]), int(st.session_state["riser_units"]),
+        pname, pdata, st.session_state["branch_counter"], st.session_state["system_counter"],
+        start_floor=int(st.session_state["riser_start_floor"]),
+        first_length=st.session_state["riser_first_length"], floor_length=st.session_state["riser_floor_height"],
+        unit_length=st.session_state["riser_unit_length"],
+        base_static_head=st.session_state["riser_base_head"], floor_height=st.session_state["riser_floor_height"],
+        template_id=template_id, templates=templates
+    )
+    st.session_state["pipes"].extend(new_nodes)
+    st.session_state["branch_counter"] = b_count
+    st.session_state["system_counter"] = s_count
+    st.session_state["selected_id"] = top_id
+
+def apply_optimized_sizes(changes):
+    by_id = {p["id"]: p for p in st.session_state["pipes"]}
+    for c in changes:
+        if c["id"] in by_id: by_id[c["id"]]["manual_size"] = c["size"]
+    del st.session_state["sizing_result"]
+
+def add_loop_link(node_id):
+    node = next((p for p in st.session_state["pipes"] if p["id"] == node_id), None)
+    if not node: return
+    size = st.session_state["loop_link_size"]
+    node.setdefault("loop_links", []).append({
+        "to": st.session_state["loop_link_to"], "length": st.session_state["loop_link_length"],
+        "size": None if size.startswith("自動") else size,
+    })
+
+def remove_loop_link(node_id, link_index):
+    node = next((p for p in st.session_state["pipes"] if p["id"] == node_id), None)
+    if node and link_index < len(node.get("loop_links") or []):
+        del node["loop_links"][link_index]
+        if not node["loop_links"]: del node["loop_links"]
+
+def restore_counters(pipes):
+    max_b, max_s = 0, 0
+    for p in pipes:
+        try:
+            num = int(p["id"].split("_")[-1])
+            if p["type"] == "branch" and num > max_b: max_b = num
+            if p["type"] == "system" and num > max_s: max_s = num
+        except: pass
+    st.session_state["branch_counter"] = max_b + 1
+    st.session_state["system_counter"] = max_s + 1
+
+def import_edge_list_file():
+    uploaded = st.session_state.get("edge_list_file")
+    if uploaded is None: return
+    try:
+        pipes, report = import_edge_list(uploaded, uploaded.name)
+    except ValueError as e:
+        st.session_state["import_message"] = ("error", f"取込エラー:\n{e}")
+        return
+    st.session_state["pipes"] = pipes
+    st.session_state["templates"] = {}
+    restore_counters(pipes)
+    st.session_state["selected_id"] = "root"
+    for key in ("chart_image", "excel_job", "pdf_job"):
+        if key in st.session_state: del st.session_state[key]
+    c = report["counts"]
+    msg = f"取込完了: {report['rows']} 区間 (分岐 {c['branch']} / 系統 {c['system']} / 器具 {c['fixture']})"
+    if report["unmapped_columns"]:
+        msg += f"\n未対応の列: {', '.join(report['unmapped_columns'])}"
+    st.session_state["import_message"] = ("success", msg)
+
+def apply_stored_settings(settings, is_fv):
+    """保存時の設計条件 (管種・許容流速・人数係数・損失計算) を入力欄へ戻す"""
+    st.session_state["toilet_type"] = "洗浄弁式" if is_fv else "ロータンク式"
+    if settings.get("pipe_type") in PIPE_DATABASES: st.session_state["pipe_type_selection"] = settings["pipe_type"]
+    if settings.get("max_velocity") is not None: st.session_state["max_velocity_setting"] = float(settings["max_velocity"])
+    for name, value in (settings.get("person_calc_params") or {}).items():
+        if f"person_{name}" in SETTING_DEFAULTS: st.session_state[f"person_{name}"] = float(value)
+    loss = settings.get("loss_params") or {}
+    if loss:
+        st.session_state["loss_model"] = LOSS_MODELS[1] if is_darcy(loss) else LOSS_MODELS[0]
+        for name, key in (("C", "hw_c_value"), ("fitting", "fitting_ratio"), ("temperature", "water_temperature"),
+                          ("roughness", "roughness_setting")):
+            if loss.get(name) is not None: st.session_state[key] = float(loss[name])
+
+def open_db_project():
+    name = st.session_state.get("db_project_choice")
+    if not name: return
+    try:
+        with ProjectStore(st.session_state["db_path"]) as store:
+            project = store.load(name)
+    except (sqlite3.Error, ValueError) as e:
+        st.session_state["db_message"] = ("error", f"読込エラー: {e}")
+        return
+    st.session_state["pipes"] = project["pipes"]
+    st.session_state["templates"] = project["templates"]
+    restore_counters(project["pipes"])
+    st.session_state["selected_id"] = "root"
+    st.session_state["db_project_name"] = name
+    if project["building_type"] in BUILDING_TYPES: st.session_state["building_type_selection"] = project["building_type"]
+    apply_stored_settings(project["settings"], project["is_fv"])
+    for key in ("chart_image", "excel_job", "pdf_job"):
+        if key in st.session_state: del st.session_state[key]
+    note = "、設計条件は保存時の値に戻しました" if project["settings"] else ""
+    st.session_state["db_message"] = ("success", f"「{name}」を開きました ({len(project['pipes'])} ノード{note})")
+
+def request_db_save():
+    # 計算結果も保存するので、実際の書き込みは計算の後で行う
+    if not st.session_state.get("db_project_name", "").strip():
+        st.session_state["db_message"] = ("error", "保存名を入力してください")
+        return
+    st.session_state["db_save_pending"] = True
+
+@st.cache_resource
+def get_job_queue():
+    # 作成結果はセッションの外 (プロセス内で共有) に置き、同じ内容のジョブは使い回す
+    return JobQueue()
+
+EXPORT_JOBS = {
+    "excel_job": ("💾 Excel計算書をダウンロード", "water_calc.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "excel_download"),
+    "pdf_job": ("💾 系統図PDFを保存", "diagram.pdf", "application/pdf", "pdf_download"),
+}
+
+def show_export_jobs():
+    jobs = get_job_queue()
+    for col, (state_key, (label, file_name, mime, key)) in zip(st.columns(2), EXPORT_JOBS.items()):
+        job_id = st.session_state.get(state_key)
+        if not job_id: continue
+        job = jobs.get(job_id)
+        with col:
+            if job is None:
+                st.caption("作成結果の保存期間が過ぎました。もう一度作成してください")
+            elif job.pending:
+                st.caption(f"⏳ {job.label} ({job.elapsed:.0f} 秒)")
+            elif job.status == DONE:
+                st.download_button(label, job.result, file_name, mime, key=key, width="stretch", on_click="ignore")
+            else:
+                st.error(f"作成エラー: {job.error}")
+
+HISTORY_COUNTERS = ("branch_counter", "system_counter")
+
+def _apply_history(result, label):
+    if result is None: return
+    pipes, templates, counters, changed = result
+    st.session_state["pipes"] = pipes
+    if templates is not None: st.session_state["templates"] = templates
+    # 履歴からは複製が戻るので、テンプレート参照ノードの共有 (fixtures など) を張り直す
+    link_templates(pipes, st.session_state["templates"])
+    if counters: st.session_state.update(counters)
+    if st.session_state["selected_id"] not in {p["id"] for p in pipes}: st.session_state["selected_id"] = "root"
+    forget_node_widgets(changed)
+    for key in ("chart_image", "excel_job", "pdf_job"):
+        if key in st.session_state: del st.session_state[key]
+    st.toast(f"{label} ({len(changed)} 区間)")
+
+def forget_node_widgets(node_ids):
+    # 入力欄 (キーにノード ID を含むもの) を保存値から作り直させる
+    for key in [k for k in st.session_state if isinstance(k, str) and any(f"_{nid}" in k for nid in node_ids)]:
+        del st.session_state[key]
+
+def apply_editor_edits(editor_key, fields):
+    """データエディタの変更内容 (編集されたセルだけ) を pipes に反映し、変わったノード ID を返す"""
+    state = st.session_state.get(editor_key)
+    if not state or not state.get("edited_rows"): return set()
+    pipes = st.session_state["pipes"]
+    dirty = apply_edits(pipes, {p["id"]: i for i, p in enumerate(pipes)}, st.session_state.get(f"{editor_key}_ids", []),
+                        state["edited_rows"], fields)
+    del st.session_state[editor_key]   # 反映済みの変更は捨てる (表は新しい値で作り直す)
+    forget_node_widgets(dirty)
+    st.session_state["dirty_ids"] = st.session_state.get("dirty_ids", set()) | dirty
+    return dirty
+
+def apply_batch_edits():
+    dirty = apply_editor_edits("batch_editor", BATCH_FIELDS)
+    st.toast(f"パラメータを更新しました ({len(dirty)} 区間)")
+
+def undo_edit():
+    _apply_history(st.session_state["history"].undo(st.session_state["pipes"]), "元に戻しました")
+
+def redo_edit():
+    _apply_history(st.session_state["history"].redo(st.session_state["pipes"]), "やり直しました")
+
+def load_pump_catalog_file():
+    uploaded = st.session_state.get("pump_catalog_file")
+    if uploaded is None:
+        st.session_state.pop("pump_catalog", None)
+        return
+    try:
+        st.session_state["pump_catalog"] = load_pump_catalog(uploaded, uploaded.name)
+        st.session_state["pump_catalog_message"] = ("success", f"カタログ読込: {len(st.session_state['pump_catalog'])} 機種")
+    except ValueError as e:
+        st.session_state.pop("pump_catalog", None)
+        st.session_state["pump_catalog_message"] = ("error", f"カタログ読込エラー:\n{e}")
+
 # --- 4. グラフ描画関数 ---
 def get_flow_curve_image(current_lu, current_flow, is_fv):
+    # matplotlib は線図作成時にのみ読み込む (起動時間短縮)
+    import matplotlib.pyplot as plt
+    plt.rcParams['font.family'] = 'Meiryo'
     x_vals = []
     v = 10
     while v <= 4000:
@@ -608,6 +900,7 @@ def get_display_size(size_a, pipe_type):
 
 # --- 5. UI ---
 st.set_page_config(layout="wide", page_title="給水管計算ツール Final v59")
+diag = RunTimer()
 
 if "pipes" not in st.session_state:
     st.session_state["pipes"] = [{"id": "root", "name": "ポンプ(始点)", "type": "branch", "parent": None, "fixtures": {}, "manual_size": None, "dwelling_count": 0, "person_count": 0, "specific_pipe_type": None, "length": 0.0, "is_fixed_flow": False, "fixed_flow_val": 0.0, "is_manual_critical": False, "static_head": 0.0, "required_pressure": 0.0, "equivalent_length": 0.0, "inner_pipe_length": 2.0, "fixture_type": None}]
@@ -616,106 +909,167 @@ if "system_counter" not in st.session_state: st.session_state["system_counter"]
 if "selected_id" not in st.session_state: st.session_state["selected_id"] = "root"
 if "input_mode" not in st.session_state: st.session_state["input_mode"] = "public"
 if "custom_presets" not in st.session_state: st.session_state["custom_presets"] = PRESETS.copy()
+if "templates" not in st.session_state: st.session_state["templates"] = {}
+if "history" not in st.session_state: st.session_state["history"] = History()
+for key, value in SETTING_DEFAULTS.items():
+    if key not in st.session_state: st.session_state[key] = value
+
+# 前回の実行以降の編集 (コールバック・データエディタ) を履歴に積む
+with diag.stage("編集履歴"):
+    st.session_state["history"].record(st.session_state["pipes"], st.session_state["templates"],
+                                       {k: st.session_state[k] for k in HISTORY_COUNTERS})
 
 with st.sidebar:
     st.header("📂 ファイル操作")
-    current_json = json.dumps(st.session_state["pipes"], ensure_ascii=False, indent=2)
+    history = st.session_state["history"]
+    undo_col, redo_col = st.columns(2)
+    undo_col.button("↶ 元に戻す", on_click=undo_edit, disabled=not history.can_undo(), width="stretch",
+                    help=history.describe(history.undo_steps[-1]) if history.can_undo() else None)
+    redo_col.button("↷ やり直す", on_click=redo_edit, disabled=not history.can_redo(), width="stretch",
+                    help=history.describe(history.redo_steps[-1]) if history.can_redo() else None)
+    with diag.stage("JSON保存データ"):
+        current_json = json.dumps(pack_project(st.session_state["pipes"], st.session_state["templates"]), ensure_ascii=False, indent=2)
     st.download_button("💾 現在の構成を保存 (JSON)", current_json, "pipe_config.json", "application/json", key="json_download")
     uploaded_file = st.file_uploader("📂 保存データを読み込む", type=["json"])
     if uploaded_file is not None:
         try:
-            loaded_data = json.load(uploaded_file)
+            loaded_data, loaded_templates = unpack_project(json.load(uploaded_file))
             st.session_state["pipes"] = loaded_data
-            max_b, max_s = 0, 0
-            for p in loaded_data:
-                try:
-                    num = int(p["id"].split("_")[-1])
-                    if p["type"] == "branch" and num > max_b: max_b = num
-                    if p["type"] == "system" and num > max_s: max_s = num
-                except: pass
-            st.session_state["branch_counter"] = max_b + 1
-            st.session_state["system_counter"] = max_s + 1
+            st.session_state["templates"] = loaded_templates
+            restore_counters(loaded_data)
             st.session_state["selected_id"] = "root"
             st.success("読込完了！")
             st.rerun()
         except: st.error("読込エラー")
+    st.file_uploader("📐 CAD拾い出し表を取り込む (CSV/XLSX)", type=["csv", "xlsx"], key="edge_list_file", on_change=import_edge_list_file,
+                     help="列: 区間ID, 親ID, 配管長, 静水頭, 器具名の列 (個数)。親IDが空欄の区間はポンプに接続します")
+    if "import_message" in st.session_state:
+        kind, msg = st.session_state["import_message"]
+        if kind == "error": st.error(msg)
+        else: st.success(msg)
+
+    with st.expander("🗄️ プロジェクトDB"):
+        if "db_path" not in st.session_state: st.session_state["db_path"] = DEFAULT_DB_PATH
+        st.text_input("DBファイル (SQLite)", key="db_path")
+        db_names = []
+        if os.path.exists(st.session_state["db_path"]):
+            try:
+                with ProjectStore(st.session_state["db_path"]) as store: db_names = store.names()
+            except sqlite3.Error as e: st.error(f"DBを開けません: {e}")
+        db_col1, db_col2 = st.columns([0.7, 0.3])
+        db_col1.selectbox("プロジェクト", db_names, key="db_project_choice", label_visibility="collapsed",
+                          placeholder="保存済みプロジェクトなし")
+        db_col2.button("開く", on_click=open_db_project, disabled=not db_names, width="stretch")
+        st.text_input("保存名", key="db_project_name")
+        st.button("💾 DBに保存 (計算結果を含む)", on_click=request_db_save, width="stretch")
+        if "db_message" in st.session_state:
+            kind, msg = st.session_state.pop("db_message")
+            if kind == "error": st.error(msg)
+            else: st.success(msg)
+        if db_names and st.toggle("全プロジェクト横断検索", key="show_db_query"):
+            q_col1, q_col2 = st.columns(2)
+            q_velocity = q_col1.number_input("流速がこれを超える区間 (m/s)", value=2.0, step=0.1, format="%.1f", key="db_query_velocity")
+            q_root = q_col2.text_input("ルート口径 (前方一致)", key="db_query_root_size", placeholder="例: 規格外")
+            with ProjectStore(st.session_state["db_path"]) as store:
+                if q_root.strip():
+                    st.dataframe(store.find_projects(q_root.strip(), prefix=True), hide_index=True)
+                st.dataframe(store.find_sections(q_velocity, limit=500), hide_index=True, height=240)
 
     st.divider()
     st.header("⚙️ 設計条件")
-    building_type = st.selectbox("建物の用途", ["一般・事務所 (負荷単位法)", "集合住宅 (BL基準)", "集合住宅 (人数基準)", "一戸建て (総水栓数法)"], key="building_type_selection")
+    building_type = st.selectbox("建物の用途", BUILDING_TYPES, key="building_type_selection")
     person_calc_params = {}
     is_fv = False
     
     if "一般" in building_type:
-        toilet_type = st.radio("大便器方式", ["洗浄弁式", "ロータンク式"])
+        toilet_type = st.radio("大便器方式", ["洗浄弁式", "ロータンク式"], key="toilet_type")
         is_fv = (toilet_type == "洗浄弁式")
     elif "人数基準" in building_type:
         st.caption("👥 人数計算の係数設定 (Q = C × P^k)")
         col1, col2 = st.columns(2)
-        c1 = col1.number_input("係数 C1", value=26.0, step=0.1, format="%.1f")
-        k1 = col2.number_input("指数 k1", value=0.36, step=0.01, format="%.2f")
+        c1 = col1.number_input("係数 C1", step=0.1, format="%.1f", key="person_C1")
+        k1 = col2.number_input("指数 k1", step=0.01, format="%.2f", key="person_k1")
         col3, col4 = st.columns(2)
-        c2 = col3.number_input("係数 C2", value=13.0, step=0.1, format="%.1f")
-        k2 = col4.number_input("指数 k2", value=0.56, step=0.01, format="%.2f")
+        c2 = col3.number_input("係数 C2", step=0.1, format="%.1f", key="person_C2")
+        k2 = col4.number_input("指数 k2", step=0.01, format="%.2f", key="person_k2")
         person_calc_params = {"C1": c1, "k1": k1, "C2": c2, "k2": k2}
     else:
         st.caption("▼ グラフ表示用設定")
-        toilet_type = st.radio("大便器方式 (参考)", ["洗浄弁式", "ロータンク式"])
+        toilet_type = st.radio("大便器方式 (参考)", ["洗浄弁式", "ロータンク式"], key="toilet_type")
         is_fv = (toilet_type == "洗浄弁式")
 
     st.divider()
-    selected_pipe_type = st.selectbox("基本の管種", list(PIPE_DATABASES.keys()))
+    selected_pipe_type = st.selectbox("基本の管種", list(PIPE_DATABASES.keys()), key="pipe_type_selection")
     
     st.markdown("#### 🎨 図面表示設定")
     graph_direction = st.radio("図面の向き", ["横書き (左→右)", "縦書き (上→下)", "縦書き (下→上)"], horizontal=True)
     rankdir = "LR" if "左→右" in graph_direction else ("TB" if "上→下" in graph_direction else "BT")
     color_mode = st.selectbox("色分けモード", ["なし (標準)", "管種別", "流速別"], index=0)
     show_fixtures_mode = st.radio("末端器具の表示", ["なし", "すべて", "最遠ルート末端のみ"])
+    use_viewer = st.toggle("軽量ビューア (大規模向け: 表示範囲のみ描画)", key="use_diagram_viewer",
+                           value=len(st.session_state["pipes"]) > VIEWER_NODE_THRESHOLD,
+                           help="ドラッグで移動・ホイールで拡大縮小、クリックで選択。末端器具と図中の計算式は表示しません")
 
     st.divider()
     show_pipe_length = st.checkbox("図面に管長を表示", value=False)
     show_velocity = st.checkbox("図面に流速を表示", value=False)
     show_head_loss = st.checkbox("図面に損失水頭を表示", value=False)
     show_calc_formula = st.checkbox("図面に計算式を表示", value=False)
-    max_vel_setting = st.number_input("許容流速 (m/s)", value=2.0, step=0.1, format="%.1f")
+    max_vel_setting = st.number_input("許容流速 (m/s)", step=0.1, format="%.1f", key="max_velocity_setting")
     
     with st.expander("🌊 摩擦損失計算の設定"):
-        st.caption("ヘーゼン・ウィリアムス式 (H = 10.666 * C^-1.85 * D^-4.87 * Q^1.85 * L)")
-        c_val_setting = st.number_input("流速係数 C", value=130.0, step=1.0)
-        fitting_ratio = st.number_input("継手類による割増率", value=1.2, step=0.1, format="%.1f")
+        loss_model = st.radio("計算式", LOSS_MODELS, horizontal=True, key="loss_model")
+        if loss_model == "ヘーゼン・ウィリアムス":
+            st.caption("ヘーゼン・ウィリアムス式 (H = 10.666 * C^-1.85 * D^-4.87 * Q^1.85 * L)")
+            c_val_setting = st.number_input("流速係数 C", step=1.0, key="hw_c_value")
+        else:
+            st.caption("ダルシー・ワイスバッハ式 (H = f * L/D * v²/2g、f はコールブルック式)")
+            c_val_setting = 130.0
+            water_temp = st.number_input("水温 (℃)", step=5.0, format="%.0f", key="water_temperature")
+            roughness_setting = st.number_input("管内面粗度 ε (mm、0 = 管種ごとの標準値)", min_value=0.0, step=0.01, format="%.4f", key="roughness_setting")
+        fitting_ratio = st.number_input("継手類による割増率", step=0.1, format="%.1f", key="fitting_ratio")
         loss_params = {"C": c_val_setting, "fitting": fitting_ratio}
+        if loss_model == "ダルシー・ワイスバッハ":
+            loss_params.update(model=DARCY_WEISBACH, temperature=water_temp, roughness=roughness_setting)
 
 col_ctrl, col_edit, col_view = st.columns([0.8, 1.2, 2.5])
 
+# 接続先の検索・配下一覧用の索引 (ボタンは1ページ分だけ作る)
+with diag.stage("ノード索引"):
+    node_index = NodeIndex(st.session_state["pipes"])
+
 with col_ctrl:
     st.subheader("1. 構成作成")
-    current_parent = next((p for p in st.session_state["pipes"] if p["id"] == st.session_state["selected_id"]), None)
+    current_parent = node_index.get(st.session_state["selected_id"])
     if current_parent:
-        icon = '🔵' if current_parent['type'] == 'branch' else ('🚰' if current_parent['type'] == 'fixture' else '🏠')
-        st.info(f"現在の接続先:\n\n**{icon} {current_parent['name']}**")
+        st.info(f"現在の接続先:\n\n**{node_index.label(current_parent['id'])}**")
+        # パンくず (起点からの経路。深い場合は近い祖先だけ)
+        crumbs = node_index.path(current_parent["id"])[:-1]
+        if len(crumbs) > BREADCRUMB_DEPTH:
+            st.caption(f"… ({len(crumbs) - BREADCRUMB_DEPTH} 階層省略)")
+            crumbs = crumbs[-BREADCRUMB_DEPTH:]
+        for depth, crumb_id in enumerate(crumbs):
+            st.button(f"{'　' * depth}↳ {node_index.label(crumb_id)}", key=f"crumb_{depth}", type="tertiary",
+                      on_click=set_parent, args=(crumb_id,))
     else:
         st.session_state["selected_id"] = "root"
         st.warning("接続先を選択してください")
 
-    sel_col1, sel_col2 = st.columns(2)
-    with sel_col1:
-        st.caption("🔵 分岐点")
-        branches = [p for p in st.session_state["pipes"] if p["type"] == "branch"]
-        for p in branches:
-            is_active = (p["id"] == st.session_state["selected_id"])
-            btn_type = "primary" if is_active else "secondary"
-            if st.button(f"{p['name']}", key=f"sel_{p['id']}", type=btn_type, width="stretch"):
-                set_parent(p["id"])
-                st.rerun()
-    with sel_col2:
-        st.caption("🏠 系統・末端")
-        systems = [p for p in st.session_state["pipes"] if p["type"] == "system"]
-        for p in systems:
-            is_active = (p["id"] == st.session_state["selected_id"])
-            btn_type = "primary" if is_active else "secondary"
-            if st.button(f"{p['name']}", key=f"sel_{p['id']}", type=btn_type, width="stretch"):
-                set_parent(p["id"])
-                st.rerun()
+    st.text_input("🔍 接続先を検索 (名称・IDの前方一致)", key="node_search", placeholder="例: 分岐-3, 3F",
+                  on_change=reset_page, args=("node_search_page",))
+    search_type = st.radio("種別", ["すべて", "🔵 分岐点", "🏠 系統"], horizontal=True, key="node_search_type",
+                           label_visibility="collapsed", on_change=reset_page, args=("node_search_page",))
+    search_types = {"すべて": ("branch", "system"), "🔵 分岐点": ("branch",), "🏠 系統": ("system",)}[search_type]
+    with diag.stage("接続先の検索"):
+        matches = node_index.search(st.session_state.get("node_search", ""), search_types)
+    if matches:
+        start, end = show_pager("node_search_page", len(matches))
+        for node_id in matches[start:end]:
+            btn_type = "primary" if node_id == st.session_state["selected_id"] else "secondary"
+            st.button(node_index.label(node_id), key=f"sel_{node_id}", type=btn_type, width="stretch",
+                      on_click=set_parent, args=(node_id,))
+    else:
+        st.caption("該当するノードはありません")
 
     st.write("▼ 追加ボタン")
     btn_col1, btn_col2 = st.columns(2)
@@ -735,6 +1089,24 @@ with col_ctrl:
             if st.button(f"＋ {pname}", width="stretch"):
                 add_node("system", pass_data)
                 st.rerun()
+        for tid, tpl in st.session_state["templates"].items():
+            st.button(f"＋ {tpl['name']} (テンプレート)", key=f"add_tpl_{tid}", width="stretch", on_click=add_template_node, args=(tid,))
+
+    with st.expander("🏢 立管を一括生成"):
+        st.caption("現在の接続先から、各階の分岐と系統をまとめて追加します")
+        st.selectbox("各階の系統 (プリセット)", list(st.session_state["custom_presets"].keys()), key="riser_preset")
+        r_col1, r_col2 = st.columns(2)
+        with r_col1:
+            st.number_input("階数", min_value=1, max_value=200, value=10, step=1, key="riser_floors")
+            st.number_input("開始階", min_value=-5, max_value=200, value=1, step=1, key="riser_start_floor")
+            st.number_input("最初の立管長 (m)", min_value=0.0, value=5.0, step=0.5, key="riser_first_length")
+            st.number_input("最下階の高さ (m)", value=0.0, step=0.5, key="riser_base_head", help="最下階系統の静水頭 (ポンプ基準)")
+        with r_col2:
+            st.number_input("1階あたり系統数", min_value=1, max_value=100, value=4, step=1, key="riser_units")
+            st.number_input("階高 (m)", min_value=0.0, value=3.0, step=0.1, key="riser_floor_height", help="各階の立管長と静水頭の増分に使用")
+            st.number_input("系統の配管長 (m)", min_value=0.0, value=2.0, step=0.5, key="riser_unit_length")
+            st.checkbox("テンプレートで共有", value=True, key="riser_use_template", help="全系統を1つのテンプレート参照にします (保存ファイルが小さくなります)")
+        st.button("＋ 立管を生成", width="stretch", type="primary", on_click=add_riser_bulk)
 
     st.markdown("---")
     st.button("🔢 番号の自動修正", on_click=renumber_nodes)
@@ -742,46 +1114,79 @@ with col_ctrl:
 
 # --- 計算ロジック実行 ---
 # ノードマップ構築
-node_map = {
-    p["id"]: PipeSection(
-        p["id"], p["name"], p["type"], p["fixtures"], 
-        p.get("manual_size"), p.get("dwelling_count", 1), 
-        p.get("person_count", 0), p.get("specific_pipe_type"),
-        p.get("length", 2.0),
-        p.get("is_fixed_flow", False), p.get("fixed_flow_val", 0.0),
-        p.get("is_manual_critical", False),
-        p.get("static_head", 0.0), p.get("required_pressure", 0.0),
-        p.get("equivalent_length", 0.0),
-        p.get("inner_pipe_length", 2.0),
-        p.get("fixture_type", None)
-    ) for p in st.session_state["pipes"]
-}
-root_node = None
-for p in st.session_state["pipes"]:
-    node = node_map[p["id"]]
-    if p["parent"]:
-        parent = node_map.get(p["parent"])
-        if parent: parent.add_child(node)
-    else:
-        root_node = node
+with diag.stage("ノードマップ構築"):
+    template_caches = {tid: {} for tid in st.session_state["templates"]}
+    node_map = {
+        p["id"]: PipeSection(
+            p["id"], p["name"], p["type"], p["fixtures"], 
+            p.get("manual_size"), p.get("dwelling_count", 1), 
+            p.get("person_count", 0), p.get("specific_pipe_type"),
+            p.get("length", 2.0),
+            p.get("is_fixed_flow", False), p.get("fixed_flow_val", 0.0),
+            p.get("is_manual_critical", False),
+            p.get("static_head", 0.0), p.get("required_pressure", 0.0),
+            p.get("equivalent_length", 0.0),
+            p.get("inner_pipe_length", 2.0),
+            p.get("fixture_type", None),
+            repeat_count(p), p.get("template"), template_caches.get(p.get("template"))
+        ) for p in st.session_state["pipes"]
+    }
+    load_table = LoadTable.from_pipes(st.session_state["pipes"])
+    root_node = None
+    for row, p in enumerate(st.session_state["pipes"]):
+        node = node_map[p["id"]]
+        node.load_table, node.row = load_table, row
+        if p["parent"]:
+            parent = node_map.get(p["parent"])
+            if parent: parent.add_child(node)
+        else:
+            root_node = node
 
 # 計算実行
 current_flow = 0
 current_load = 0
 critical_node = None
 sel_node = None
+loop_result = None
 if root_node: 
-    root_node.calculate(PIPE_DATABASES, selected_pipe_type, max_vel_setting, building_type, is_fv, person_calc_params, loss_params)
-    root_node.calculate_cumulative_loss()
-    critical_node = root_node.find_critical_node()
+    with diag.stage("計算 (calculate)"):
+        root_node.calculate(PIPE_DATABASES, selected_pipe_type, max_vel_setting, building_type, is_fv, person_calc_params, loss_params)
+        root_node.calculate_cumulative_loss()
+    if has_loops(st.session_state["pipes"]):
+        with diag.stage("ループ網計算"):
+            loop_result = solve_network(root_node, node_map, st.session_state["pipes"], PIPE_DATABASES, loss_params, selected_pipe_type,
+                                        max_velocity=max_vel_setting)
+    with diag.stage("計算 (calculate)"):
+        critical_node = root_node.find_critical_node()
+    if st.session_state.pop("db_save_pending", False):
+        db_name = st.session_state["db_project_name"].strip()
+        try:
+            with diag.stage("プロジェクトDB保存"), ProjectStore(st.session_state["db_path"]) as store:
+                counts = store.save(db_name, st.session_state["pipes"], st.session_state["templates"], building_type, is_fv,
+                                    {"pipe_type": selected_pipe_type, "max_velocity": max_vel_setting,
+                                     "person_calc_params": person_calc_params, "loss_params": loss_params})
+                result_count = store.save_results(db_name, node_map.values(), root_node, critical_node,
+                                                  total_dynamic_head_of(critical_node))
+            st.toast(f"「{db_name}」を保存しました (ノード 追加 {counts['inserted']} / 更新 {counts['updated']} / "
+                     f"削除 {counts['deleted']}、計算結果 {result_count} 行)")
+        except (sqlite3.Error, ValueError) as e:
+            st.toast(f"DB保存エラー: {e}", icon="⚠️")
     if st.session_state["selected_id"] in node_map:
         sel_node = node_map[st.session_state["selected_id"]]
         current_flow = sel_node.flow_lpm
         current_load = sel_node.total_load
 
+# データエディタで書き換えた区間 (前回の実行以降)。計算は毎回全体をやり直すので計算には使わず、
+# 診断情報に件数を記録するだけ
+dirty_ids = st.session_state.pop("dirty_ids", set())
+diag.set_info("dirty_count", len(dirty_ids))
+# 両方のデータエディタの流速・損失列はこの配列から行番号で切り出す
+with diag.stage("計算結果の列配列"):
+    editor_results = result_arrays(st.session_state["pipes"], node_map)
+
 with col_edit:
     st.subheader("2. 詳細設定")
-    current_idx = next((i for i, p in enumerate(st.session_state["pipes"]) if p["id"] == st.session_state["selected_id"]), None)
+    current_idx = node_index.position.get(st.session_state["selected_id"])
     
     if current_idx is not None:
         current_data = st.session_state["pipes"][current_idx]
@@ -848,13 +1253,38 @@ with col_edit:
                     
                     if current_data["type"] == "system":
                         if "BL基準" in building_type:
-                            def update_dw(): st.session_state["pipes"][current_idx]["dwelling_count"] = st.session_state[f"dw_{current_data['id']}"]
+                            def update_dw():
+                                st.session_state["pipes"][current_idx]["dwelling_count"] = st.session_state[f"dw_{current_data['id']}"]
+                                sync_template_fields(st.session_state["pipes"][current_idx], st.session_state["templates"])
                             st.number_input("担当する戸数 (戸)", min_value=1, value=current_data.get("dwelling_count", 1), step=1, key=f"dw_{current_data['id']}", on_change=update_dw)
                         elif "人数基準" in building_type:
-                            def update_pc(): st.session_state["pipes"][current_idx]["person_count"] = st.session_state[f"pc_{current_data['id']}"]
+                            def update_pc():
+                                st.session_state["pipes"][current_idx]["person_count"] = st.session_state[f"pc_{current_data['id']}"]
+                                sync_template_fields(st.session_state["pipes"][current_idx], st.session_state["templates"])
                             current_p = current_data.get("person_count", 1)
                             st.number_input("居住人数 (人)", min_value=1, value=current_p, step=1, key=f"pc_{current_data['id']}", on_change=update_pc)
 
+                        with st.expander("🏢 基準階テンプレート (繰り返し)", expanded=bool(current_data.get("template"))):
+                            tpl_id = current_data.get("template")
+                            if tpl_id in st.session_state["templates"]:
+                                tpl = st.session_state["templates"][tpl_id]
+                                st.caption(f"テンプレート: {tpl['name']} ({tpl_id})\n器具・戸数・人数の変更は同じテンプレートの全系統に反映されます")
+                                def update_repeat():
+                                    st.session_state["pipes"][current_idx]["repeat"] = st.session_state[f"repeat_{current_data['id']}"]
+                                def update_floors():
+                                    raw = st.session_state[f"floors_{current_data['id']}"]
+                                    floors = [f.strip() for f in raw.replace("、", ",").split(",") if f.strip()]
+                                    if floors: st.session_state["pipes"][current_idx]["floors"] = floors
+                                    else: st.session_state["pipes"][current_idx].pop("floors", None)
+                                floors_txt = ", ".join(current_data.get("floors") or [])
+                                st.text_input("階名リスト (カンマ区切り・任意)", value=floors_txt, key=f"floors_{current_data['id']}", on_change=update_floors, placeholder="例: 3F, 4F, 5F")
+                                st.number_input("台数 (繰り返し数)", min_value=1, step=1, value=repeat_count(current_data), key=f"repeat_{current_data['id']}",
+                                                on_change=update_repeat, disabled=bool(current_data.get("floors")), help="階名リストがある場合はその数になります")
+                                st.button("テンプレート参照を解除", key=f"detach_tpl_{current_data['id']}", on_click=detach_template_node, args=(current_data["id"],))
+                            else:
+                                st.caption("この系統の器具・戸数・人数をテンプレートにし、同一系統を台数指定で繰り返せます")
+                                st.button("この系統をテンプレート化", key=f"make_tpl_{current_data['id']}", on_click=make_template_from_node, args=(current_data["id"],))
+
         with tab_pipe:
             if current_data["id"] != "root":
                 st.markdown("##### 📏 サイズ・管長")
@@ -904,6 +1334,15 @@ with col_edit:
                 col_h1, col_h2 = st.columns(2)
                 col_h1.number_input("ポンプからの実揚程 (m)", value=current_data.get("static_head", 0.0), step=0.1, key=f"shead_{current_data['id']}", on_change=update_head_params)
                 col_h2.number_input("末端必要圧力 (MPa)", value=current_data.get("required_pressure", 0.0), step=0.01, format="%.2f", key=f"reqp_{current_data['id']}", on_change=update_head_params)
+
+                if current_data["type"] == "system":
+                    def update_demand_pattern():
+                        choice = st.session_state[f"dpat_{current_data['id']}"]
+                        st.session_state["pipes"][current_idx]["demand_pattern"] = None if choice == "用途の標準" else choice
+                    pattern_options = ["用途の標準"] + list(DEMAND_PATTERNS)
+                    curr_pattern = current_data.get("demand_pattern")
+                    st.selectbox("時系列需要パターン", pattern_options, index=pattern_options.index(curr_pattern) if curr_pattern in pattern_options else 0,
+                                 key=f"dpat_{current_data['id']}", on_change=update_demand_pattern)
                 
                 if current_data["type"] == "system" and "一般" in building_type:
                     st.markdown("##### 🚽 簡易器具設定")
@@ -939,28 +1378,12 @@ with col_edit:
         with tab_children:
             st.markdown(f"**{current_data['name']} の配下ノード編集**")
             
-            children_indices = [i for i, p in enumerate(st.session_state["pipes"]) if p["parent"] == current_data["id"]]
+            children_indices = [node_index.position[cid] for cid in node_index.children_of(current_data["id"])]
             
             if children_indices:
-                edit_data_list = []
-                for idx in children_indices:
-                    child = st.session_state["pipes"][idx]
-                    calc_res = node_map.get(child["id"])
-                    vel_val = calc_res.velocity if calc_res else 0.0
-                    loss_val = calc_res.head_loss if calc_res else 0.0
-                    
-                    edit_data_list.append({
-                        "id": child["id"],
-                        "名称": child["name"],
-                        "種別": child["type"],
-                        "管長 (m)": child.get("length", 2.0),
-                        "器具種別": child.get("fixture_type", "") if child["type"]=="fixture" else "",
-                        "口径固定": child.get("manual_size") if child.get("manual_size") else "自動計算",
-                        "流速 (m/s)": round(vel_val, 2), 
-                        "損失 (m)": round(loss_val, 3)
-                    })
-                
-                df_children = pd.DataFrame(edit_data_list)
+                with diag.stage("配下ノード表の作成"):
+                    df_children = editor_frame(st.session_state["pipes"], children_indices, CHILD_FIELDS, editor_results)
+                    st.session_state["children_editor_ids"] = df_children["id"].tolist()
                 all_fixtures_list = [""] + [f"{f} (公)" for f in DEFAULT_PUBLIC_LIST] + [f"{f} (私)" for f in DEFAULT_PRIVATE_LIST]
                 size_list = ["自動計算"] + [d["サイズ"] for d in PIPE_DATABASES[selected_pipe_type]]
 
@@ -975,40 +1398,25 @@ with col_edit:
                     "損失 (m)": st.column_config.NumberColumn("損失 (m)", disabled=True, format="%.3f"),
                 }
 
-                edited_children = st.data_editor(
+                st.data_editor(
                     df_children,
                     column_config=child_config,
                     hide_index=True,
                     width='stretch',
                     key="children_editor",
-                    disabled=["id", "種別", "流速 (m/s)", "損失 (m)"]
+                    disabled=["id", "種別", "流速 (m/s)", "損失 (m)"],
+                    on_change=apply_editor_edits, args=("children_editor", CHILD_FIELDS)
                 )
-                
-                cols_to_check = ["id", "名称", "管長 (m)", "器具種別", "口径固定"]
-                if not df_children[cols_to_check].equals(edited_children[cols_to_check]):
-                    for index, row in edited_children.iterrows():
-                        t_id = row["id"]
-                        t_idx = next((i for i, p in enumerate(st.session_state["pipes"]) if p["id"] == t_id), None)
-                        if t_idx is not None:
-                            st.session_state["pipes"][t_idx]["name"] = row["名称"]
-                            st.session_state["pipes"][t_idx]["length"] = row["管長 (m)"]
-                            st.session_state["pipes"][t_idx]["fixture_type"] = row["器具種別"] if row["器具種別"] else None
-                            ms = row["口径固定"]
-                            st.session_state["pipes"][t_idx]["manual_size"] = None if ms == "自動計算" else ms
-                    st.rerun()
 
                 st.markdown("---")
-                for child_idx in children_indices:
+                start, end = show_pager(f"child_page_{current_data['id']}", len(children_indices))
+                for child_idx in children_indices[start:end]:
                     child = st.session_state["pipes"][child_idx]
                     c_col1, c_col2, c_col3 = st.columns([0.6, 0.2, 0.2])
-                    c_icon = "🔵" if child["type"]=="branch" else ("🚰" if child["type"]=="fixture" else "🏠")
-                    c_col1.write(f"{c_icon} {child['name']}")
-                    if c_col2.button("選択", key=f"sel_c_{child['id']}", width="stretch"):
-                        set_parent(child["id"])
-                        st.rerun()
-                    if c_col3.button("削除", key=f"del_c_{child['id']}", type="primary", width="stretch"):
-                        delete_specific_node(child["id"])
-                        st.rerun()
+                    c_col1.write(node_index.label(child["id"]))
+                    c_col2.button("選択", key=f"sel_c_{child['id']}", width="stretch", on_click=set_parent, args=(child["id"],))
+                    c_col3.button("削除", key=f"del_c_{child['id']}", type="primary", width="stretch",
+                                  on_click=delete_specific_node, args=(child["id"],))
             else:
                 st.write("(配下ノードはありません)")
             
@@ -1022,6 +1430,21 @@ with col_edit:
             if add_c3.button("＋器具", key="add_fix_here"):
                 add_node("fixture"); st.rerun()
 
+            st.markdown("---")
+            st.write("▼ 🔁 ループ接続 (連絡管)")
+            node_names = {p["id"]: p["name"] for p in st.session_state["pipes"]}
+            for li, link in enumerate(current_data.get("loop_links") or []):
+                l_col1, l_col2 = st.columns([0.8, 0.2])
+                l_col1.write(f"⇄ {node_names.get(link['to'], link['to'] + ' (削除済み)')}  L={link.get('length', 2.0)}m  {link.get('size') or '口径自動'}")
+                l_col2.button("削除", key=f"del_link_{current_data['id']}_{li}", on_click=remove_loop_link, args=(current_data["id"], li))
+            link_targets = [p["id"] for p in st.session_state["pipes"] if p["id"] != current_data["id"] and p["type"] != "fixture"]
+            if link_targets:
+                st.selectbox("接続先", link_targets, format_func=lambda i: node_names[i], key="loop_link_to")
+                lk_col1, lk_col2 = st.columns(2)
+                lk_col1.number_input("連絡管の長さ (m)", min_value=0.1, value=10.0, step=1.0, key="loop_link_length")
+                lk_col2.selectbox("口径", ["自動 (両端の大きい方)"] + [d["サイズ"] for d in PIPE_DATABASES[selected_pipe_type]], key="loop_link_size")
+                st.button("＋ 連絡管を追加", key="add_loop_link", on_click=add_loop_link, args=(current_data["id"],))
+
         st.markdown("---")
         if current_data["type"] != "root":
             st.button("このノードを削除", key="del_node_main", on_click=delete_current_node, type="primary")
@@ -1040,28 +1463,9 @@ with col_view:
 
     # --- パラメータ一括編集 (全体) ---
     with st.expander("📊 パラメータ一括編集 (全体)", expanded=False):
-        df_source = []
-        for p in st.session_state["pipes"]:
-            calc_res = node_map.get(p["id"])
-            vel_val = calc_res.velocity if calc_res else 0.0
-            loss_val = calc_res.head_loss if calc_res else 0.0
-            
-            df_source.append({
-                "id": p["id"],
-                "名称": p["name"],
-                "種別": p["type"],
-                "管長 (m)": p.get("length", 2.0),
-                "局所損失加算(m)": p.get("equivalent_length", 0.0),
-                "実揚程 (m)": p.get("static_head", 0.0) if p["type"] in ["system", "fixture"] else 0.0,
-                "末端必要圧 (MPa)": p.get("required_pressure", 0.0) if p["type"] in ["system", "fixture"] else 0.0,
-                "口径固定": p.get("manual_size") if p.get("manual_size") else "自動計算",
-                "流量固定モード": p.get("is_fixed_flow", False),
-                "固定流量 (L/min)": p.get("fixed_flow_val", 0.0),
-                "流速 (m/s)": round(vel_val, 2), 
-                "損失 (m)": round(loss_val, 3)   
-            })
-        
-        df_editor = pd.DataFrame(df_source)
+        with diag.stage("一括編集表の作成"):
+            df_editor = editor_frame(st.session_state["pipes"], range(len(st.session_state["pipes"])), BATCH_FIELDS, editor_results)
+            st.session_state["batch_editor_ids"] = df_editor["id"].tolist()
         size_list = ["自動計算"] + [d["サイズ"] for d in PIPE_DATABASES[selected_pipe_type]]
         
         column_config = {
@@ -1079,7 +1483,7 @@ with col_view:
             "損失 (m)": st.column_config.NumberColumn("損失 (m)", disabled=True, format="%.3f"),
         }
 
-        edited_df = st.data_editor(
+        st.data_editor(
             df_editor,
             column_config=column_config,
             hide_index=True,
@@ -1088,23 +1492,7 @@ with col_view:
             disabled=["id", "種別", "流速 (m/s)", "損失 (m)"]
         )
 
-        if st.button("一括変更を適用", type="primary"):
-            for index, row in edited_df.iterrows():
-                target_id = row["id"]
-                pipe_idx = next((i for i, p in enumerate(st.session_state["pipes"]) if p["id"] == target_id), None)
-                if pipe_idx is not None:
-                    st.session_state["pipes"][pipe_idx]["name"] = row["名称"]
-                    st.session_state["pipes"][pipe_idx]["length"] = row["管長 (m)"]
-                    st.session_state["pipes"][pipe_idx]["equivalent_length"] = row["局所損失加算(m)"]
-                    if st.session_state["pipes"][pipe_idx]["type"] in ["system", "fixture"]:
-                         st.session_state["pipes"][pipe_idx]["static_head"] = row["実揚程 (m)"]
-                         st.session_state["pipes"][pipe_idx]["required_pressure"] = row["末端必要圧 (MPa)"]
-                    ms = row["口径固定"]
-                    st.session_state["pipes"][pipe_idx]["manual_size"] = None if ms == "自動計算" else ms
-                    st.session_state["pipes"][pipe_idx]["is_fixed_flow"] = row["流量固定モード"]
-                    st.session_state["pipes"][pipe_idx]["fixed_flow_val"] = row["固定流量 (L/min)"]
-            st.success("パラメータを更新しました！")
-            st.rerun()
+        st.button("一括変更を適用", type="primary", on_click=apply_batch_edits)
 
     # --- 計算結果の表示 ---
     critical_path_ids = set()
@@ -1119,7 +1507,7 @@ with col_view:
         static_head = critical_node.static_head
         req_pressure_head = critical_node.required_pressure * 102.0
         inner_loss = critical_node.critical_inner_loss
-        total_dynamic_head = friction_loss + static_head + req_pressure_head + inner_loss
+        total_dynamic_head = total_dynamic_head_of(critical_node)
 
         st.success(f"🚩 最遠ルート (末端: {critical_node.name})")
         if critical_node.is_manual_critical: st.info("※手動指定された末端です")
@@ -1136,6 +1524,22 @@ with col_view:
             pump_q_m3_min = pump_q_lpm / 1000.0
             p_kw = (0.163 * pump_q_m3_min * total_dynamic_head * 1.1) / 0.55
             st.caption(f"参考: ポンプ概算軸動力 (Q={int(pump_q_lpm)}L/min, H={total_dynamic_head:.1f}m, η=0.55, α=1.1) ≒ {p_kw:.2f} kW")
+            with st.expander("🔧 ポンプ選定 (カタログ照合)"):
+                st.file_uploader("ポンプカタログ (CSV/XLSX)", type=["csv", "xlsx"], key="pump_catalog_file", on_change=load_pump_catalog_file,
+                                 help="1行 = 性能曲線上の1点。列: 型式, 流量 (L/min), 揚程 (m), 効率 (%), メーカー, 電動機 (kW)")
+                if "pump_catalog_message" in st.session_state:
+                    kind, msg = st.session_state["pump_catalog_message"]
+                    if kind == "error": st.error(msg)
+                    else: st.caption(msg)
+                catalog = st.session_state.get("pump_catalog")
+                if catalog is not None:
+                    pump_df = select_pumps(catalog, pump_q_lpm, total_dynamic_head, friction_loss + inner_loss,
+                                           exponent=2.0 if is_darcy(loss_params) else 1.852)
+                    if pump_df.empty:
+                        st.warning("設計点を満たす機種がありません")
+                    else:
+                        st.caption(f"設計点を満たす機種: {len(pump_df)} (最高効率点比 0.7〜1.2 を優先し、軸動力の小さい順)")
+                        st.dataframe(pump_df.head(50), hide_index=True)
 
         total_len = 0.0
         curr = critical_node
@@ -1145,6 +1549,100 @@ with col_view:
             else: curr = None
         st.caption(f"総配管長 (主管): {total_len:.1f} m")
 
+        if loop_result:
+            state_txt = "収束" if loop_result["converged"] else "未収束 (結果は参考値)"
+            st.info(f"🔁 ループ網計算: 連絡管 {loop_result['loops']} 本 / 網内の管 {loop_result['pipes']} 本, 反復 {loop_result['iterations']} 回で{state_txt}")
+            st.dataframe(pd.DataFrame([{
+                "連絡管": f"{l['from_name']} ⇄ {l['to_name']}", "口径": l["size"],
+                "流量 (L/min)": round(l["flow_lpm"], 1), "流速 (m/s)": l["velocity"], "損失 (m)": l["head_loss"],
+            } for l in loop_result["links"]]), hide_index=True)
+            if loop_result["over_velocity"]:
+                st.warning("ループ網の流量で許容流速を超える区間があります (口径はツリー計算の流量で選定): "
+                           + ", ".join(f"{o['name']} {o['size']} {o['velocity']} m/s" for o in loop_result["over_velocity"]))
+
+        with st.expander("💰 口径最適化 (材料費最小)"):
+            st.caption("許容流速を守りつつ、全末端の全揚程が目標以下となるよう材料費ができるだけ小さい口径を選びます "
+                       "(揚程を刻んで解く近似解で、最小コストからわずかに外れることがあります。単価は参考値)")
+            opt_budget = st.number_input("目標全揚程 (m)", min_value=0.0, value=round(total_dynamic_head, 2), step=0.5)
+            if st.button("最適化を実行", key="run_size_opt"):
+                with diag.stage("口径最適化"):
+                    st.session_state["sizing_result"] = optimize_sizes(root_node, PIPE_DATABASES, max_vel_setting, loss_params, opt_budget)
+            opt_res = st.session_state.get("sizing_result")
+            if opt_res:
+                if not opt_res["feasible"]:
+                    st.error(f"目標 {opt_res['budget']:.2f} m を満たす口径の組合せがありません (最大口径でも {opt_res['min_head']:.2f} m)")
+                else:
+                    o_c1, o_c2 = st.columns(2)
+                    o_c1.metric("材料費", f"{opt_res['cost']:,.0f} 円", delta=f"{opt_res['cost'] - opt_res['greedy_cost']:+,.0f} 円 (現在比)", delta_color="inverse")
+                    o_c2.metric("全揚程", f"{opt_res['head']:.3f} m", delta=f"{opt_res['head'] - opt_res['greedy_head']:+.3f} m (現在比)", delta_color="inverse")
+                    if opt_res["changes"]:
+                        st.dataframe(pd.DataFrame(changes_table(opt_res)), hide_index=True)
+                        st.button("✅ 最適口径を手動口径として適用", on_click=apply_optimized_sizes, args=(opt_res["changes"],))
+                    else:
+                        st.info("現在の口径が最適です")
+
+        with st.expander("📊 全末端の残存圧力 (減圧弁の検討)"):
+            pr_c1, pr_c2 = st.columns(2)
+            pr_head = pr_c1.number_input("ポンプ全揚程 (m)", min_value=0.0, value=round(total_dynamic_head, 2), step=0.5)
+            pr_max = pr_c2.number_input("給水圧力の上限 (MPa)", min_value=0.0, value=DEFAULT_MAX_PRESSURE_MPA, step=0.05, format="%.2f")
+            if st.toggle("全末端を計算して表示", key="show_residual_pressures"):
+                with diag.stage("全末端残存圧力"):
+                    pressure_df = residual_pressures(node_map.values(), pr_head, pr_max)
+                counts = summarize(pressure_df)
+                st.caption(f"末端 {len(pressure_df)} 箇所: 不足 {counts['不足']} / 過大 {counts['過大']} / 適正 {counts['適正']}")
+                if st.checkbox("不足・過大のみ表示", value=True, key="residual_problems_only"):
+                    pressure_df = pressure_df[pressure_df["判定"] != "適正"]
+                st.dataframe(pressure_df, hide_index=True)
+
+        with st.expander("📉 口径アップの効果 (全揚程の感度)"):
+            st.caption("各区間を1サイズ上げた場合の必要全揚程の変化です (他の区間は現状のまま)")
+            if st.toggle("全区間を計算して表示", key="show_upsize_sensitivity"):
+                with diag.stage("口径感度分析"):
+                    sens_df = upsize_sensitivity(root_node, PIPE_DATABASES, loss_params)
+                sens_top = st.number_input("表示件数", min_value=1, value=30, step=10, key="sensitivity_rows")
+                effective = sens_df[sens_df["全揚程の変化 (m)"] < 0]
+                st.caption(f"全揚程が下がる区間: {len(effective)} / {len(sens_df)}")
+                st.dataframe(sens_df.head(int(sens_top)), hide_index=True)
+
+        with st.expander("🎲 同時使用シミュレーション (設計流量の検証)"):
+            st.caption("器具ごとの使用確率と吐水量から各器具の使用状態を繰り返し抽選し、区間流量のパーセンタイルを設計流量と比較します")
+            usage_df = st.data_editor(
+                pd.DataFrame([{"器具": k, "使用確率": v["p"], "吐水量 (L/min)": v["flow"]} for k, v in FIXTURE_USAGE.items()]),
+                hide_index=True, disabled=["器具"], key="fixture_usage_editor")
+            sim_usage = {r["器具"]: {"p": float(r["使用確率"]), "flow": float(r["吐水量 (L/min)"])} for r in usage_df.to_dict("records")}
+            mc_c1, mc_c2, mc_c3 = st.columns(3)
+            mc_trials = mc_c1.number_input("試行回数", min_value=100, value=DEFAULT_TRIALS, step=1000)
+            mc_pcts = mc_c2.multiselect("パーセンタイル", [50.0, 90.0, 95.0, 99.0, 99.9], default=list(DEFAULT_PERCENTILES))
+            mc_workers = mc_c3.number_input("並列プロセス数", min_value=1, max_value=os.cpu_count() or 1, value=1)
+            if st.button("シミュレーションを実行", key="run_simulation", disabled=not mc_pcts):
+                with diag.stage("同時使用シミュレーション"):
+                    st.session_state["simulation_result"] = simulate(root_node, mc_trials, mc_pcts, sim_usage, workers=int(mc_workers))
+            sim_df = st.session_state.get("simulation_result")
+            if sim_df is not None:
+                st.dataframe(sim_df, hide_index=True)
+
+        with st.expander("⏱️ 時系列需要 (受水槽容量・部分負荷)"):
+            st.caption("時刻別の需要パターン (1.0 = ピーク時) で全区間の流量・流速・損失を時刻ごとに求めます (口径は設計口径のまま)")
+            pattern_df = st.data_editor(pd.DataFrame(DEMAND_PATTERNS, index=[f"{h}時" for h in range(24)]), key="demand_pattern_editor")
+            ts_c1, ts_c2 = st.columns(2)
+            ts_step = ts_c1.selectbox("時間刻み (分)", [60, 30, 15, 5, 1])
+            ts_days = ts_c2.number_input("日数", min_value=1, max_value=366, value=1)
+            if st.toggle("時系列を計算して表示", key="show_demand_profile"):
+                with diag.stage("時系列需要"):
+                    profile = evaluate_profile(
+                        root_node, loss_params, {name: pattern_df[name].tolist() for name in pattern_df.columns}, building_type,
+                        {p["id"]: p["demand_pattern"] for p in st.session_state["pipes"] if p.get("demand_pattern")}, int(ts_step), int(ts_days))
+                ts_m1, ts_m2, ts_m3, ts_m4 = st.columns(4)
+                ts_m1.metric("最大総流量", f"{profile['peak_flow_lpm']:.1f} L/min")
+                ts_m2.metric("最大必要全揚程", f"{profile['peak_head']:.2f} m")
+                ts_m3.metric("日最大使用量", f"{profile['daily_max_m3']:.1f} m³/日")
+                ts_m4.metric("時間最大使用量", f"{profile['hourly_max_m3']:.1f} m³/h")
+                series = profile["series"]
+                # 長い時系列はグラフ用に間引く
+                stride = max(1, len(series) // 5000)
+                st.line_chart(series.iloc[::stride].set_index("経過時間 (h)"))
+                st.dataframe(profile["sections"], hide_index=True)
+
     info_text = f"用途: {building_type} | 基本管種: {selected_pipe_type}"
     if "一般" in building_type: info_text += f" | 大便器: {toilet_type}"
     elif "人数基準" in building_type: info_text += f" | 式: Q=26P^0.36(≦30人), Q=13P^0.56(≧31人)"
@@ -1153,150 +1651,64 @@ with col_view:
     
     full_caption = f"{diagram_title}\n[{info_text}]"
     
-    graph = graphviz.Digraph()
-    graph.attr(rankdir=rankdir, nodesep='1.0', ranksep='1.5')
-    graph.attr('edge', fontsize='11', fontcolor='#D50000', fontname='Meiryo')
-    graph.attr('node', fontname='Meiryo')
-    graph.attr(label=full_caption, labelloc='t', fontsize='18', fontname='Meiryo')
-
-    def draw_node(n):
-        is_sel = (n.id == st.session_state["selected_id"])
-        pw = "3.0" if is_sel else "1.0"
-        sc = "red" if is_sel else "black"
-        tooltip_txt = n.calc_description if n.calc_description else n.name
-
-        if n.id == "root":
-            info_txt = f"{int(n.flow_lpm)} L/min"
-            if "BL基準" in building_type: info_txt += f"\n(計{n.system_total}戸)"
-            elif "人数基準" in building_type: info_txt += f"\n(計{n.person_total}人)"
-            elif "一戸建て" in building_type: info_txt += f"\n(器具{n.fixture_total}個)"
-            else: info_txt += f"\n({n.total_load}LU)"
-            lbl = f"{n.name}\n{info_txt}"
-            graph.node(n.id, label=lbl, shape="box", style="filled", fillcolor="#FFF9C4", color=sc, penwidth=pw, tooltip=tooltip_txt)
-
-        elif n.type == "branch":
-            info_txt = ""
-            if "BL基準" in building_type: info_txt = f"({n.system_total}戸)"
-            elif "人数基準" in building_type: info_txt = f"({n.person_total}人)"
-            elif "一戸建て" in building_type: info_txt = f"({n.fixture_total}個)"
-            else: info_txt = f"({n.total_load} LU)"
-            fill = "#E3F2FD"
-            lbl = f'''<
-            <TABLE BORDER="0" CELLBORDER="0" CELLSPACING="0" CELLPADDING="0">
-                <TR><TD><B><FONT POINT-SIZE="10">{n.name}</FONT></B></TD></TR>
-                <TR><TD><FONT POINT-SIZE="7">{info_txt}</FONT></TD></TR>
-            </TABLE>>'''
-            graph.node(n.id, label=lbl, shape="circle", style="filled", fillcolor=fill, 
-                       margin="0.01", width="0.1", height="0.1", color=sc, penwidth=pw, tooltip=tooltip_txt)
-
-        elif n.type == "system":
-            fill = "#FFF9C4" if is_sel else "#E8F5E9"
-            if "BL基準" in building_type: content_txt = f"<B>{n.dwelling_count} 戸</B>"; bottom_txt = ""
-            elif "人数基準" in building_type: content_txt = f"<B>{n.person_count} 人</B>"; bottom_txt = ""
-            else:
-                items = [f"{k}x{v}" for k,v in n.fixtures.items() if v>0]
-                formatted_items = []
-                for item in items: formatted_items.append(item)
-                content_txt = "<BR/>".join(formatted_items) if formatted_items else "(下流へ接続)"
-                total_lu_display = n.total_load
-                bottom_txt = f"計: {total_lu_display} LU" if "一般" in building_type else ""
-            
-            if n.is_manual_critical: content_txt += "<BR/><FONT COLOR='red' POINT-SIZE='10'>[最遠指定]</FONT>"
-            if n.required_pressure > 0: bottom_txt += f"<BR/>Req: {n.required_pressure}MPa"
-
-            lbl = f'''<
-            <TABLE BORDER="0" CELLBORDER="1" CELLSPACING="0" CELLPADDING="4" BGCOLOR="{fill}">
-                <TR><TD><B>🏠 {n.name}</B></TD></TR>
-                <TR><TD ALIGN="LEFT"><FONT POINT-SIZE="10">{content_txt}</FONT></TD></TR>
-                {"<TR><TD>"+bottom_txt+"</TD></TR>" if bottom_txt else ""}
-            </TABLE>>'''
-            graph.node(n.id, label=lbl, shape="plain", tooltip=tooltip_txt)
-            
-            is_show_fixtures = False
-            if show_fixtures_mode == "すべて":
-                is_show_fixtures = True
-            elif show_fixtures_mode == "最遠ルート末端のみ" and critical_node and n.id == critical_node.id:
-                is_show_fixtures = True
-
-            if is_show_fixtures and n.fixtures:
-                for f_name, qty in n.fixtures.items():
-                    if qty > 0:
-                        spec = FIXTURE_SPECS.get(f_name)
-                        size_disp = "-"
-                        if spec:
-                            size_a = spec["size_a"]
-                            size_disp = get_display_size(size_a, selected_pipe_type)
-                        
-                        for i in range(qty):
-                            f_node_id = f"{n.id}_fix_{f_name}_{i}"
-                            f_label = f"{f_name.split(' ')[0]}"
-                            graph.node(f_node_id, label=f_label, shape="oval", style="filled", fillcolor="white", fontsize="8", width="0.5", height="0.3")
-                            edge_lbl = f"{size_disp}\n{n.inner_pipe_length}m"
-                            graph.edge(n.id, f_node_id, label=edge_lbl, fontsize="8", color="gray", arrowhead="dot")
-        
-        elif n.type == "fixture":
-            fill = "#FFF9C4" if is_sel else "#F3E5F5"
-            lbl = f'''<
-            <TABLE BORDER="0" CELLBORDER="1" CELLSPACING="0" CELLPADDING="4" BGCOLOR="{fill}">
-                <TR><TD><B>🚰 {n.name}</B></TD></TR>
-                <TR><TD><FONT POINT-SIZE="9">{n.fixture_type if n.fixture_type else "未設定"}</FONT></TD></TR>
-                <TR><TD><FONT POINT-SIZE="8">{n.load_units} LU</FONT></TD></TR>
-            </TABLE>>'''
-            graph.node(n.id, label=lbl, shape="plain", tooltip=tooltip_txt)
-
-        for child in n.children:
-            manual_mark = "🔒" if child.is_manual else ""
-            pipe_info = child.size
-            if child.specific_pipe_type: pipe_info += f" ({child.specific_pipe_type})"
-            edge_label = f"{manual_mark}{pipe_info}\n{int(child.flow_lpm)} L/min"
-            
-            if show_pipe_length: edge_label += f"\nL={child.length}m"
-            if show_velocity: edge_label += f"\n({child.velocity} m/s)"
-            if show_head_loss: edge_label += f"\nΔh={child.head_loss}m"
-            if show_calc_formula and child.calc_description: edge_label += f"\n[{child.calc_description}]"
-            
-            style = "solid"
-            color = "black"
-            penwidth = "1.0"
-            fontcolor = "black"
-            
-            if color_mode == "管種別":
-                p_type = child.used_pipe_type
-                if "SGP" in p_type: color = PIPE_COLORS["SGP"]
-                elif "HIVP" in p_type: color = PIPE_COLORS["HIVP"]
-                elif "VP" in p_type: color = PIPE_COLORS["VP"]
-                elif "SU" in p_type: color = PIPE_COLORS["SU"]
-                elif "PE" in p_type: color = PIPE_COLORS["PE"]
-                fontcolor = color
-            elif color_mode == "流速別":
-                vel = child.velocity
-                if vel >= max_vel_setting: color = "#D32F2F" # 赤 (警告)
-                elif vel >= max_vel_setting * 0.7: color = "#F57C00" # オレンジ (注意)
-                else: color = "#1976D2" # 青 (安全)
-                fontcolor = color
-            
-            if n.id in critical_path_ids and child.id in critical_path_ids:
-                color = "red"
-                penwidth = "3.0"
-            
-            if child.size == "規格外" and not "SU" in str(child.used_pipe_type):
-                color = "red"; style = "dashed"; penwidth="1.0"
-            elif child.size == "規格外(過大)":
-                color = "red"; style = "dashed"; penwidth="1.0"
-            
-            graph.edge(n.id, child.id, label=edge_label, color=color, fontcolor=fontcolor, style=style, penwidth=penwidth)
-            draw_node(child)
+    diagram_options = {
+        "rankdir": rankdir, "color_mode": color_mode, "show_fixtures_mode": show_fixtures_mode,
+        "show_pipe_length": show_pipe_length, "show_velocity": show_velocity,
+        "show_head_loss": show_head_loss, "show_calc_formula": show_calc_formula,
+        "max_velocity": max_vel_setting,
+    }
 
     if root_node:
-        draw_node(root_node)
-        st.graphviz_chart(graph)
+        diagram_args = dict(caption=full_caption, critical_node=critical_node, critical_path_ids=critical_path_ids,
+                            application_path=application_path, loop_links=loop_result["links"] if loop_result else None)
+        # 配置は構成と向きが変わったときだけ dot で求め、表示切替では座標を使い回す
+        # (Graphviz の実行ファイルがない環境ではブラウザ側で描画する。軽量ビューアは配置も Python 側で求める)
+        # 実行ファイルがないときだけ以後の配置計算をやめ、dot の失敗はその回だけブラウザ側の描画に戻す
+        gv = load_graphviz(application_path)
+        layout = None
+        if st.session_state.get("server_layout", True) and not use_viewer:
+            with diag.stage("系統図配置"):
+                layout_graph = build_diagram(root_node, building_type, selected_pipe_type,
+                                             options=layout_options(diagram_options), **diagram_args)
+                try:
+                    layout, hit = LAYOUT_CACHE.get(layout_graph.source, application_path)
+                    diag.count("系統図配置", hit=hit)
+                except (gv.ExecutableNotFound, OSError):
+                    st.session_state["server_layout"] = False
+                except gv.CalledProcessError as e:
+                    st.warning(f"系統図の配置計算に失敗したため、ブラウザ側で描画します: {e}")
+        with diag.stage("系統図DOT生成"):
+            graph = build_diagram(root_node, building_type, selected_pipe_type, selected_id=st.session_state["selected_id"],
+                                  options=diagram_options, layout=layout, **diagram_args)
+        svg = None
+        if layout and not use_viewer:
+            with diag.stage("系統図表示 (配置済み描画)"):
+                try:
+                    svg = render_with_layout(graph.source, "svg", application_path).decode("utf-8")
+                except (gv.ExecutableNotFound, OSError, gv.CalledProcessError) as e:
+                    st.warning(f"配置済みの系統図を描画できないため、ブラウザ側で描画します: {e}")
+                    graph = build_diagram(root_node, building_type, selected_pipe_type, selected_id=st.session_state["selected_id"],
+                                          options=diagram_options, **diagram_args)
+        if use_viewer:
+            with diag.stage("系統図表示 (軽量ビューア)"):
+                show_viewer(viewer_data(root_node, diagram_options, critical_path_ids, st.session_state["selected_id"],
+                                        diagram_args["loop_links"]), on_select=select_from_viewer)
+        elif svg is not None:
+            st.image(svg, width="stretch")
+        else:
+            with diag.stage("系統図表示 (graphviz_chart)"):
+                st.graphviz_chart(graph)
         
         if "一般" in building_type:
             g_col1, g_col2 = st.columns([0.4, 0.6])
             with g_col1:
                 if st.button("📉 流量線図を作成・更新", width="stretch"):
-                    img_buf = get_flow_curve_image(current_load, current_flow, is_fv)
+                    with diag.stage("流量線図"):
+                        img_buf = get_flow_curve_image(current_load, current_flow, is_fv)
                     st.session_state["chart_image"] = img_buf
+                    diag.count("流量線図", hit=False)
+                elif "chart_image" in st.session_state:
+                    diag.count("流量線図", hit=True)
                 if "chart_image" in st.session_state:
                     if st.button("× 線図を閉じる", width="stretch"): del st.session_state["chart_image"]; st.rerun()
             with g_col2:
@@ -1305,66 +1717,50 @@ with col_view:
                     st.download_button(label="💾 グラフ画像を保存", data=st.session_state["chart_image"].getvalue(), file_name="flow_chart.png", mime="image/png", key="graph_download")
 
         st.markdown("---")
-        excel_bytes = None
-        if "excel_bytes" not in st.session_state: st.session_state["excel_bytes"] = None
+        jobs = get_job_queue()
         exp_col1, exp_col2 = st.columns(2)
         with exp_col1:
             if st.button("📊 Excelデータを作成・更新", width="stretch"):
                 if root_node:
-                    try:
-                        # 全データ作成
-                        excel_data = root_node.get_excel_data()
-                        df_all = pd.DataFrame(excel_data)
-                        
-                        # クリティカルパスデータ作成
-                        crit_data_list = []
-                        if critical_node:
-                            path_nodes = []
-                            curr = critical_node
-                            while curr:
-                                path_nodes.append(curr)
-                                if curr.parent_id and curr.parent_id in node_map:
-                                    curr = node_map[curr.parent_id]
-                                else:
-                                    curr = None
-                            path_nodes.reverse() # Root -> End
-                            
-                            for p in path_nodes:
-                                if p.id == "root": continue
-                                c_val = p.loss_params_used.get("C", "")
-                                fit_val = p.loss_params_used.get("fitting", "")
-                                row = {
-                                    "区間": f"{p.parent_name} -> {p.name}",
-                                    "流量 (L/min)": round(p.flow_lpm, 1),
-                                    "管種": p.used_pipe_type,
-                                    "口径": p.size,
-                                    "流速 (m/s)": p.velocity,
-                                    "流速係数": c_val,
-                                    "継手割増": fit_val,
-                                    "管長 (m)": p.length,
-                                    "加算等価長 (m)": p.equivalent_length,
-                                    "単独損失 (m)": p.head_loss,
-                                    "累計損失 (m)": round(p.cum_head_loss, 3),
-                                    "器具接続損失(m)": round(p.critical_inner_loss, 3) if p.type=="system" else 0
-                                }
-                                crit_data_list.append(row)
-                        df_crit = pd.DataFrame(crit_data_list)
-
-                        with io.BytesIO() as buffer:
-                            with pd.ExcelWriter(buffer) as writer: 
-                                df_all.to_excel(writer, index=False, sheet_name="全区間一覧")
-                                if not df_crit.empty:
-                                    df_crit.to_excel(writer, index=False, sheet_name="最遠ルート計算書")
-                            st.session_state["excel_bytes"] = buffer.getvalue()
-                    except Exception as e: st.error(f"Excel作成エラー: {e}")
-            if st.session_state["excel_bytes"]:
-                st.download_button("💾 Excel計算書をダウンロード", st.session_state["excel_bytes"], "water_calc.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", key="excel_download", width="stretch")
-        if "pdf_bytes" not in st.session_state: st.session_state["pdf_bytes"] = None
+                    with diag.stage("Excel作成 (投入)"):
+                        all_rows = root_node.get_excel_data()
+                        route_rows = critical_route_rows(critical_node, node_map)
+                        key = content_key("excel", json.dumps([all_rows, route_rows], ensure_ascii=False, default=str))
+                        job = jobs.submit("excel", key, excel_from_rows, all_rows, route_rows)
+                    st.session_state["excel_job"] = job.id
+                    diag.count("Excel", hit=job.reused > 0)
         with exp_col2:
             if st.button("📄 PDF図面を作成・更新", width="stretch", key="btn_create_pdf"):
-                try:
-                    pdf_bytes = graph.pipe(format='pdf')
-                    st.session_state["pdf_bytes"] = pdf_bytes
-                except Exception as e: st.error(f"PDF作成エラー: {e}")
-            if st.session_state["pdf_bytes"]:
-                st.download_button("💾 系統図PDFを保存", st.session_state["pdf_bytes"], "diagram.pdf", "application/pdf", key="pdf_download", width="stretch")
\ No newline at end of file
+                with diag.stage("PDF作成 (投入)"):
+                    job = jobs.submit("pdf", content_key("pdf", graph.source), render_source, graph.source, "pdf", application_path)
+                st.session_state["pdf_job"] = job.id
+                diag.count("PDF", hit=job.reused > 0)
+        # 作成中のジョブがある間だけ、この部分を1秒ごとに描き直して状態を問い合わせる
+        export_jobs = [jobs.get(st.session_state.get(k)) for k in EXPORT_JOBS]
+        st.fragment(show_export_jobs, run_every=1.0 if any(j and j.pending for j in export_jobs) else None)()
+
+# --- 診断情報 (処理時間・キャッシュ) ---
+diag.set_info("node_count", len(st.session_state["pipes"]))
+diag.set_info("building_type", building_type)
+diag_record = diag.record()
+log_run(diag_record)
+if "diag_history" not in st.session_state: st.session_state["diag_history"] = []
+if "diag_cache_totals" not in st.session_state: st.session_state["diag_cache_totals"] = {}
+st.session_state["diag_history"] = (st.session_state["diag_history"] + [diag_record])[-HISTORY_SIZE:]
+merge_cache_counters(st.session_state["diag_cache_totals"], diag_record["cache"])
+
+with st.sidebar:
+    with st.expander("🩺 診断情報 (処理時間)", expanded=False):
+        st.caption(f"ノード数: {diag_record['node_count']} | 今回の実行: {diag_record['total_ms']:.0f} ms")
+        st.dataframe(
+            pd.DataFrame([{"段階": k, "時間 (ms)": v} for k, v in diag_record["stages_ms"].items()]),
+            hide_index=True, width="stretch"
+        )
+        if st.session_state["diag_cache_totals"]:
+            st.caption("キャッシュ (セッション累計)")
+            st.dataframe(
+                pd.DataFrame([{"対象": k, "ヒット": c["hit"], "ミス": c["miss"]} for k, c in st.session_state["diag_cache_totals"].items()]),
+                hide_index=True, width="stretch"
+            )
+        st.caption(f"直近 {len(st.session_state['diag_history'])} 回の合計時間 (ms)")
+        st.line_chart([r["total_ms"] for r in st.session_state["diag_history"]], height=120)
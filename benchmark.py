@@ -0,0 +1,195 @@
+# benchmark.py
+"""計算エンジンのベンチマーク
+
+合成プロジェクト (synthetic.py) に対してパイプラインの各段階
+(ツリー構築 → calculate → 累計損失 → 最遠末端 → Excel行 → DOT生成) を計測し、
+結果を JSON で出力する。--compare で以前の結果と比較し、退行があれば終了コード 1。
+
+    python benchmark.py --sizes 100 1000 10000 --output bench.json
+    python benchmark.py --compare bench.json --threshold 1.2
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+from constants import PIPE_DATABASES
+from models import build_tree, get_route
+import synthetic
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000]
+DEFAULT_SETTINGS = {
+    "pipe_type": "SGP-VB (硬質塩化ビニルライニング鋼管)",
+    "max_velocity": 2.0,
+    "person_calc_params": {"C1": 26.0, "k1": 0.36, "C2": 13.0, "k2": 0.56},
+    "loss_params": {"C": 130.0, "fitting": 1.2},
+}
+
+# --- パイプラインの各段階 (ctx に結果を積んで次の段階へ渡す) ---
+def stage_build(ctx):
+    ctx["node_map"], ctx["root"] = build_tree(ctx["pipes"], ctx.get("templates"))
+
+def stage_calculate(ctx):
+    s = ctx["settings"]
+    ctx["root"].calculate(PIPE_DATABASES, s["pipe_type"], s["max_velocity"], ctx["building_type"],
+                          ctx["is_fv"], s["person_calc_params"], s["loss_params"])
+
+def stage_cumulative(ctx):
+    ctx["root"].calculate_cumulative_loss()
+
+def stage_critical(ctx):
+    ctx["critical"] = ctx["root"].find_critical_node()
+
+def stage_excel(ctx):
+    ctx["excel_rows"] = ctx["root"].get_excel_data()
+
+def stage_dot(ctx):
+    from diagram import build_diagram
+    route = get_route(ctx["critical"], ctx["node_map"]) if ctx.get("critical") else []
+    graph = build_diagram(ctx["root"], ctx["building_type"], ctx["settings"]["pipe_type"],
+                          critical_node=ctx.get("critical"), critical_path_ids={n.id for n in route})
+    ctx["dot_source"] = graph.source
+
+PIPELINE_STAGES = [
+    ("build", stage_build),
+    ("calculate", stage_calculate),
+    ("cumulative", stage_cumulative),
+    ("critical", stage_critical),
+    ("excel", stage_excel),
+    ("dot", stage_dot),
+]
+STAGE_NAMES = [name for name, _ in PIPELINE_STAGES]
+
+def make_context(pipes, building_type, is_fv, settings=None, templates=None):
+    merged = dict(DEFAULT_SETTINGS)
+    if settings: merged.update(settings)
+    return {"pipes": pipes, "templates": templates or {}, "building_type": building_type, "is_fv": is_fv, "settings": merged}
+
+def run_pipeline(ctx, stages=None, hook=None):
+    """選択した段階まで順に実行する (前提となる段階は自動的に含める)
+
+    hook(name, func, ctx) を渡すと各段階の実行を委ねる (計測・プロファイル用)。
+    """
+    last = max(STAGE_NAMES.index(s) for s in stages) if stages else len(PIPELINE_STAGES) - 1
+    for name, func in PIPELINE_STAGES[:last + 1]:
+        if hook: hook(name, func, ctx)
+        else: func(ctx)
+    return ctx
+
+def bench_case(pipes, building_type, is_fv, stages, repeat=3, measure_memory=True):
+    """1ケースを repeat 回計測し、段階ごとの最小/中央値時間とピークメモリを返す"""
+    timings = {name: [] for name in STAGE_NAMES}
+    def timed(name, func, ctx):
+        t0 = time.perf_counter()
+        func(ctx)
+        timings[name].append(time.perf_counter() - t0)
+
+    for _ in range(repeat):
+        run_pipeline(make_context(pipes, building_type, is_fv), stages, timed)
+
+    peak_kb = {}
+    if measure_memory:
+        # tracemalloc は実行を遅くするので時間計測とは別に1回だけ流す
+        def traced(name, func, ctx):
+            tracemalloc.start()
+            func(ctx)
+            peak_kb[name] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+            tracemalloc.stop()
+        run_pipeline(make_context(pipes, building_type, is_fv), stages, traced)
+
+    result = {}
+    for name, values in timings.items():
+        if not values: continue
+        values.sort()
+        result[name] = {
+            "min_s": round(values[0], 6),
+            "median_s": round(values[len(values) // 2], 6),
+            "peak_kb": peak_kb.get(name),
+        }
+    return result
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+def run_benchmarks(scenarios, sizes, stages=None, repeat=3, measure_memory=True, seed=0, log=None):
+    """シナリオ × 規模の全ケースを計測して結果 dict を返す"""
+    stages = stages or STAGE_NAMES
+    # 深い立管でも再帰計算が通るよう余裕を持たせる
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+    cases = []
+    for scenario in scenarios:
+        for size in sizes:
+            pipes, building_type, is_fv = synthetic.generate(scenario, size, seed=seed)
+            stats = bench_case(pipes, building_type, is_fv, stages, repeat, measure_memory)
+            cases.append({"scenario": scenario, "size": size, "nodes": len(pipes), "stages": stats})
+            if log:
+                total = sum(v["median_s"] for v in stats.values())
+                log(f"{scenario:>16} {len(pipes):>7} nodes  {total:8.3f} s  " +
+                    "  ".join(f"{k}={v['median_s']:.3f}" for k, v in stats.items()))
+    return {
+        "meta": {
+            "commit": _git_commit(), "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(), "platform": platform.platform(),
+            "repeat": repeat, "seed": seed,
+        },
+        "cases": cases,
+    }
+
+def compare_results(baseline, current, threshold=1.2, min_seconds=0.001):
+    """同じケース・段階の中央値を比較し、threshold 倍を超えて遅くなったものを返す"""
+    base_index = {(c["scenario"], c["size"]): c["stages"] for c in baseline.get("cases", [])}
+    regressions = []
+    for case in current.get("cases", []):
+        base_stages = base_index.get((case["scenario"], case["size"]))
+        if not base_stages: continue
+        for name, stats in case["stages"].items():
+            base = base_stages.get(name)
+            if not base or base["median_s"] < min_seconds: continue
+            ratio = stats["median_s"] / base["median_s"]
+            if ratio > threshold:
+                regressions.append({"scenario": case["scenario"], "size": case["size"], "stage": name,
+                                    "baseline_s": base["median_s"], "current_s": stats["median_s"], "ratio": round(ratio, 2)})
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="計算エンジンのベンチマーク")
+    parser.add_argument("--scenarios", nargs="+", default=list(synthetic.SCENARIOS), choices=list(synthetic.SCENARIOS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES, help="ノード数 (概算)")
+    parser.add_argument("--stages", nargs="+", default=None, choices=STAGE_NAMES, help="計測する段階 (既定: すべて)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="ピークメモリを計測しない")
+    parser.add_argument("--output", help="結果 JSON の出力先 (省略時は標準出力)")
+    parser.add_argument("--compare", help="比較対象の以前の結果 JSON")
+    parser.add_argument("--threshold", type=float, default=1.2, help="退行とみなす速度比")
+    args = parser.parse_args(argv)
+
+    log = lambda msg: print(msg, file=sys.stderr)
+    results = run_benchmarks(args.scenarios, args.sizes, args.stages, args.repeat, not args.no_memory, args.seed, log)
+
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f: f.write(text)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f: baseline = json.load(f)
+        regressions = compare_results(baseline, results, args.threshold)
+        for r in regressions:
+            log(f"退行: {r['scenario']} {r['size']} {r['stage']} {r['baseline_s']:.4f}s → {r['current_s']:.4f}s (x{r['ratio']})")
+        if regressions: return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+# builders.py
+"""ノード dict の生成と一括構築 (立管・各階分岐の一括追加)"""
+from templates import link_templates
+
+def make_node(node_id, name, node_type, parent, **fields):
+    """保存形式のノード dict (add_node と同じ既定値)"""
+    node = {
+        "id": node_id, "name": name, "type": node_type,
+        "parent": parent, "fixtures": {}, "manual_size": None,
+        "dwelling_count": 1, "person_count": 1, "specific_pipe_type": None,
+        "length": 2.0, "is_fixed_flow": False, "fixed_flow_val": 0.0, "is_manual_critical": False,
+        "static_head": 0.0, "required_pressure": 0.0, "equivalent_length": 0.0, "inner_pipe_length": 2.0, "fixture_type": None
+    }
+    node.update(fields)
+    return node
+
+def make_root():
+    return make_node("root", "ポンプ(始点)", "branch", None, dwelling_count=0, person_count=0, length=0.0)
+
+def build_riser(parent_id, floors, units_per_floor, preset_name, preset_data, branch_counter, system_counter,
+                start_floor=1, first_length=5.0, floor_length=3.0, unit_length=2.0,
+                base_static_head=0.0, floor_height=3.0, required_pressure=0.0, template_id=None, templates=None):
+    """立管 (各階の分岐の連なり) と各階の系統をまとめて生成する
+
+    既存のノードリストには触れず、新規ノードのリストと更新後のカウンタを返すので、
+    呼び出し側は extend 1回で反映できる (再計算も1回で済む)。
+    template_id を渡すと各系統はテンプレート参照になり、保存時に器具構成を1回だけ持つ。
+    返り値: (new_nodes, branch_counter, system_counter, 最上階の分岐ID)
+    """
+    new_nodes = []
+    parent = parent_id
+    fixtures = preset_data.get("fixtures", {})
+    dw = preset_data.get("dw", 1)
+    person = preset_data.get("person", 1)
+    for i in range(floors):
+        floor_label = f"{start_floor + i}F"
+        branch_counter += 1
+        floor_id = f"node_branch_{branch_counter}"
+        new_nodes.append(make_node(
+            floor_id, f"分岐-{branch_counter} ({floor_label})", "branch", parent,
+            length=first_length if i == 0 else floor_length
+        ))
+        static_head = round(base_static_head + i * floor_height, 3)
+        for _ in range(units_per_floor):
+            system_counter += 1
+            new_nodes.append(make_node(
+                f"node_system_{system_counter}", f"系統 ({preset_name})-{system_counter}", "system", floor_id,
+                fixtures=dict(fixtures), dwelling_count=dw, person_count=person, length=unit_length,
+                static_head=static_head, required_pressure=required_pressure, template=template_id
+            ))
+        parent = floor_id
+    if template_id and templates:
+        link_templates(new_nodes, templates)
+    else:
+        for n in new_nodes: n.pop("template", None)
+    return new_nodes, branch_counter, system_counter, parent
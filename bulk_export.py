@@ -0,0 +1,184 @@
+# bulk_export.py
+"""複数プロジェクトの区間別計算結果の一括書き出し (列指向)
+
+プロジェクトごとに計算済みのノードから列の配列 (流量・口径・流速・損失・累計損失・管種 …)
+を直接作り、1つのファイルへ追記していく。行ごとの dict は作らない。
+  - .parquet : 型つきの列指向 (pyarrow が必要)。文字列列は辞書符号化され、
+               追記分は ROW_GROUP_ROWS 行ごとの行グループにまとめて書く
+  - .csv     : 見出し1行 + 追記 (pyarrow なしで使える)
+計算は workers > 1 でプロセスに分け、書き込みは親プロセスが到着順に行う。
+
+    python bulk_export.py results.parquet --db projects.db
+    python bulk_export.py results.csv --files a.json b.json --workers 4
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+# 列名と型 (str は文字列、それ以外は numpy の dtype)
+RESULT_COLUMNS = (
+    ("project", "str"), ("node_id", "str"), ("name", "str"), ("parent_id", "str"), ("type", "str"),
+    ("flow_lpm", "float64"), ("used_pipe_type", "str"), ("size", "str"), ("velocity", "float64"),
+    ("head_loss", "float64"), ("cum_head_loss", "float64"), ("length", "float64"), ("repeat", "int32"),
+)
+ROW_GROUP_ROWS = 256 * 1024
+
+def result_columns(project, nodes):
+    """計算済みノードの列配列 {列名: ndarray}"""
+    nodes = list(nodes)
+    k = len(nodes)
+    def text(attr):
+        return np.array([getattr(n, attr) or "" for n in nodes], dtype=object)
+    return {
+        "project": np.full(k, project, dtype=object),
+        "node_id": text("id"),
+        "name": text("name"),
+        "parent_id": text("parent_id"),
+        "type": text("type"),
+        "flow_lpm": np.fromiter((n.flow_lpm for n in nodes), np.float64, k),
+        "used_pipe_type": text("used_pipe_type"),
+        "size": np.array([str(n.size) for n in nodes], dtype=object),
+        "velocity": np.fromiter((n.velocity for n in nodes), np.float64, k),
+        "head_loss": np.fromiter((n.head_loss for n in nodes), np.float64, k),
+        "cum_head_loss": np.fromiter((n.cum_head_loss for n in nodes), np.float64, k),
+        "length": np.fromiter((n.length for n in nodes), np.float64, k),
+        "repeat": np.fromiter((n.repeat for n in nodes), np.int32, k),
+    }
+
+class CsvResultWriter:
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        self._file = open(path, "w", encoding="utf-8", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow([name for name, _ in RESULT_COLUMNS])
+
+    def append(self, columns):
+        self._writer.writerows(zip(*(columns[name].tolist() for name, _ in RESULT_COLUMNS)))
+        self.rows += len(columns["node_id"])
+
+    def close(self):
+        self._file.close()
+
+class ParquetResultWriter:
+    def __init__(self, path, row_group_rows=ROW_GROUP_ROWS):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self._pa = pa
+        self.path = path
+        self.rows = 0
+        self.row_group_rows = row_group_rows
+        self.schema = pa.schema([(name, pa.string() if kind == "str" else pa.from_numpy_dtype(np.dtype(kind)))
+                                 for name, kind in RESULT_COLUMNS])
+        self._writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+        self._pending, self._pending_rows = [], 0
+
+    def append(self, columns):
+        pa = self._pa
+        batch = pa.record_batch([pa.array(columns[f.name], type=f.type) for f in self.schema], schema=self.schema)
+        self._pending.append(batch)
+        self._pending_rows += batch.num_rows
+        self.rows += batch.num_rows
+        if self._pending_rows >= self.row_group_rows: self._flush()
+
+    def _flush(self):
+        if self._pending:
+            self._writer.write_table(self._pa.Table.from_batches(self._pending), row_group_size=self.row_group_rows)
+        self._pending, self._pending_rows = [], 0
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+def open_writer(path, fmt=None):
+    """拡張子 (または fmt) に応じた書き出し先。parquet で pyarrow がなければ ValueError"""
+    fmt = fmt or os.path.splitext(path)[1].lstrip(".").lower()
+    if fmt == "csv":
+        return CsvResultWriter(path)
+    if fmt == "parquet":
+        try:
+            return ParquetResultWriter(path)
+        except ImportError:
+            raise ValueError("Parquet の書き出しには pyarrow が必要です (pip install pyarrow、または .csv を指定)") from None
+    raise ValueError(f"未対応の形式です: {fmt} (parquet / csv)")
+
+def project_columns(name, request):
+    """1プロジェクトを計算して列配列を返す (ワーカープロセスで実行)"""
+    from service import calculate_project
+    ctx, _ = calculate_project(request)
+    return result_columns(name, ctx["node_map"].values())
+
+def _file_requests(paths, building_type, is_fv):
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        yield os.path.splitext(os.path.basename(path))[0], {"project": data, "building_type": building_type, "is_fv": is_fv}
+
+def _store_requests(db_path, names=None):
+    from store import ProjectStore
+    from templates import PROJECT_FORMAT
+    with ProjectStore(db_path) as store:
+        for name in names or store.names():
+            project = store.load(name)
+            yield name, {"project": {"format": PROJECT_FORMAT, "templates": project["templates"], "pipes": project["pipes"]},
+                         "building_type": project["building_type"] or "一般・事務所 (負荷単位法)",
+                         "is_fv": project["is_fv"], "settings": project["settings"]}
+
+def export_results(requests, path, fmt=None, workers=1, log=None):
+    """(名前, 計算リクエスト) の列を計算して1ファイルに書き出す。{"projects", "rows", "seconds"}"""
+    t0 = time.perf_counter()
+    writer = open_writer(path, fmt)
+    count = 0
+    try:
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                pending = set()
+                for name, request in requests:
+                    pending.add(pool.submit(project_columns, name, request))
+                    # 計算済みの列が溜まりすぎないよう、投入はワーカー数の数倍までに抑える
+                    if len(pending) >= workers * 4:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            writer.append(future.result()); count += 1
+                        if log: log(f"{count} プロジェクト / {writer.rows} 行")
+                for future in pending:
+                    writer.append(future.result()); count += 1
+        else:
+            for name, request in requests:
+                writer.append(project_columns(name, request)); count += 1
+                if log and count % 100 == 0: log(f"{count} プロジェクト / {writer.rows} 行")
+    finally:
+        writer.close()
+    return {"projects": count, "rows": writer.rows, "seconds": round(time.perf_counter() - t0, 2)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="複数プロジェクトの計算結果を列指向ファイルへ一括書き出し")
+    parser.add_argument("output", help="出力先 (.parquet / .csv)")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--db", help="プロジェクトDB (store.py)")
+    source.add_argument("--files", nargs="+", help="保存データ (JSON) のファイル")
+    parser.add_argument("--names", nargs="+", help="DBから書き出すプロジェクト (省略時はすべて)")
+    parser.add_argument("--format", choices=["parquet", "csv"], help="省略時は出力先の拡張子で判断")
+    parser.add_argument("--building-type", default="一般・事務所 (負荷単位法)", help="--files の建物用途")
+    parser.add_argument("--fv", action="store_true", help="--files を洗浄弁式として計算する")
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    log = lambda msg: print(msg, file=sys.stderr)
+    requests = _store_requests(args.db, args.names) if args.db else _file_requests(args.files, args.building_type, args.fv)
+    try:
+        summary = export_results(requests, args.output, args.format, args.workers, log)
+    except ValueError as e:
+        log(f"エラー: {e}")
+        return 1
+    log(f"{summary['projects']} プロジェクト / {summary['rows']} 行 ({summary['seconds']} 秒) → {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,4 @@
 # constants.py
-import pandas as pd
 
 # 器具データ（負荷単位LU, 標準接続口径A）
 FIXTURE_SPECS = {
@@ -26,6 +25,39 @@ FIXTURE_SPECS = {
     "洗濯機 (私)": {"lu": 2, "size_a": 15}
 }
 
+# 同時使用シミュレーション用の器具ごとの使用確率 (ピーク時のある瞬間に使用中である確率) と吐水量 (L/min)
+FIXTURE_USAGE = {
+    "大便器 (洗浄弁) (公)": {"p": 0.05, "flow": 110.0},
+    "大便器 (タンク) (公)": {"p": 0.10, "flow": 12.0},
+    "小便器 (洗浄弁) (公)": {"p": 0.08, "flow": 30.0},
+    "小便器 (タンク) (公)": {"p": 0.10, "flow": 8.0},
+    "洗面器 (公)": {"p": 0.10, "flow": 10.0},
+    "手洗器 (公)": {"p": 0.05, "flow": 8.0},
+    "掃除用流し (公)": {"p": 0.03, "flow": 15.0},
+    "厨房流し (公)": {"p": 0.10, "flow": 25.0},
+    "シャワー (公)": {"p": 0.15, "flow": 12.0},
+    "大便器 (洗浄弁) (私)": {"p": 0.02, "flow": 110.0},
+    "大便器 (タンク) (私)": {"p": 0.03, "flow": 12.0},
+    "小便器 (洗浄弁) (私)": {"p": 0.02, "flow": 30.0},
+    "小便器 (タンク) (私)": {"p": 0.03, "flow": 8.0},
+    "洗面器 (私)": {"p": 0.04, "flow": 10.0},
+    "手洗器 (私)": {"p": 0.02, "flow": 8.0},
+    "台所流し (私)": {"p": 0.06, "flow": 12.0},
+    "浴槽 (私)": {"p": 0.03, "flow": 20.0},
+    "シャワー (私)": {"p": 0.05, "flow": 12.0},
+    "洗濯機 (私)": {"p": 0.05, "flow": 15.0},
+}
+DEFAULT_FIXTURE_USAGE = {"p": 0.05, "flow": 12.0}
+
+# 時系列需要の時刻別パターン (0時〜23時、1.0 = ピーク時の使用率)
+DEMAND_PATTERNS = {
+    "住宅": [0.10, 0.05, 0.05, 0.05, 0.10, 0.30, 0.80, 1.00, 0.70, 0.45, 0.40, 0.45,
+             0.55, 0.45, 0.40, 0.40, 0.45, 0.60, 0.80, 0.95, 1.00, 0.85, 0.55, 0.25],
+    "事務所": [0.02, 0.02, 0.02, 0.02, 0.02, 0.02, 0.05, 0.30, 0.80, 0.90, 0.85, 0.90,
+              1.00, 0.95, 0.85, 0.85, 0.80, 0.70, 0.40, 0.20, 0.10, 0.05, 0.02, 0.02],
+    "一定": [1.0] * 24,
+}
+
 # 後方互換性・計算用
 FIXTURE_DATA = {k: v["lu"] for k, v in FIXTURE_SPECS.items()}
 DEFAULT_PUBLIC_LIST = [k.replace(" (公)", "") for k in FIXTURE_DATA.keys() if "(公)" in k]
@@ -95,6 +127,47 @@ PIPE_DATABASES["HIVP (耐衝撃性硬質塩化ビニル管)"] = PIPE_DATABASES["
 
 PIPE_COLORS = {"SGP": "#1976D2", "VP": "#757575", "HIVP": "#1565C0", "SU": "#00796B", "PE": "#388E3C"}
 
+# 口径最適化用の参考単価 (材料費, 円/m)。PIPE_DATABASES と同じ管種名・サイズ名で引く
+PIPE_UNIT_PRICES = {
+    "SGP-VB (硬質塩化ビニルライニング鋼管)": {
+        "15A": 1100, "20A": 1400, "25A": 2000, "32A": 2600, "40A": 3000, "50A": 4100,
+        "65A": 5800, "80A": 7000, "100A": 10000, "125A": 14000, "150A": 18000,
+    },
+    "SGP (配管用炭素鋼鋼管)": {
+        "15A": 650, "20A": 800, "25A": 1150, "32A": 1500, "40A": 1750, "50A": 2400,
+        "65A": 3400, "80A": 4100, "100A": 5900, "125A": 8300, "150A": 10500,
+    },
+    "VP (硬質ポリ塩化ビニル管)": {
+        "13": 150, "16": 200, "20": 250, "25": 350, "30": 450, "40": 600,
+        "50": 900, "65": 1400, "75": 1800, "100": 2900, "125": 4500, "150": 6000,
+    },
+    "SU (一般配管用ステンレス鋼管)": {
+        "13Su": 900, "20Su": 1300, "25Su": 1900, "30Su": 2500, "40Su": 3300, "50Su": 4000,
+        "60Su": 5500, "75Su": 7500, "80Su": 9000, "100Su": 13000, "125Su": 18000, "150Su": 23000,
+    },
+    "PE (水道用ポリエチレン二層管1種)": {
+        "13": 200, "20": 280, "25": 400, "30": 550, "40": 700, "50": 1000, "75": 2000, "100": 3200,
+    },
+    "HIVP (耐衝撃性硬質塩化ビニル管)": {
+        "13": 200, "16": 260, "20": 330, "25": 460, "30": 590, "40": 780,
+        "50": 1170, "65": 1820, "75": 2340, "100": 3770, "125": 5850, "150": 7800,
+    },
+}
+
+# ダルシー・ワイスバッハ式用の管内面の絶対粗度 ε (mm)。PIPE_DATABASES と同じ管種名で引く
+PIPE_ROUGHNESS_MM = {
+    "SGP-VB (硬質塩化ビニルライニング鋼管)": 0.01,
+    "SGP (配管用炭素鋼鋼管)": 0.15,
+    "VP (硬質ポリ塩化ビニル管)": 0.0015,
+    "SU (一般配管用ステンレス鋼管)": 0.015,
+    "PE (水道用ポリエチレン二層管1種)": 0.007,
+    "HIVP (耐衝撃性硬質塩化ビニル管)": 0.0015,
+}
+DEFAULT_ROUGHNESS_MM = 0.05
+
+# 必要圧力 (MPa) → 水頭 (m)
+MPA_TO_HEAD_M = 102.0
+
 SU_FLOW_CAPACITY = {
     "13Su": 18.0, "20Su": 45.0, "25Su": 85.0, "30Su": 120.0,
     "40Su": 200.0, "50Su": 320.0, "60Su": 500.0, "75Su": 900.0,
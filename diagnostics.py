@@ -0,0 +1,73 @@
+# diagnostics.py
+"""1回のスクリプト実行 (rerun) ごとの処理時間・キャッシュ計測
+
+app.py の各段階を RunTimer.stage() で囲み、最後に record() を
+画面の診断パネルと構造化ログ (JSON 1行) の両方へ渡す。
+環境変数 WATER_PIPE_DIAG_LOG にファイルパスを指定すると JSON Lines で追記する。
+"""
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+LOGGER_NAME = "water_pipe_calc.diagnostics"
+HISTORY_SIZE = 20
+
+def get_logger():
+    """診断ログ用ロガー (WATER_PIPE_DIAG_LOG があればファイル出力を1回だけ設定)"""
+    logger = logging.getLogger(LOGGER_NAME)
+    if not getattr(logger, "_water_pipe_configured", False):
+        log_path = os.environ.get("WATER_PIPE_DIAG_LOG")
+        if log_path:
+            handler = logging.FileHandler(log_path, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+        logger._water_pipe_configured = True
+    return logger
+
+class RunTimer:
+    """段階別の経過時間、件数情報、キャッシュのヒット/ミスを記録する"""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.cache = {}
+        self.info = {}
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - t0)
+
+    def count(self, cache_name, hit):
+        c = self.cache.setdefault(cache_name, {"hit": 0, "miss": 0})
+        c["hit" if hit else "miss"] += 1
+
+    def set_info(self, key, value):
+        self.info[key] = value
+
+    def record(self):
+        """ログ・画面表示用の dict (時間は ms)"""
+        return {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "stages_ms": {k: round(v * 1000, 1) for k, v in self.stages.items()},
+            "cache": {k: dict(v) for k, v in self.cache.items()},
+            **self.info,
+        }
+
+def merge_cache_counters(totals, run_cache):
+    """セッション累計のキャッシュカウンタに今回分を加算する"""
+    for name, c in run_cache.items():
+        t = totals.setdefault(name, {"hit": 0, "miss": 0})
+        t["hit"] += c["hit"]
+        t["miss"] += c["miss"]
+    return totals
+
+def log_run(record):
+    get_logger().info(json.dumps(record, ensure_ascii=False))
@@ -0,0 +1,274 @@
+# diagram.py
+"""系統図 (graphviz) の作成
+
+配置の使い回し: 管長・流速・損失の表示切替や色分けはラベルと色しか変えないので、
+それらをすべて載せた状態の DOT で dot の配置 (-Tjson の座標) を1回だけ求めて
+LAYOUT_CACHE に残し (キーは DOT のハッシュ = 構成・向き・節点ラベル)、表示用の図には
+その座標 (pos / lp / bb) を書き込んで neato -n2 (配置計算なし) で描画する。
+"""
+import hashlib
+import json
+from collections import OrderedDict
+
+from constants import FIXTURE_SPECS, PIPE_COLORS
+from utils import get_display_size, load_graphviz
+
+DEFAULT_DIAGRAM_OPTIONS = {
+    "rankdir": "LR",
+    "color_mode": "なし (標準)",
+    "show_fixtures_mode": "なし",
+    "show_pipe_length": False,
+    "show_velocity": False,
+    "show_head_loss": False,
+    "show_calc_formula": False,
+    "max_velocity": 2.0,
+}
+# 配置計算用の図では表示切替で増えるラベルを常に載せ、色分けはしない
+LAYOUT_OPTIONS = {"show_pipe_length": True, "show_velocity": True, "show_head_loss": True, "color_mode": "なし (標準)"}
+LAYOUT_CACHE_ENTRIES = 8
+
+def layout_options(options=None):
+    opts = dict(DEFAULT_DIAGRAM_OPTIONS)
+    if options: opts.update(options)
+    opts.update(LAYOUT_OPTIONS)
+    return opts
+
+def compute_layout(source, application_path=None):
+    """dot で配置した座標 {"nodes": {ID: pos}, "edges": {(始点, 終点, 何本目): {pos, lp}}, "graph": {bb, lp}}"""
+    graphviz = load_graphviz(application_path)
+    data = json.loads(graphviz.pipe("dot", "json", source.encode("utf-8")))
+    names, nodes = {}, {}
+    for obj in data.get("objects", []):
+        if "nodes" in obj or "pos" not in obj: continue   # サブグラフ
+        names[obj["_gvid"]] = obj["name"]
+        nodes[obj["name"]] = obj["pos"]
+    edges, seen = {}, {}
+    for e in data.get("edges", []):
+        pair = (names.get(e["tail"]), names.get(e["head"]))
+        k = seen.get(pair, 0)
+        seen[pair] = k + 1
+        edges[pair + (k,)] = {key: e[key] for key in ("pos", "lp") if key in e}
+    return {"nodes": nodes, "edges": edges, "graph": {key: data[key] for key in ("bb", "lp") if key in data}}
+
+class LayoutCache:
+    """配置計算用 DOT のハッシュ → 座標 (新しく使ったものから max_entries 件)"""
+    def __init__(self, max_entries=LAYOUT_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._layouts = OrderedDict()
+
+    def __len__(self):
+        return len(self._layouts)
+
+    def get(self, source, application_path=None):
+        """(座標, キャッシュから取れたか)"""
+        key = hashlib.sha256(source.encode("utf-8")).hexdigest()
+        layout = self._layouts.get(key)
+        if layout is not None:
+            self._layouts.move_to_end(key)
+            return layout, True
+        layout = compute_layout(source, application_path)
+        self._layouts[key] = layout
+        while len(self._layouts) > self.max_entries: self._layouts.popitem(last=False)
+        return layout, False
+
+LAYOUT_CACHE = LayoutCache()
+
+def render_with_layout(source, fmt="svg", application_path=None):
+    """座標を書き込んだ DOT を配置計算なし (neato -n2) で描画する"""
+    graphviz = load_graphviz(application_path)
+    return graphviz.pipe("neato", fmt, source.encode("utf-8"), neato_no_op=2)
+
+def render_source(source, fmt="pdf", application_path=None, engine="dot"):
+    """DOT ソースを描画したファイルの bytes (バックグラウンド実行用)"""
+    graphviz = load_graphviz(application_path)
+    return graphviz.pipe(engine, fmt, source.encode("utf-8"))
+
+def edge_style(parent_id, child, color_mode, max_velocity, critical_path_ids=()):
+    """区間 (親 → child) の線の (色, 文字色, 線種, 太さ)。色分けモード・最遠ルート・規格外を反映する"""
+    style = "solid"
+    color = "black"
+    penwidth = "1.0"
+    fontcolor = "black"
+
+    if color_mode == "管種別":
+        p_type = child.used_pipe_type
+        if "SGP" in p_type: color = PIPE_COLORS["SGP"]
+        elif "HIVP" in p_type: color = PIPE_COLORS["HIVP"]
+        elif "VP" in p_type: color = PIPE_COLORS["VP"]
+        elif "SU" in p_type: color = PIPE_COLORS["SU"]
+        elif "PE" in p_type: color = PIPE_COLORS["PE"]
+        fontcolor = color
+    elif color_mode == "流速別":
+        vel = child.velocity
+        if vel >= max_velocity: color = "#D32F2F" # 赤 (警告)
+        elif vel >= max_velocity * 0.7: color = "#F57C00" # オレンジ (注意)
+        else: color = "#1976D2" # 青 (安全)
+        fontcolor = color
+
+    if parent_id in critical_path_ids and child.id in critical_path_ids:
+        color = "red"
+        penwidth = "3.0"
+
+    if child.size == "規格外" and not "SU" in str(child.used_pipe_type):
+        color = "red"; style = "dashed"; penwidth="1.0"
+    elif child.size == "規格外(過大)":
+        color = "red"; style = "dashed"; penwidth="1.0"
+    return color, fontcolor, style, penwidth
+
+def get_critical_path_ids(critical_node, node_map):
+    """最遠末端からルートまでのノードIDを集める"""
+    path_ids = set()
+    curr = critical_node
+    while curr:
+        path_ids.add(curr.id)
+        if curr.parent_id and curr.parent_id in node_map: curr = node_map[curr.parent_id]
+        else: curr = None
+    return path_ids
+
+def build_diagram(root_node, building_type, selected_pipe_type, caption="", selected_id=None,
+                  critical_node=None, critical_path_ids=None, options=None, application_path=None, loop_links=None,
+                  layout=None):
+    """計算済みのツリーから系統図 (graphviz.Digraph) を作成する
+
+    loop_links (network.solve_network の連絡管結果) を渡すと破線で描き足す。
+    layout (compute_layout の座標) を渡すと節点・辺・図全体に座標を書き込む (render_with_layout 用)。
+    """
+    opts = dict(DEFAULT_DIAGRAM_OPTIONS)
+    if options: opts.update(options)
+    critical_path_ids = critical_path_ids or set()
+    show_fixtures_mode = opts["show_fixtures_mode"]
+    color_mode = opts["color_mode"]
+    max_vel_setting = opts["max_velocity"]
+
+    graphviz = load_graphviz(application_path)
+    graph = graphviz.Digraph()
+    graph.attr(rankdir=opts["rankdir"], nodesep='1.0', ranksep='1.5')
+    graph.attr('edge', fontsize='11', fontcolor='#D50000', fontname='Meiryo')
+    graph.attr('node', fontname='Meiryo')
+    graph.attr(label=caption, labelloc='t', fontsize='18', fontname='Meiryo')
+    if layout: graph.attr(splines="true", **layout["graph"])
+    edge_count = {}
+
+    # 節点・辺は配置計算用の図と同じ順・同じ ID で追加されるので、layout があれば座標を足す
+    def add_node(name, **attrs):
+        if layout and name in layout["nodes"]: attrs["pos"] = layout["nodes"][name]
+        graph.node(name, **attrs)
+
+    def add_edge(tail, head, **attrs):
+        if layout:
+            k = edge_count.get((tail, head), 0)
+            edge_count[(tail, head)] = k + 1
+            attrs.update(layout["edges"].get((tail, head, k), {}))
+        graph.edge(tail, head, **attrs)
+
+    def draw_node(n):
+        is_sel = (n.id == selected_id)
+        pw = "3.0" if is_sel else "1.0"
+        sc = "red" if is_sel else "black"
+        tooltip_txt = n.calc_description if n.calc_description else n.name
+
+        if n.id == "root":
+            info_txt = f"{int(n.flow_lpm)} L/min"
+            if "BL基準" in building_type: info_txt += f"\n(計{n.system_total}戸)"
+            elif "人数基準" in building_type: info_txt += f"\n(計{n.person_total}人)"
+            elif "一戸建て" in building_type: info_txt += f"\n(器具{n.fixture_total}個)"
+            else: info_txt += f"\n({n.total_load}LU)"
+            lbl = f"{n.name}\n{info_txt}"
+            add_node(n.id, label=lbl, shape="box", style="filled", fillcolor="#FFF9C4", color=sc, penwidth=pw, tooltip=tooltip_txt)
+
+        elif n.type == "branch":
+            info_txt = ""
+            if "BL基準" in building_type: info_txt = f"({n.system_total}戸)"
+            elif "人数基準" in building_type: info_txt = f"({n.person_total}人)"
+            elif "一戸建て" in building_type: info_txt = f"({n.fixture_total}個)"
+            else: info_txt = f"({n.total_load} LU)"
+            fill = "#E3F2FD"
+            lbl = f'''<
+            <TABLE BORDER="0" CELLBORDER="0" CELLSPACING="0" CELLPADDING="0">
+                <TR><TD><B><FONT POINT-SIZE="10">{n.name}</FONT></B></TD></TR>
+                <TR><TD><FONT POINT-SIZE="7">{info_txt}</FONT></TD></TR>
+            </TABLE>>'''
+            add_node(n.id, label=lbl, shape="circle", style="filled", fillcolor=fill,
+                       margin="0.01", width="0.1", height="0.1", color=sc, penwidth=pw, tooltip=tooltip_txt)
+
+        elif n.type == "system":
+            fill = "#FFF9C4" if is_sel else "#E8F5E9"
+            if "BL基準" in building_type: content_txt = f"<B>{n.dwelling_count} 戸</B>"; bottom_txt = ""
+            elif "人数基準" in building_type: content_txt = f"<B>{n.person_count} 人</B>"; bottom_txt = ""
+            else:
+                items = [f"{k}x{v}" for k,v in n.fixtures.items() if v>0]
+                content_txt = "<BR/>".join(items) if items else "(下流へ接続)"
+                bottom_txt = f"計: {n.total_load} LU" if "一般" in building_type else ""
+
+            if n.is_manual_critical: content_txt += "<BR/><FONT COLOR='red' POINT-SIZE='10'>[最遠指定]</FONT>"
+            if n.required_pressure > 0: bottom_txt += f"<BR/>Req: {n.required_pressure}MPa"
+
+            repeat = getattr(n, "repeat", 1)
+            title_txt = f"{n.name} ×{repeat}" if repeat > 1 else n.name
+            lbl = f'''<
+            <TABLE BORDER="0" CELLBORDER="1" CELLSPACING="0" CELLPADDING="4" BGCOLOR="{fill}">
+                <TR><TD><B>🏠 {title_txt}</B></TD></TR>
+                <TR><TD ALIGN="LEFT"><FONT POINT-SIZE="10">{content_txt}</FONT></TD></TR>
+                {"<TR><TD>"+bottom_txt+"</TD></TR>" if bottom_txt else ""}
+            </TABLE>>'''
+            add_node(n.id, label=lbl, shape="plain", tooltip=tooltip_txt)
+
+            is_show_fixtures = False
+            if show_fixtures_mode == "すべて":
+                is_show_fixtures = True
+            elif show_fixtures_mode == "最遠ルート末端のみ" and critical_node and n.id == critical_node.id:
+                is_show_fixtures = True
+
+            if is_show_fixtures and n.fixtures:
+                for f_name, qty in n.fixtures.items():
+                    if qty > 0:
+                        spec = FIXTURE_SPECS.get(f_name)
+                        size_disp = "-"
+                        if spec:
+                            size_disp = get_display_size(spec["size_a"], selected_pipe_type)
+
+                        for i in range(qty):
+                            f_node_id = f"{n.id}_fix_{f_name}_{i}"
+                            f_label = f"{f_name.split(' ')[0]}"
+                            add_node(f_node_id, label=f_label, shape="oval", style="filled", fillcolor="white", fontsize="8", width="0.5", height="0.3")
+                            edge_lbl = f"{size_disp}\n{n.inner_pipe_length}m"
+                            add_edge(n.id, f_node_id, label=edge_lbl, fontsize="8", color="gray", arrowhead="dot")
+
+        elif n.type == "fixture":
+            fill = "#FFF9C4" if is_sel else "#F3E5F5"
+            lbl = f'''<
+            <TABLE BORDER="0" CELLBORDER="1" CELLSPACING="0" CELLPADDING="4" BGCOLOR="{fill}">
+                <TR><TD><B>🚰 {n.name}</B></TD></TR>
+                <TR><TD><FONT POINT-SIZE="9">{n.fixture_type if n.fixture_type else "未設定"}</FONT></TD></TR>
+                <TR><TD><FONT POINT-SIZE="8">{n.load_units} LU</FONT></TD></TR>
+            </TABLE>>'''
+            add_node(n.id, label=lbl, shape="plain", tooltip=tooltip_txt)
+
+    def draw_edge(n, child):
+        manual_mark = "🔒" if child.is_manual else ""
+        pipe_info = child.size
+        if child.specific_pipe_type: pipe_info += f" ({child.specific_pipe_type})"
+        edge_label = f"{manual_mark}{pipe_info}\n{int(child.flow_lpm)} L/min"
+
+        if opts["show_pipe_length"]: edge_label += f"\nL={child.length}m"
+        if opts["show_velocity"]: edge_label += f"\n({child.velocity} m/s)"
+        if opts["show_head_loss"]: edge_label += f"\nΔh={child.head_loss}m"
+        if opts["show_calc_formula"] and child.calc_description: edge_label += f"\n[{child.calc_description}]"
+
+        color, fontcolor, style, penwidth = edge_style(n.id, child, color_mode, max_vel_setting, critical_path_ids)
+
+        add_edge(n.id, child.id, label=edge_label, color=color, fontcolor=fontcolor, style=style, penwidth=penwidth)
+
+    # 深いツリーでも再帰上限に掛からないよう明示スタックで走査する
+    # (出力順は 節点 → (辺, 子の部分木) × 子の数 で、再帰版と同じ)
+    stack = [(root_node, None)]
+    while stack:
+        n, parent = stack.pop()
+        if parent is not None: draw_edge(parent, n)
+        draw_node(n)
+        for child in reversed(n.children):
+            stack.append((child, n))
+    for link in loop_links or []:
+        add_edge(link["from"], link["to"], label=f"{link['size']}\n{abs(int(link['flow_lpm']))} L/min",
+                   style="dashed", dir="none", constraint="false", color="#6A1B9A", fontcolor="#6A1B9A")
+    return graph
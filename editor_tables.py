@@ -0,0 +1,88 @@
+# editor_tables.py
+"""データエディタ (パラメータ一括編集・配下ノード表) の表の作成と編集の反映
+
+表は列ごとに作る。入力値の列は pipes の該当行から、流速・損失の列は
+result_arrays() (計算後に1回だけ作る全ノード分の配列) を行番号で切り出して作る。
+行ごとの dict は作らない。
+
+編集の反映は st.data_editor の変更内容 (session_state[key]["edited_rows"]:
+表の行番号 → {列名: 新しい値}) だけを使い、編集された行の編集された列だけを書き換える。
+表全体の比較や全行の書き戻しはしない。apply_edits() は値が変わったノードの ID 集合を返す。
+"""
+import numpy as np
+import pandas as pd
+
+AUTO_SIZE = "自動計算"
+TERMINAL_TYPES = ("system", "fixture")
+RESULT_COLUMNS = ("流速 (m/s)", "損失 (m)")
+
+# 列名 → (ノードの項目, 既定値, 変換)
+#   size: None ⇔ "自動計算" / fixture: 器具ノード以外は空欄、空欄 ⇔ None / terminal: 末端 (系統・器具) のみ有効
+BATCH_FIELDS = {
+    "名称": ("name", "", None),
+    "管長 (m)": ("length", 2.0, None),
+    "局所損失加算(m)": ("equivalent_length", 0.0, None),
+    "実揚程 (m)": ("static_head", 0.0, "terminal"),
+    "末端必要圧 (MPa)": ("required_pressure", 0.0, "terminal"),
+    "口径固定": ("manual_size", None, "size"),
+    "流量固定モード": ("is_fixed_flow", False, None),
+    "固定流量 (L/min)": ("fixed_flow_val", 0.0, None),
+}
+CHILD_FIELDS = {
+    "名称": ("name", "", None),
+    "管長 (m)": ("length", 2.0, None),
+    "器具種別": ("fixture_type", None, "fixture"),
+    "口径固定": ("manual_size", None, "size"),
+}
+
+def result_arrays(pipes, node_map):
+    """pipes の並びの流速・損失の配列 (計算結果のないノードは 0)"""
+    nodes = [node_map.get(p["id"]) for p in pipes]
+    n = len(nodes)
+    velocity = np.fromiter((node.velocity if node else 0.0 for node in nodes), np.float64, n)
+    head_loss = np.fromiter((node.head_loss if node else 0.0 for node in nodes), np.float64, n)
+    return {"流速 (m/s)": velocity.round(2), "損失 (m)": head_loss.round(3)}
+
+def _display_value(p, key, default, conv):
+    value = p.get(key, default)
+    if conv == "size": return value or AUTO_SIZE
+    if conv == "fixture": return (value or "") if p["type"] == "fixture" else ""
+    if conv == "terminal": return value if p["type"] in TERMINAL_TYPES else 0.0
+    return value
+
+def editor_frame(pipes, rows, fields, results):
+    """pipes の行番号 rows の表 (列: id, 名称, 種別, fields の残り, 流速, 損失)"""
+    nodes = [pipes[i] for i in rows]
+    data = {"id": [p["id"] for p in nodes]}
+    for column, (key, default, conv) in fields.items():
+        data[column] = [_display_value(p, key, default, conv) for p in nodes]
+        if column == "名称": data["種別"] = [p["type"] for p in nodes]
+    take = np.asarray(rows, dtype=np.int64)
+    for column in RESULT_COLUMNS:
+        data[column] = results[column][take]
+    return pd.DataFrame(data)
+
+def apply_edits(pipes, position, row_ids, edited_rows, fields):
+    """editor の変更内容を pipes に反映する。値が変わったノードの ID 集合を返す
+
+    row_ids: 表の行番号 → ノード ID (表を作ったときの並び)、position: ノード ID → pipes の行番号。
+    表を作った後に削除されたノードの行は無視する。
+    """
+    dirty = set()
+    for row, changes in edited_rows.items():
+        row = int(row)
+        i = position.get(row_ids[row]) if row < len(row_ids) else None
+        if i is None: continue
+        p = pipes[i]
+        for column, value in changes.items():
+            spec = fields.get(column)
+            if spec is None: continue
+            key, default, conv = spec
+            if conv == "terminal" and p["type"] not in TERMINAL_TYPES: continue
+            if conv == "size": value = None if value in (None, AUTO_SIZE) else value
+            elif conv == "fixture": value = value or None
+            elif value is None: value = default
+            if p.get(key, default) != value:
+                p[key] = value
+                dirty.add(p["id"])
+    return dirty
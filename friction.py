@@ -0,0 +1,169 @@
+# friction.py
+"""ダルシー・ワイスバッハ式による摩擦損失
+
+    h = f · (L / D) · v² / 2g
+摩擦係数 f はコールブルック式
+    1/√f = -2·log10( (ε/D)/3.7 + 2.51 / (Re·√f) )
+を全区間の配列でまとめて解く (スワミー・ジェイン式を初期値にした反復)。Re < 2000 は層流 f = 64/Re。
+
+f は (粗度, 内径, レイノルズ数の区分) ごとに FRICTION_CACHE に残し、再計算では
+未知の組だけを解く。区分は log10(Re) を RE_BINS_PER_DECADE 等分したもので、
+f は区分の代表値 (10^(区分/分割数)) の Re で求める (f の誤差は 0.1% 程度)。
+
+loss_params の "model" が "darcy_weisbach" のとき、PipeSection.calculate は区間損失を
+その場では求めず、ルートの calculate の最後に apply_darcy_weisbach で全区間まとめて求める。
+"""
+import math
+
+import numpy as np
+
+from constants import PIPE_ROUGHNESS_MM, DEFAULT_ROUGHNESS_MM
+
+HAZEN_WILLIAMS = "hazen_williams"
+DARCY_WEISBACH = "darcy_weisbach"
+GRAVITY = 9.80665
+DEFAULT_TEMPERATURE_C = 20.0
+LAMINAR_RE = 2000.0
+RE_BINS_PER_DECADE = 500
+MAX_CACHE_ENTRIES = 200000
+
+def is_darcy(loss_params):
+    return bool(loss_params) and loss_params.get("model") == DARCY_WEISBACH
+
+def kinematic_viscosity(temperature_c=DEFAULT_TEMPERATURE_C):
+    """水の動粘性係数 (m²/s、ポアズイユの式)"""
+    t = float(temperature_c)
+    return 1.792e-6 / (1.0 + 0.0337 * t + 0.000221 * t * t)
+
+def roughness_mm(pipe_type, loss_params=None):
+    """管内面の絶対粗度 ε (mm)。loss_params の "roughness" (>0) があればそれを優先する"""
+    override = (loss_params or {}).get("roughness")
+    if override: return float(override)
+    return PIPE_ROUGHNESS_MM.get(pipe_type, DEFAULT_ROUGHNESS_MM)
+
+def colebrook(re, rel_roughness, tol=1e-10, max_iter=30):
+    """コールブルック式の摩擦係数 (配列)。Re < 2000 は 64/Re"""
+    re = np.asarray(re, dtype=float)
+    rel = np.broadcast_to(np.asarray(rel_roughness, dtype=float), re.shape)
+    f = np.zeros(re.shape)
+    laminar = (re > 0) & (re < LAMINAR_RE)
+    f[laminar] = 64.0 / re[laminar]
+    turb = re >= LAMINAR_RE
+    if not turb.any(): return f
+    r, e = re[turb], rel[turb] / 3.7
+    # スワミー・ジェイン式を初期値に、x = 1/√f の不動点反復
+    x = -2.0 * np.log10(e + 5.74 / r ** 0.9)
+    for _ in range(max_iter):
+        x_new = -2.0 * np.log10(e + 2.51 * x / r)
+        done = np.max(np.abs(x_new - x)) < tol
+        x = x_new
+        if done: break
+    f[turb] = 1.0 / (x * x)
+    return f
+
+class FrictionCache:
+    """(粗度mm, 内径mm, Re区分) → 摩擦係数"""
+    def __init__(self, max_entries=MAX_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._f = {}
+
+    def __len__(self):
+        return len(self._f)
+
+    def clear(self):
+        self._f.clear()
+
+    def factor(self, roughness, d_mm, re):
+        """1要素分の摩擦係数 (配列を作らずにキャッシュを引く)"""
+        if re <= 0: return 0.0
+        key = (float(roughness), float(d_mm), int(round(math.log10(re) * RE_BINS_PER_DECADE)))
+        f = self._f.get(key)
+        if f is None: f = float(self.factors([roughness], [d_mm], [re])[0])
+        return f
+
+    def factors(self, roughness, d_mm, re):
+        """各要素の摩擦係数。キャッシュにない組だけをまとめて colebrook で解く"""
+        d_mm = np.asarray(d_mm, dtype=float)
+        re = np.asarray(re, dtype=float)
+        roughness = np.broadcast_to(np.asarray(roughness, dtype=float), d_mm.shape)
+        bins = np.zeros(re.shape, dtype=np.int64)
+        positive = re > 0
+        bins[positive] = np.rint(np.log10(re[positive]) * RE_BINS_PER_DECADE)
+        keys = list(zip(roughness.tolist(), d_mm.tolist(), bins.tolist()))
+        out = np.zeros(len(keys))
+        missing = {}
+        for i, key in enumerate(keys):
+            if not positive[i]: continue
+            f = self._f.get(key)
+            if f is None: missing.setdefault(key, []).append(i)
+            else: out[i] = f
+        if missing:
+            miss = list(missing)
+            eps = np.array([k[0] for k in miss])
+            dia = np.array([k[1] for k in miss])
+            re_rep = 10.0 ** (np.array([k[2] for k in miss]) / RE_BINS_PER_DECADE)
+            solved = colebrook(re_rep, eps / dia)
+            if len(self._f) + len(miss) > self.max_entries: self._f.clear()
+            for key, f in zip(miss, solved.tolist()):
+                self._f[key] = f
+                out[missing[key]] = f
+        return out
+
+FRICTION_CACHE = FrictionCache()
+
+def darcy_losses(q_m3s, d_mm, equivalent_length, roughness, temperature_c=DEFAULT_TEMPERATURE_C, cache=FRICTION_CACHE):
+    """区間損失 (m) の配列 (丸めなし)。q, d_mm, equivalent_length, roughness は同じ形
+
+    cache=None ではキャッシュを使わず、各要素の Re でそのまま colebrook を解く (大きな配列向け)。
+    """
+    q = np.abs(np.asarray(q_m3s, dtype=float))
+    d_m = np.asarray(d_mm, dtype=float) / 1000.0
+    area = math.pi * (d_m / 2) ** 2
+    valid = (d_m > 0) & (q > 0)
+    v = np.divide(q, area, out=np.zeros_like(q), where=valid)
+    re = v * d_m / kinematic_viscosity(temperature_c)
+    if cache is None:
+        f = colebrook(re, np.divide(roughness, np.asarray(d_mm, dtype=float), out=np.zeros_like(q), where=valid))
+    else:
+        f = cache.factors(roughness, d_mm, re)
+    return np.divide(f * np.asarray(equivalent_length, dtype=float) * v * v, 2 * GRAVITY * d_m,
+                     out=np.zeros_like(q), where=valid)
+
+def section_losses(q_m3s, d_mm, length, equivalent_length, loss_params, pipe_types):
+    """PipeSection.calculate と同じ式・丸めの区間損失 (配列)。pipe_types は要素ごとの管種"""
+    q = np.asarray(q_m3s, dtype=float)
+    d = np.asarray(d_mm, dtype=float)
+    if not loss_params or not len(q): return np.zeros(len(q))
+    L_eq = np.asarray(length, dtype=float) * loss_params.get("fitting", 1.2) + np.asarray(equivalent_length, dtype=float)
+    valid = (d > 0) & (q > 0)
+    if is_darcy(loss_params):
+        eps = [roughness_mm(t, loss_params) for t in pipe_types]
+        h = darcy_losses(q, d, L_eq, eps, loss_params.get("temperature", DEFAULT_TEMPERATURE_C))
+    else:
+        C_val = loss_params.get("C", 130.0)
+        h = np.zeros(len(q))
+        h[valid] = 10.666 * (C_val ** -1.852) * ((d[valid] / 1000.0) ** -4.87) * (q[valid] ** 1.852) * L_eq[valid]
+    return np.where(valid, np.round(h, 3), 0.0)
+
+def darcy_loss(q_m3s, d_mm, equivalent_length, pipe_type, loss_params, cache=FRICTION_CACHE):
+    """1区間分の損失 (m、丸めなし)。器具接続管など単独の計算用"""
+    if d_mm <= 0 or q_m3s <= 0: return 0.0
+    d_m = d_mm / 1000.0
+    v = q_m3s / (math.pi * (d_m / 2) ** 2)
+    re = v * d_m / kinematic_viscosity(loss_params.get("temperature", DEFAULT_TEMPERATURE_C))
+    f = cache.factor(roughness_mm(pipe_type, loss_params), d_mm, re)
+    return f * equivalent_length * v * v / (2 * GRAVITY * d_m)
+
+def apply_darcy_weisbach(root, loss_params):
+    """calculate() 済みツリーの全区間の損失をダルシー・ワイスバッハ式でまとめて求め、head_loss に入れる"""
+    nodes, stack = [], [root]
+    while stack:
+        n = stack.pop()
+        if n.inner_diameter > 0 and n.flow_lpm > 0: nodes.append(n)
+        stack.extend(n.children)
+    if not nodes: return
+    h = section_losses([n.flow_lpm / 60000 for n in nodes], [n.inner_diameter for n in nodes],
+                       [n.length for n in nodes], [n.equivalent_length for n in nodes],
+                       loss_params, [n.used_pipe_type for n in nodes])
+    for n, loss in zip(nodes, h.tolist()):
+        n.head_loss = loss
@@ -0,0 +1,128 @@
+# history.py
+"""構成編集の元に戻す / やり直す
+
+編集のたびに構成全体を複製すると 1万ノード規模ではセッションのメモリが足りなくなるので、
+直前の状態 (ID → ノード dict の複製) を1組だけ持ち、1ステップには
+  - 変わったノードの (変更前, 変更後)  (追加は変更前 None、削除は変更後 None)
+  - ノードの並び順が変わった場合だけ、その前後の ID 列
+  - テンプレート・採番カウンタが変わった場合だけ、その前後
+を記録する (差分の履歴)。変わらないノードは履歴にも戻した後のリストにも
+同じ dict がそのまま残る (構造共有)。
+ステップ数 (max_steps) と差分の合計サイズ (max_bytes、JSON 換算の概算) の上限を
+超えたら古いステップから捨てる。
+
+record() は rerun のたびに呼び、前回から変わっていれば1ステップとして積む。
+undo() / redo() は差分だけを当てたノードリストと、変わったノード ID を返す。
+"""
+import copy
+import json
+from collections import deque
+
+DEFAULT_MAX_STEPS = 50
+DEFAULT_MAX_BYTES = 20 * 1024 * 1024
+
+def _size(obj):
+    """差分の大きさの概算 (JSON の文字数)"""
+    return len(json.dumps(obj, ensure_ascii=False, default=str))
+
+class History:
+    def __init__(self, max_steps=DEFAULT_MAX_STEPS, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_steps = max_steps
+        self.max_bytes = max_bytes
+        self.undo_steps = deque()
+        self.redo_steps = deque()
+        self.bytes = 0
+        self._nodes = None      # 直前の状態: ID → ノード dict の複製
+        self._order = None
+        self._templates = None
+        self._counters = None
+
+    def can_undo(self):
+        return bool(self.undo_steps)
+
+    def can_redo(self):
+        return bool(self.redo_steps)
+
+    def record(self, pipes, templates=None, counters=None):
+        """前回の状態からの変更を1ステップとして積む。変更がなければ False"""
+        order = [p["id"] for p in pipes]
+        if self._nodes is None:
+            self._reset(pipes, order, templates, counters)
+            return False
+        nodes = {}
+        seen = set()
+        for p in pipes:
+            seen.add(p["id"])
+            old = self._nodes.get(p["id"])
+            if old != p: nodes[p["id"]] = (old, copy.deepcopy(p))
+        for nid in self._nodes.keys() - seen:
+            nodes[nid] = (self._nodes[nid], None)
+        step = {"nodes": nodes}
+        if order != self._order: step["order"] = (self._order, order)
+        if templates is not None and templates != self._templates: step["templates"] = (self._templates, copy.deepcopy(templates))
+        if counters is not None and counters != self._counters: step["counters"] = (self._counters, dict(counters))
+        if len(step) == 1 and not nodes:
+            return False
+        self._apply_to_state(step, forward=True)
+        self.redo_steps.clear()
+        self._push(step)
+        return True
+
+    def undo(self, pipes):
+        """1ステップ戻す。(ノードリスト, テンプレート or None, カウンタ or None, 変わったID) / 履歴なしは None"""
+        if not self.undo_steps: return None
+        step = self.undo_steps.pop()
+        self.bytes -= step["bytes"]
+        self.redo_steps.append(step)
+        return self._restore(pipes, step, forward=False)
+
+    def redo(self, pipes):
+        if not self.redo_steps: return None
+        step = self.redo_steps.pop()
+        self.undo_steps.append(step)
+        self.bytes += step["bytes"]
+        return self._restore(pipes, step, forward=True)
+
+    def describe(self, step):
+        added = sum(1 for old, new in step["nodes"].values() if old is None)
+        removed = sum(1 for old, new in step["nodes"].values() if new is None)
+        changed = len(step["nodes"]) - added - removed
+        parts = [f"{label} {n}" for label, n in (("追加", added), ("削除", removed), ("変更", changed)) if n]
+        if "templates" in step: parts.append("テンプレート")
+        return " / ".join(parts) or "並び順"
+
+    def _reset(self, pipes, order, templates, counters):
+        self._nodes = {p["id"]: copy.deepcopy(p) for p in pipes}
+        self._order = order
+        self._templates = copy.deepcopy(templates)
+        self._counters = dict(counters) if counters is not None else None
+
+    def _push(self, step):
+        step["bytes"] = _size([step["nodes"], step.get("order"), step.get("templates")])
+        self.undo_steps.append(step)
+        self.bytes += step["bytes"]
+        while self.undo_steps and (len(self.undo_steps) > self.max_steps or self.bytes > self.max_bytes):
+            self.bytes -= self.undo_steps.popleft()["bytes"]
+
+    def _apply_to_state(self, step, forward):
+        """直前の状態 (複製) を step の前後どちらかに合わせる"""
+        k = 1 if forward else 0
+        for nid, versions in step["nodes"].items():
+            if versions[k] is None: self._nodes.pop(nid, None)
+            else: self._nodes[nid] = versions[k]
+        if "order" in step: self._order = step["order"][k]
+        if "templates" in step: self._templates = step["templates"][k]
+        if "counters" in step: self._counters = step["counters"][k]
+
+    def _restore(self, pipes, step, forward):
+        self._apply_to_state(step, forward)
+        k = 1 if forward else 0
+        live = {p["id"]: p for p in pipes}
+        for nid, versions in step["nodes"].items():
+            if versions[k] is None: live.pop(nid, None)
+            else: live[nid] = copy.deepcopy(versions[k])
+        order = step["order"][k] if "order" in step else [p["id"] for p in pipes if p["id"] in live]
+        restored = [live[nid] for nid in order if nid in live]
+        templates = copy.deepcopy(step["templates"][k]) if "templates" in step else None
+        counters = dict(step["counters"][k]) if "counters" in step else None
+        return restored, templates, counters, set(step["nodes"])
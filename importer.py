@@ -0,0 +1,204 @@
+# importer.py
+"""CAD拾い出し表 (CSV / XLSX の辺リスト) からの構成読込
+
+1行 = 1区間 (区間ID, 親ID, 配管長, 器具数..., 静水頭) の表を、行を順に1回だけ読んで
+保存形式のノード dict のリストに変換する。親の解決は ID→ノードの dict 引きで行い、
+親が見つからない行 (孤立) と親をたどってもポンプに戻らない行 (循環) を検出する。
+ファイル全体をメモリに読み込まず (CSV は逐次デコード、XLSX は read_only)、
+保持するのは生成したノードだけなので 10万行規模でもメモリは出力に比例する。
+
+列名は下の COLUMN_ALIASES のいずれか。器具列は FIXTURE_SPECS のキーと
+空白・全角半角の違いを無視して照合する。親IDが空欄の行はポンプ(始点)に接続する。
+"""
+import csv
+import io
+import os
+import unicodedata
+
+from constants import FIXTURE_SPECS
+from builders import make_node, make_root
+
+COLUMN_ALIASES = {
+    "id": ("id", "区間id", "区間", "section", "sectionid", "section_id"),
+    "parent": ("parent", "親id", "親", "parentid", "parent_id"),
+    "name": ("name", "名称", "区間名"),
+    "type": ("type", "種別"),
+    "length": ("length", "配管長", "長さ", "管長", "length_m"),
+    "static_head": ("static_head", "静水頭", "高さ", "staticHead", "head"),
+    "required_pressure": ("required_pressure", "必要圧力"),
+    "equivalent_length": ("equivalent_length", "相当長"),
+    "dwelling_count": ("dwelling_count", "戸数"),
+    "person_count": ("person_count", "人数"),
+}
+FLOAT_FIELDS = ("length", "static_head", "required_pressure", "equivalent_length")
+INT_FIELDS = ("dwelling_count", "person_count")
+TYPE_ALIASES = {"branch": "branch", "分岐": "branch", "system": "system", "系統": "system", "fixture": "fixture", "器具": "fixture"}
+MAX_REPORTED = 20
+CSV_ENCODINGS = ("utf-8-sig", "cp932")
+
+def _normalize(label):
+    return unicodedata.normalize("NFKC", str(label)).replace(" ", "").replace("　", "").lower()
+
+_FIXTURE_INDEX = {_normalize(k): k for k in FIXTURE_SPECS}
+_ALIAS_INDEX = {_normalize(a): field for field, aliases in COLUMN_ALIASES.items() for a in aliases}
+
+def map_columns(header, fixture_specs=None):
+    """見出し行から (列番号→項目名, 列番号→器具名, 対応しなかった見出し) を作る"""
+    fixture_index = _FIXTURE_INDEX if fixture_specs is None else {_normalize(k): k for k in fixture_specs}
+    fields, fixtures, unmapped = {}, {}, []
+    for i, label in enumerate(header):
+        if label is None or str(label).strip() == "": continue
+        key = _normalize(label)
+        if key in _ALIAS_INDEX and _ALIAS_INDEX[key] not in fields.values():
+            fields[i] = _ALIAS_INDEX[key]
+        elif key in fixture_index:
+            fixtures[i] = fixture_index[key]
+        else:
+            unmapped.append(str(label))
+    missing = {"id", "parent"} - set(fields.values())
+    if missing:
+        raise ValueError(f"必須列がありません: {', '.join(sorted(missing))}")
+    return fields, fixtures, unmapped
+
+def _cell(value):
+    if value is None: return ""
+    if isinstance(value, float) and value.is_integer(): value = int(value)
+    return str(value).strip()
+
+def build_pipes(rows, fixture_specs=None):
+    """見出し行つきの行イテレータからノードリストと読込レポートを作る
+
+    返り値: (pipes, report)。pipes の先頭はポンプ(始点)。
+    区間IDの重複・数値の不正・孤立・循環があれば ValueError (先頭 MAX_REPORTED 件を列挙)。
+    """
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        raise ValueError("表が空です")
+    fields, fixture_cols, unmapped = map_columns(header, fixture_specs)
+    col_of = {f: i for i, f in fields.items()}
+    id_col, parent_col = col_of["id"], col_of["parent"]
+
+    root = make_root()
+    pipes = [root]
+    index = {root["id"]: root}
+    problems = []
+    for line_no, row in enumerate(rows, start=2):
+        if not row or all(_cell(v) == "" for v in row): continue
+        node_id = _cell(row[id_col]) if id_col < len(row) else ""
+        if not node_id:
+            problems.append(f"{line_no}行目: 区間IDが空欄です")
+            continue
+        if node_id in index:
+            problems.append(f"{line_no}行目: 区間ID {node_id} が重複しています")
+            continue
+        parent = _cell(row[parent_col]) if parent_col < len(row) else ""
+        node = make_node(node_id, node_id, "branch", parent or root["id"], dwelling_count=0, person_count=0)
+        node["_line"] = line_no
+        try:
+            for i, field in fields.items():
+                if field in ("id", "parent") or i >= len(row): continue
+                value = _cell(row[i])
+                if value == "": continue
+                if field in FLOAT_FIELDS: node[field] = float(value)
+                elif field in INT_FIELDS: node[field] = int(float(value))
+                elif field == "type": node["_type"] = TYPE_ALIASES.get(value.lower(), TYPE_ALIASES.get(value))
+                else: node[field] = value
+            for i, fname in fixture_cols.items():
+                if i >= len(row): continue
+                value = _cell(row[i])
+                if value == "": continue
+                count = int(float(value))
+                if count: node["fixtures"][fname] = count
+        except ValueError:
+            problems.append(f"{line_no}行目: 数値に変換できない値があります")
+            continue
+        pipes.append(node)
+        index[node_id] = node
+
+    # 親の解決 (孤立の検出) と子の有無
+    has_children = set()
+    for node in pipes[1:]:
+        if node["parent"] not in index:
+            problems.append(f"{node['_line']}行目: 親ID {node['parent']} が見つかりません (孤立)")
+        else:
+            has_children.add(node["parent"])
+    if not problems:
+        problems.extend(_find_cycles(pipes, index))
+    if problems:
+        shown = problems[:MAX_REPORTED]
+        more = f"\n…ほか {len(problems) - MAX_REPORTED} 件" if len(problems) > MAX_REPORTED else ""
+        raise ValueError("\n".join(shown) + more)
+
+    counts = {"branch": 0, "system": 0, "fixture": 0}
+    for node in pipes[1:]:
+        node_type = node.pop("_type", None)
+        if node_type is None:
+            node_type = "system" if node["fixtures"] and node["id"] not in has_children else "branch"
+        node["type"] = node_type
+        if node_type == "system":
+            node["dwelling_count"] = node["dwelling_count"] or 1
+            node["person_count"] = node["person_count"] or 1
+        elif node_type == "fixture":
+            node["fixture_type"] = next(iter(node["fixtures"]), "洗面器 (私)")
+            node["fixtures"] = {}
+        del node["_line"]
+        counts[node_type] += 1
+    report = {"rows": len(pipes) - 1, "counts": counts, "unmapped_columns": unmapped,
+              "fixture_columns": list(fixture_cols.values())}
+    return pipes, report
+
+def _find_cycles(pipes, index):
+    """親をたどってポンプに戻らないノードを探す (各ノードは1回だけ訪問)"""
+    state = {pipes[0]["id"]: 2}  # 1: 現在の経路上, 2: 確認済み
+    problems = []
+    for node in pipes[1:]:
+        path = []
+        cur = node
+        while state.get(cur["id"]) is None:
+            state[cur["id"]] = 1
+            path.append(cur)
+            cur = index[cur["parent"]]
+        if state[cur["id"]] == 1:
+            start = next(i for i, n in enumerate(path) if n["id"] == cur["id"])
+            loop = " → ".join(n["id"] for n in path[start:][:10])
+            problems.append(f"{cur['_line']}行目: 親IDが循環しています ({loop} → {cur['id']})")
+        for n in path: state[n["id"]] = 2
+    return problems
+
+def iter_csv_rows(stream, encoding):
+    text = io.TextIOWrapper(stream, encoding=encoding, newline="")
+    try:
+        yield from csv.reader(text)
+    finally:
+        text.detach()
+
+def iter_xlsx_rows(stream, sheet_name=None):
+    import openpyxl
+    wb = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    try:
+        ws = wb[sheet_name] if sheet_name else wb.worksheets[0]
+        yield from ws.iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+def import_edge_list(source, filename=None, fixture_specs=None, sheet_name=None):
+    """CSV / XLSX (パスまたはバイナリのファイルオブジェクト) から (pipes, report) を得る
+
+    CSV は UTF-8 (BOM可) で読み、デコードできなければ Shift_JIS (cp932) で読み直す。
+    """
+    if isinstance(source, (str, os.PathLike)):
+        filename = filename or os.fspath(source)
+        with open(source, "rb") as f:
+            return import_edge_list(f, filename, fixture_specs, sheet_name)
+    name = (filename or getattr(source, "name", "") or "").lower()
+    if name.endswith((".xlsx", ".xlsm")):
+        return build_pipes(iter_xlsx_rows(source, sheet_name), fixture_specs)
+    start = source.tell()
+    for encoding in CSV_ENCODINGS:
+        source.seek(start)
+        try:
+            return build_pipes(iter_csv_rows(source, encoding), fixture_specs)
+        except UnicodeDecodeError:
+            continue
+    raise ValueError("CSVの文字コードを判別できません (UTF-8 または Shift_JIS で保存してください)")
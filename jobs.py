@@ -0,0 +1,118 @@
+# jobs.py
+"""Excel / PDF 作成のバックグラウンド実行
+
+画面のボタンは内容 (計算書の行・系統図の DOT) をそろえて JobQueue.submit() に渡すだけで、
+重い処理 (pd.ExcelWriter、graphviz の描画) はワーカースレッドで実行される。
+スクリプトの実行は待たずに終わるので、画面は操作できるまま状態を問い合わせて表示する。
+
+  - ジョブは ID で引き、状態は 待機中 → 作成中 → 完了 / エラー と進む。
+  - 結果はキューの中に持つ (st.session_state には ID だけを置く)。完了した結果の合計が
+    max_bytes を超えたら古いものから捨てる。
+  - 内容のハッシュが同じジョブが待機中・作成中・完了済みなら、新しく作らずにそれを返す。
+    エラーになったジョブは再投入できる。
+ワーカーをプロセスではなくスレッドにしているのは、画面側の計算ツリー (app.py の
+PipeSection) をそのまま渡さず行データや DOT だけを渡せば足り、exe 版でも動かすため。
+graphviz の描画は外部プロセスなので並行に進む。
+"""
+import hashlib
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+STATUS_LABELS = {QUEUED: "待機中", RUNNING: "作成中", DONE: "完了", FAILED: "エラー"}
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+def content_key(kind, *parts):
+    """ジョブ内容のハッシュ (parts は str / bytes)"""
+    h = hashlib.sha256(kind.encode("utf-8"))
+    for part in parts:
+        h.update(b"\0")
+        h.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+    return h.hexdigest()
+
+class Job:
+    def __init__(self, job_id, kind, key):
+        self.id = job_id
+        self.kind = kind
+        self.key = key
+        self.status = QUEUED
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.reused = 0
+
+    @property
+    def pending(self):
+        return self.status in (QUEUED, RUNNING)
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.time()) - (self.started or self.submitted)
+
+    @property
+    def label(self):
+        return STATUS_LABELS[self.status]
+
+class JobQueue:
+    def __init__(self, workers=DEFAULT_WORKERS, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export-job")
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._jobs = {}      # ID → Job (投入順)
+        self._by_key = {}    # 内容のハッシュ → ID
+        self._bytes = 0
+
+    def submit(self, kind, key, func, *args):
+        """func(*args) を実行するジョブ。同じ key のジョブがあればそれを返す"""
+        with self._lock:
+            job = self._jobs.get(self._by_key.get(key))
+            if job is not None and job.status != FAILED:
+                job.reused += 1
+                return job
+            job = Job(f"{kind}-{next(self._ids)}", kind, key)
+            self._jobs[job.id] = job
+            self._by_key[key] = job.id
+        self._executor.submit(self._run, job, func, args)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, func, args):
+        job.started = time.time()
+        job.status = RUNNING
+        try:
+            result = func(*args)
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            job.status = FAILED
+        else:
+            job.result = result
+            job.status = DONE
+        job.finished = time.time()
+        with self._lock:
+            if job.status == DONE: self._bytes += len(job.result)
+            self._evict()
+
+    def _evict(self):
+        # 完了済みの古いジョブから結果ごと捨てる (待機中・作成中は残す)
+        for job_id in list(self._jobs):
+            if self._bytes <= self.max_bytes: break
+            job = self._jobs[job_id]
+            if job.pending: continue
+            if job.status == DONE: self._bytes -= len(job.result)
+            del self._jobs[job_id]
+            if self._by_key.get(job.key) == job_id: del self._by_key[job.key]
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {"jobs": len(jobs), "pending": sum(j.pending for j in jobs), "bytes": self._bytes,
+                "reused": sum(j.reused for j in jobs)}
@@ -0,0 +1,125 @@
+# loadtest.py
+"""計算サービス (service.py) の負荷試験
+
+合成プロジェクト (synthetic.py) を distinct 種類作り、種別 (calculate / excel / dot / pdf) を
+--mix の比率で混ぜたリクエストを concurrency 本の接続から送る。同じプロジェクトが
+同時に送られるので、実行中リクエストのまとめ (coalesced) と 503 の件数も確認できる。
+種別ごとの応答時間 (p50 / p95 / p99)・ステータス別件数・スループットを JSON で出力する。
+
+    python service.py --port 8765 &
+    python loadtest.py --url http://127.0.0.1:8765 --requests 500 --concurrency 32 --nodes 1000
+"""
+import argparse
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import synthetic
+
+DEFAULT_MIX = "calculate=0.7,excel=0.2,pdf=0.1"
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        mix[kind.strip()] = float(weight or 1)
+    return mix
+
+def make_bodies(scenario, nodes, distinct, seed=0):
+    bodies = []
+    for i in range(distinct):
+        pipes, building_type, is_fv = synthetic.generate(scenario, nodes, seed=seed + i)
+        bodies.append(json.dumps({"project": pipes, "building_type": building_type, "is_fv": is_fv},
+                                 ensure_ascii=False).encode("utf-8"))
+    return bodies
+
+def percentile(values, p):
+    if not values: return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))], 4)
+
+class Client:
+    """スレッドごとに keep-alive の接続を1本持つ"""
+    def __init__(self, url, timeout):
+        parts = urlsplit(url)
+        self.host, self.port, self.timeout = parts.hostname, parts.port or 80, timeout
+        self.local = threading.local()
+
+    def request(self, method, path, body=None):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            conn.request(method, path, body=body, headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            return response.status, response.read()
+        except (ConnectionError, http.client.HTTPException):
+            conn.close()
+            self.local.conn = None
+            raise
+
+def run(url, bodies, mix, n_requests, concurrency, seed=0, timeout=600):
+    rng = random.Random(seed)
+    kinds, weights = list(mix), list(mix.values())
+    plan = [(rng.choices(kinds, weights)[0], rng.randrange(len(bodies))) for _ in range(n_requests)]
+    client = Client(url, timeout)
+    latencies = {kind: [] for kind in kinds}
+    statuses = {}
+    lock = threading.Lock()
+
+    def one(item):
+        kind, i = item
+        t0 = time.perf_counter()
+        try:
+            status, _ = client.request("POST", f"/{kind}", bodies[i])
+        except (OSError, http.client.HTTPException):
+            status = "error"
+        elapsed = time.perf_counter() - t0
+        with lock:
+            statuses.setdefault(kind, {}).setdefault(str(status), 0)
+            statuses[kind][str(status)] += 1
+            if status == 200: latencies[kind].append(elapsed)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, plan))
+    wall = time.perf_counter() - t0
+    status_code, server = client.request("GET", "/status")
+    return {
+        "requests": n_requests, "concurrency": concurrency, "wall_s": round(wall, 3),
+        "throughput_rps": round(n_requests / wall, 2) if wall > 0 else None,
+        "kinds": {kind: {"ok": len(v), "p50_s": percentile(v, 50), "p95_s": percentile(v, 95),
+                         "p99_s": percentile(v, 99), "status": statuses.get(kind, {})}
+                  for kind, v in latencies.items()},
+        "server": json.loads(server) if status_code == 200 else None,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="計算サービスの負荷試験")
+    parser.add_argument("--url", default="http://127.0.0.1:8765")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--scenario", default="tower", choices=list(synthetic.SCENARIOS))
+    parser.add_argument("--nodes", type=int, default=1000, help="プロジェクトのノード数 (概算)")
+    parser.add_argument("--distinct", type=int, default=4, help="異なるプロジェクトの数 (少ないほど同時の重複が増える)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="種別の比率 (例: calculate=0.7,excel=0.2,pdf=0.1)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="結果 JSON の出力先 (省略時は標準出力)")
+    args = parser.parse_args(argv)
+
+    bodies = make_bodies(args.scenario, args.nodes, args.distinct, args.seed)
+    result = run(args.url, bodies, parse_mix(args.mix), args.requests, args.concurrency, args.seed)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f: f.write(text)
+    else:
+        print(text)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
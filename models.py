@@ -1,11 +1,13 @@
 # models.py
 import math
-import pandas as pd
-from constants import FIXTURE_SPECS, FIXTURE_DATA, SU_FLOW_CAPACITY
-from utils import interpolate_flow, get_display_size
+from constants import FIXTURE_SPECS, FIXTURE_DATA, SU_FLOW_CAPACITY, MPA_TO_HEAD_M
+from utils import interpolate_flow, get_display_size, get_pipe_catalog
+from templates import repeat_count
+from tree_arrays import LoadTable
+from friction import is_darcy, darcy_loss, apply_darcy_weisbach
 
 class PipeSection:
-    def __init__(self, id, name, type, fixtures=None, manual_size=None, dwelling_count=1, person_count=0, specific_pipe_type=None, length=2.0, is_fixed_flow=False, fixed_flow_val=0.0, is_manual_critical=False, static_head=0.0, required_pressure=0.0, equivalent_length=0.0, inner_pipe_length=2.0, fixture_type=None):
+    def __init__(self, id, name, type, fixtures=None, manual_size=None, dwelling_count=1, person_count=0, specific_pipe_type=None, length=2.0, is_fixed_flow=False, fixed_flow_val=0.0, is_manual_critical=False, static_head=0.0, required_pressure=0.0, equivalent_length=0.0, inner_pipe_length=2.0, fixture_type=None, repeat=1, template_id=None, template_cache=None):
         self.id = id
         self.name = name
         self.type = type
@@ -23,6 +25,13 @@ class PipeSection:
         self.is_fixed_flow = is_fixed_flow
         self.fixed_flow_val = fixed_flow_val
         self.is_manual_critical = is_manual_critical
+        # テンプレート参照 (同じテンプレートのノードは template_cache を共有する)
+        self.repeat = repeat
+        self.template_id = template_id
+        self.template_cache = template_cache
+        # build_tree が設定する器具構成の行列表現と自ノードの行番号
+        self.load_table = None
+        self.row = None
         self.children = []
         self.parent_name = ""
         self.parent_id = None
@@ -36,6 +45,7 @@ class PipeSection:
         self.size = "-"
         self.velocity = 0.0
         self.head_loss = 0.0
+        self.inner_diameter = 0.0
         self.cum_head_loss = 0.0
         self.cum_length = 0.0
         self.is_manual = False
@@ -52,22 +62,31 @@ class PipeSection:
     def calculate_self_stats(self, building_type, fixture_specs=None):
         # カスタム器具データがなければデフォルトを使用
         specs = fixture_specs if fixture_specs else FIXTURE_SPECS
-        # 負荷単位辞書を生成
-        f_data = {k: v["lu"] for k, v in specs.items()}
-        
-        load = 0.0
-        count = 0
-        for fname_key, qty in self.fixtures.items():
-            if qty > 0:
-                count += qty
-                if fname_key in f_data:
-                    load += qty * f_data[fname_key]
-        
-        if self.type == "fixture" and self.fixture_type:
-            spec = specs.get(self.fixture_type)
-            if spec:
-                load = spec["lu"]
-                count = 1
+        cache_key = ("stats", id(specs))
+        if self.load_table is not None:
+            table = self.load_table.stats(specs)
+            load, count = table["load"][self.row], table["count"][self.row]
+        elif self.template_cache is not None and cache_key in self.template_cache:
+            load, count = self.template_cache[cache_key]
+        else:
+            # 負荷単位辞書を生成
+            f_data = {k: v["lu"] for k, v in specs.items()}
+
+            load = 0.0
+            count = 0
+            for fname_key, qty in self.fixtures.items():
+                if qty > 0:
+                    count += qty
+                    if fname_key in f_data:
+                        load += qty * f_data[fname_key]
+
+            if self.type == "fixture" and self.fixture_type:
+                spec = specs.get(self.fixture_type)
+                if spec:
+                    load = spec["lu"]
+                    count = 1
+            if self.template_cache is not None:
+                self.template_cache[cache_key] = (load, count)
         
         self.load_units = load
         self.fixture_count = count
@@ -105,6 +124,11 @@ class PipeSection:
         self.system_total = self.system_count + child_system_sum
         self.person_total = self.person_count_val + child_person_sum
         self.fixture_total = self.fixture_count + child_fixture_sum
+        if self.load_table is not None:
+            # 負荷単位・器具数の配下合計はツリー集約で一括計算済み
+            table = self.load_table.stats(fixture_specs if fixture_specs else FIXTURE_SPECS)
+            self.total_load = table["subtree_load"][self.row]
+            self.fixture_total = table["subtree_count"][self.row]
         
         auto_flow = 0.0
         auto_desc = ""
@@ -146,16 +170,15 @@ class PipeSection:
         q_m3s = self.flow_lpm / 60000
         target_pipe_type = self.specific_pipe_type if self.specific_pipe_type else default_pipe_type
         self.used_pipe_type = target_pipe_type
-        current_specs_df = pd.DataFrame(all_pipe_db.get(target_pipe_type, []))
+        size_to_dmm, sizes_by_diameter = get_pipe_catalog(all_pipe_db, target_pipe_type)
         d_mm_actual = 0.0
         
         if self.manual_size and self.manual_size != "自動計算":
             self.size = self.manual_size
             self.is_manual = True
-            if not current_specs_df.empty:
-                row = current_specs_df[current_specs_df["サイズ"] == self.manual_size]
-                if not row.empty and q_m3s > 0:
-                    d_mm_actual = row.iloc[0]["内径(mm)"]
+            if size_to_dmm:
+                if self.manual_size in size_to_dmm and q_m3s > 0:
+                    d_mm_actual = size_to_dmm[self.manual_size]
                     area = math.pi * ((d_mm_actual/1000)/2)**2
                     self.velocity = round(q_m3s / area, 2)
                 else: self.velocity = 0.0
@@ -170,24 +193,21 @@ class PipeSection:
                 for size_name, cap_lpm in sorted_capacity:
                     if self.flow_lpm <= cap_lpm:
                         best_size = size_name
-                        row = current_specs_df[current_specs_df["サイズ"] == size_name]
-                        if not row.empty:
-                            d_mm_actual = row.iloc[0]["内径(mm)"]
+                        if size_name in size_to_dmm:
+                            d_mm_actual = size_to_dmm[size_name]
                             area = math.pi * ((d_mm_actual/1000)/2)**2
                             best_vel = round(q_m3s / area, 2) if area > 0 else 0.0
                         found_su = True
                         break
                 if not found_su and self.flow_lpm > 0: best_size = "規格外(過大)"
             else:
-                if not current_specs_df.empty:
-                    sorted_specs = current_specs_df.sort_values("内径(mm)")
-                    for _, row in sorted_specs.iterrows():
-                        d_mm = row["内径(mm)"]
+                if sizes_by_diameter:
+                    for size_name, d_mm in sizes_by_diameter:
                         area = math.pi * ((d_mm/1000)/2)**2
                         if area <= 0: continue
                         vel = q_m3s / area
                         if vel <= max_velocity:
-                            best_size = row["サイズ"]
+                            best_size = size_name
                             best_vel = round(vel, 2)
                             d_mm_actual = d_mm
                             break
@@ -195,8 +215,10 @@ class PipeSection:
             self.velocity = best_vel
             
         self.head_loss = 0.0
+        self.inner_diameter = d_mm_actual
         self.loss_params_used = loss_params.copy() if loss_params else {}
-        if loss_params and d_mm_actual > 0 and q_m3s > 0:
+        # ダルシー・ワイスバッハ式はルートの計算の最後に全区間まとめて求める
+        if loss_params and d_mm_actual > 0 and q_m3s > 0 and not is_darcy(loss_params):
             C_val = loss_params.get("C", 130.0)
             fit_rate = loss_params.get("fitting", 1.2)
             D_m = d_mm_actual / 1000.0
@@ -206,8 +228,11 @@ class PipeSection:
         
         self.critical_inner_loss = 0.0
         specs = fixture_specs if fixture_specs else FIXTURE_SPECS
-        
-        if self.type == "system" and self.fixtures:
+        # テンプレートの器具接続管損失は管種・計算条件が同じなら一度だけ計算する
+        inner_key = ("inner", id(specs), self.used_pipe_type, is_fv, tuple(sorted(loss_params.items())) if loss_params else None)
+        if self.template_cache is not None and inner_key in self.template_cache:
+            self.critical_inner_loss = self.template_cache[inner_key]
+        elif self.type == "system" and self.fixtures:
             max_inner_loss = 0.0
             for f_name, qty in self.fixtures.items():
                 if qty <= 0: continue
@@ -215,21 +240,29 @@ class PipeSection:
                 if not spec: continue
                 f_size_a = spec["size_a"]
                 f_d_mm = 16.0 
-                specs_df = pd.DataFrame(all_pipe_db.get(self.used_pipe_type, []))
-                if not specs_df.empty:
+                inner_sizes, _ = get_pipe_catalog(all_pipe_db, self.used_pipe_type)
+                if inner_sizes:
                     search_str = get_display_size(f_size_a, self.used_pipe_type)
-                    row = specs_df[specs_df["サイズ"] == search_str]
-                    if not row.empty: f_d_mm = row.iloc[0]["内径(mm)"]
+                    if search_str in inner_sizes: f_d_mm = inner_sizes[search_str]
                 if f_d_mm > 0 and loss_params:
                     f_lu = spec["lu"]
                     f_flow_lpm = interpolate_flow(f_lu, is_fv)
                     f_q_m3s = f_flow_lpm / 60000
                     f_D_m = f_d_mm / 1000.0
                     f_L_eq = self.inner_pipe_length * loss_params.get("fitting", 1.2)
-                    f_h = 10.666 * (loss_params.get("C", 130.0) ** -1.852) * (f_D_m ** -4.87) * (f_q_m3s ** 1.852) * f_L_eq
+                    if is_darcy(loss_params):
+                        f_h = darcy_loss(f_q_m3s, f_d_mm, f_L_eq, self.used_pipe_type, loss_params)
+                    else:
+                        f_h = 10.666 * (loss_params.get("C", 130.0) ** -1.852) * (f_D_m ** -4.87) * (f_q_m3s ** 1.852) * f_L_eq
                     if f_h > max_inner_loss: max_inner_loss = f_h
             self.critical_inner_loss = max_inner_loss
-        return self.total_load, self.system_total, self.person_total, self.fixture_total
+            if self.template_cache is not None:
+                self.template_cache[inner_key] = max_inner_loss
+        if self.parent_id is None and is_darcy(loss_params):
+            apply_darcy_weisbach(self, loss_params)
+        # 繰り返しノードは同一系統 repeat 台分を上流へ渡す (自区間は1台分で選定)
+        r = self.repeat
+        return self.total_load * r, self.system_total * r, self.person_total * r, self.fixture_total * r
 
     def calculate_cumulative_loss(self, parent_cum_loss=0.0, parent_cum_len=0.0):
         self.cum_head_loss = parent_cum_loss + self.head_loss
@@ -241,7 +274,7 @@ class PipeSection:
         all_terminals = self.get_all_terminals()
         if not all_terminals: return self
         def get_total_head(t):
-            req_head_m = t.required_pressure
+            req_head_m = t.required_pressure * MPA_TO_HEAD_M
             return t.cum_head_loss + t.static_head + req_head_m + t.critical_inner_loss
         manual_targets = [t for t in all_terminals if t.is_manual_critical]
         if manual_targets: return max(manual_targets, key=get_total_head)
@@ -256,12 +289,13 @@ class PipeSection:
     def get_excel_data(self):
         data = []
         if self.id != "root":
-            section_name = f"{self.parent_name} → {self.name}"
+            end_name = f"{self.name} ×{self.repeat}" if self.repeat > 1 else self.name
+            section_name = f"{self.parent_name} → {end_name}"
             node_type_str = "分岐"
             if self.type == "system": node_type_str = "系統(PS)"
             elif self.type == "fixture": node_type_str = "器具"
             row = {
-                "区間名称": section_name, "始点": self.parent_name, "終点": self.name,
+                "区間名称": section_name, "始点": self.parent_name, "終点": end_name,
                 "種別": node_type_str, "流量 (L/min)": round(self.flow_lpm, 1),
                 "管種": self.used_pipe_type, "口径": self.size,
                 "流速 (m/s)": self.velocity, "管長 (m)": self.length,
@@ -270,4 +304,52 @@ class PipeSection:
             }
             data.append(row)
         for child in self.children: data.extend(child.get_excel_data())
-        return data
\ No newline at end of file
+        return data
+
+def build_tree(pipes, templates=None):
+    """保存形式のノードリストから PipeSection のツリーを構築する (node_map, root_node)
+
+    templates を渡すとテンプレート参照ノードの値を引き継ぎ、計算キャッシュを共有させる。
+    """
+    templates = templates or {}
+    template_caches = {tid: {} for tid in templates}
+    def tpl_value(p, key, default):
+        tpl = templates.get(p.get("template"))
+        return tpl.get(key, default) if tpl else p.get(key, default)
+    node_map = {
+        p["id"]: PipeSection(
+            p["id"], p["name"], p["type"], tpl_value(p, "fixtures", {}),
+            p.get("manual_size"), tpl_value(p, "dwelling_count", 1),
+            tpl_value(p, "person_count", 0), p.get("specific_pipe_type"),
+            p.get("length", 2.0),
+            p.get("is_fixed_flow", False), p.get("fixed_flow_val", 0.0),
+            p.get("is_manual_critical", False),
+            p.get("static_head", 0.0), p.get("required_pressure", 0.0),
+            p.get("equivalent_length", 0.0),
+            tpl_value(p, "inner_pipe_length", 2.0),
+            p.get("fixture_type", None),
+            repeat_count(p), p.get("template"), template_caches.get(p.get("template"))
+        ) for p in pipes
+    }
+    load_table = LoadTable.from_pipes(pipes, templates)
+    root_node = None
+    for row, p in enumerate(pipes):
+        node = node_map[p["id"]]
+        node.load_table, node.row = load_table, row
+        if p["parent"]:
+            parent = node_map.get(p["parent"])
+            if parent: parent.add_child(node)
+        else:
+            root_node = node
+    return node_map, root_node
+
+def get_route(node, node_map):
+    """ルートから node までの経路 (ルート → 末端の順)"""
+    path_nodes = []
+    curr = node
+    while curr:
+        path_nodes.append(curr)
+        if curr.parent_id and curr.parent_id in node_map: curr = node_map[curr.parent_id]
+        else: curr = None
+    path_nodes.reverse()
+    return path_nodes
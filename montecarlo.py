@@ -0,0 +1,202 @@
+# montecarlo.py
+"""器具の同時使用のモンテカルロシミュレーション
+
+負荷単位法・BL基準などの経験式で決めた設計流量を、確率モデルで検証する。
+各器具はピーク時のある瞬間に確率 p で使用中 (吐水量 q L/min) とし、
+試行ごとに全器具の使用状態を引いて各区間を流れる流量の分布を求める。
+
+配列化の方法:
+  - ノード自身の器具構成 (系統の器具・器具ノード) ごとに「吐水量合計」の離散分布を
+    二項分布のたたみ込みで1回だけ求め、試行ごとの値は一様乱数1個と累積分布の
+    二分探索で引く (同じ構成のノードは同じ分布を共有する)。
+  - 繰り返しノード (×N) の残り N-1 台分は、配下の器具数 × (N-1) の二項分布で
+    器具種別ごとにまとめて引く (上流の流量の分布は器具の総数だけで決まるため)。
+  - 区間流量は深い階層から親へ1段ずつ足し上げる (ノード × 試行 の配列演算)。
+試行はチャンクに分けて実行し、パーセンタイルに必要な上側の値だけを残すので、
+メモリはノード数 × (チャンク + 上側の件数) 程度で済む。workers > 1 ではチャンクを
+プロセスに分けて並列に実行する (乱数はチャンクごとに SeedSequence から作るので、
+workers の数によらず結果は同じ)。
+"""
+import math
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from constants import FIXTURE_USAGE, DEFAULT_FIXTURE_USAGE
+
+DEFAULT_TRIALS = 10000
+DEFAULT_PERCENTILES = (50.0, 95.0, 99.0)
+DEFAULT_CHUNK = 4000
+PRUNE_PROB = 1e-13   # これより小さい確率の組合せは分布から除く
+
+def usage_of(name, usage=None):
+    usage = FIXTURE_USAGE if usage is None else usage
+    return usage.get(name) or DEFAULT_FIXTURE_USAGE
+
+def own_fixtures(node):
+    """ノード自身の器具構成 {器具: 個数} (calculate_self_stats と同じく器具ノードは種別1個)"""
+    if node.type == "fixture" and node.fixture_type:
+        return {node.fixture_type: 1}
+    return {name: qty for name, qty in node.fixtures.items() if qty > 0}
+
+def binomial_pmf(n, p):
+    """k = 0..n の二項分布の確率"""
+    if p <= 0: return [1.0] + [0.0] * n
+    if p >= 1: return [0.0] * n + [1.0]
+    lp, lq = math.log(p), math.log1p(-p)
+    lg = math.lgamma(n + 1)
+    return [math.exp(lg - math.lgamma(k + 1) - math.lgamma(n - k + 1) + k * lp + (n - k) * lq) for k in range(n + 1)]
+
+def flow_distribution(fixtures, usage=None):
+    """器具構成の吐水量合計 (L/min) の離散分布 (値の昇順配列, 累積確率の配列)"""
+    dist = {0.0: 1.0}
+    for name, qty in sorted(fixtures.items()):
+        u = usage_of(name, usage)
+        n, q = int(round(qty)), float(u["flow"])
+        if n <= 0 or q <= 0 or u["p"] <= 0: continue
+        pmf = binomial_pmf(n, float(u["p"]))
+        new = {}
+        for v, pv in dist.items():
+            for k, pk in enumerate(pmf):
+                pr = pv * pk
+                if pr < PRUNE_PROB: continue
+                key = round(v + k * q, 6)
+                new[key] = new.get(key, 0.0) + pr
+        dist = new
+    values = np.array(sorted(dist), dtype=float)
+    cdf = np.cumsum([dist[v] for v in values])
+    return values, cdf / cdf[-1]
+
+class SimulationModel:
+    """ツリーと器具構成のシミュレーション用の配列表現 (ワーカープロセスへそのまま渡す)"""
+    def __init__(self, root, usage=None):
+        order, stack, depth = [], [(root, 0)], []
+        while stack:
+            node, d = stack.pop()
+            order.append(node); depth.append(d)
+            stack.extend((c, d + 1) for c in reversed(node.children))
+        self.ids = [n.id for n in order]
+        self.names = [n.name for n in order]
+        self.design_flow = np.array([n.flow_lpm for n in order], dtype=float)
+        index = {n.id: i for i, n in enumerate(order)}
+        parent = np.array([index.get(n.parent_id, -1) if n is not root else -1 for n in order], dtype=np.int64)
+        depth = np.array(depth, dtype=np.int64)
+
+        # 階層ごとの足し上げ: (子の行, 親の行, reduceat の区切り)。深い階層から順に並べる
+        self.levels = []
+        for d in range(int(depth.max()), 0, -1):
+            children = np.flatnonzero(depth == d)
+            children = children[np.argsort(parent[children], kind="stable")]
+            parents, starts = np.unique(parent[children], return_index=True)
+            self.levels.append((children, parents, starts))
+
+        # 自身の器具構成ごとの分布 (同じ構成は1回だけ求める)
+        own = [own_fixtures(n) for n in order]
+        groups = {}
+        for i, fixtures in enumerate(own):
+            if fixtures: groups.setdefault(tuple(sorted(fixtures.items())), []).append(i)
+        self.classes = []
+        for key, rows in groups.items():
+            values, cdf = flow_distribution(dict(key), usage)
+            if values[-1] > 0:
+                self.classes.append((values, cdf, np.array(rows, dtype=np.int64)))
+
+        # 繰り返しノードの残り台数分: 配下の器具数 (1台分) × (repeat - 1) を器具種別ごとに
+        subtree = [None] * len(order)
+        for i in range(len(order) - 1, -1, -1):
+            counts = dict(own[i])
+            for c in order[i].children:
+                for name, qty in subtree[index[c.id]].items():
+                    counts[name] = counts.get(name, 0) + qty * c.repeat
+            subtree[i] = counts
+        rows, n_fix, probs, flows = [], [], [], []
+        for i, node in enumerate(order):
+            if node.repeat <= 1 or node is root: continue
+            for name, qty in subtree[i].items():
+                u = usage_of(name, usage)
+                n = int(round(qty * (node.repeat - 1)))
+                if n > 0 and u["p"] > 0 and u["flow"] > 0:
+                    rows.append(i); n_fix.append(n); probs.append(u["p"]); flows.append(u["flow"])
+        self.extra_rows = np.array(rows, dtype=np.int64)
+        self.extra_n = np.array(n_fix, dtype=np.int64)
+        self.extra_p = np.array(probs, dtype=float)
+        self.extra_flow = np.array(flows, dtype=float)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def run(self, trials, seed):
+        """trials 回分の各区間流量 (ノード × 試行)"""
+        rng = np.random.default_rng(seed)
+        flow = np.zeros((len(self.ids), trials))
+        for values, cdf, rows in self.classes:
+            u = rng.random((len(rows), trials))
+            flow[rows] = values[np.minimum(np.searchsorted(cdf, u, side="right"), len(values) - 1)]
+        extra = np.zeros_like(flow)
+        if len(self.extra_rows):
+            draws = rng.binomial(self.extra_n[:, None], self.extra_p[:, None], size=(len(self.extra_rows), trials))
+            np.add.at(extra, self.extra_rows, draws * self.extra_flow[:, None])
+        for children, parents, starts in self.levels:
+            flow[parents] += np.add.reduceat(flow[children] + extra[children], starts, axis=0)
+        return flow
+
+def _keep_top(tail, block, k):
+    """行ごとに上位 k 個 (順不同) を残す"""
+    both = block if tail is None else np.concatenate([tail, block], axis=1)
+    if both.shape[1] > k:
+        both = np.partition(both, both.shape[1] - k, axis=1)[:, -k:]
+    return both
+
+def _run_chunk(model, trials, seed, k):
+    flow = model.run(trials, seed)
+    return flow.sum(axis=1), _keep_top(None, flow, k).astype(np.float32)
+
+_worker_model = None
+
+def _init_worker(model):
+    global _worker_model
+    _worker_model = model
+
+def _run_chunk_in_worker(args):
+    return _run_chunk(_worker_model, *args)
+
+def simulate(root, trials=DEFAULT_TRIALS, percentiles=DEFAULT_PERCENTILES, usage=None, seed=0, workers=1,
+             chunk=DEFAULT_CHUNK, model=None):
+    """各区間のピーク流量のパーセンタイル表 (DataFrame、行きがけ順)
+
+    calculate() の後に呼ぶ (設計流量との比較に flow_lpm を使う)。ツリーは変更しない。
+    """
+    model = model or SimulationModel(root, usage)
+    percentiles = sorted(float(p) for p in percentiles)
+    trials = int(trials)
+    # 上側の何件を残せば最小のパーセンタイルまで求まるか
+    k = max(1, trials - int(math.floor(percentiles[0] / 100 * (trials - 1))))
+    sizes = [min(chunk, trials - start) for start in range(0, trials, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(n, s, min(k, n)) for n, s in zip(sizes, seeds)]
+
+    total = np.zeros(len(model))
+    tail = None
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model,)) as pool:
+            for sums, top in pool.map(_run_chunk_in_worker, tasks):
+                total += sums; tail = _keep_top(tail, top, k)
+    else:
+        for task in tasks:
+            sums, top = _run_chunk(model, *task)
+            total += sums; tail = _keep_top(tail, top, k)
+    tail = np.sort(tail, axis=1).astype(float)
+
+    df = pd.DataFrame({"区間": model.names, "設計流量 (L/min)": model.design_flow.round(1),
+                       "平均 (L/min)": (total / trials).round(1)}, index=model.ids)
+    offset = trials - tail.shape[1]
+    for p in percentiles:
+        pos = p / 100 * (trials - 1)
+        lo, hi = int(math.floor(pos)) - offset, int(math.ceil(pos)) - offset
+        value = tail[:, lo] + (tail[:, hi] - tail[:, lo]) * (pos - math.floor(pos))
+        df[f"P{p:g} (L/min)"] = value.round(1)
+    df["最大 (L/min)"] = tail[:, -1].round(1)
+    top_label = f"P{percentiles[-1]:g} (L/min)"
+    df[f"設計/P{percentiles[-1]:g}"] = np.where(df[top_label] > 0, (df["設計流量 (L/min)"] / df[top_label].where(df[top_label] > 0, 1)).round(2), math.nan)
+    return df
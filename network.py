@@ -0,0 +1,221 @@
+# network.py
+"""ループ (環状配管) を含む管網の計算
+
+ノード dict の "loop_links" に [{"to": 接続先ID, "length": m, "size": 口径, "pipe_type": 管種}]
+を持たせると、ツリーの区間に加えてその連絡管があるものとして解く。
+ループがなければ何もせず、従来のツリー計算の結果がそのまま使われる。
+
+解き方 (全体勾配法 / Global Gradient Algorithm):
+  1. calculate() で得た各区間の設計流量のうち、ループ網 (連絡管の両端からルートまでの経路)
+     の外に出る枝の流量を、その枝が分かれる網内ノードの需要とする
+     (合計は網に入る流量 = ルート直下の網内区間の設計流量に合わせて比例配分。
+     ルートから直接網の外へ出る枝は網を通らないので含めない)。
+  2. 網内の区間と連絡管について、ヘーゼン・ウィリアムス式 h = r·Q|Q|^0.852 と
+     節点の連続式をニュートン法で同時に解く (ダルシー・ワイスバッハ式では h = r·Q|Q|、
+     r は各反復の流量から求めた摩擦係数で更新する)。各反復の線形方程式
+     (Aᵀ G⁻¹ A) ΔH = Aᵀ G⁻¹ f₁ - f₂ は疎行列で組み立てて解く。
+  3. 網内区間の流量・流速・損失を置き換え、全ノードの累計損失を付け直す
+     (網の外の枝はツリー計算の損失をそのまま足す)。
+     口径はツリー計算で決めたものを使うので、流量の変わった網内区間と連絡管は
+     許容流速を超えていないか確かめ直す。
+計算式・C 値・継手割増率は loss_params を、内径は管種カタログを使う。
+"""
+import math
+
+import numpy as np
+
+from utils import get_pipe_catalog
+from friction import is_darcy, darcy_losses, roughness_mm, DEFAULT_TEMPERATURE_C
+
+HW_EXPONENT = 1.852
+MIN_FLOW_M3S = 1e-7   # 流量0の管でも勾配が消えないようにする下限
+DEFAULT_TOL_M3S = 1e-9
+DEFAULT_MAX_ITER = 50
+
+def has_loops(pipes):
+    return any(p.get("loop_links") for p in pipes)
+
+def resistance(d_mm, length, equivalent_length, loss_params):
+    """h = r·Q^1.852 の r (Q: m³/s, h: m、ヘーゼン・ウィリアムス式)"""
+    if d_mm <= 0: return 0.0
+    C_val = loss_params.get("C", 130.0)
+    fit_rate = loss_params.get("fitting", 1.2)
+    L_eq = (length * fit_rate) + equivalent_length
+    return 10.666 * (C_val ** -1.852) * ((d_mm / 1000.0) ** -4.87) * L_eq
+
+def _path_to_root(node, node_map):
+    path = []
+    while node is not None:
+        path.append(node)
+        node = node_map.get(node.parent_id) if node.parent_id else None
+    return path
+
+def collect_links(pipes, node_map):
+    """有効な連絡管 [(from_node, to_node, link_dict)]。存在しないノードへの連絡は無視する"""
+    links = []
+    for p in pipes:
+        for link in p.get("loop_links") or []:
+            a, b = node_map.get(p["id"]), node_map.get(link.get("to"))
+            if a is not None and b is not None and a is not b:
+                links.append((a, b, link))
+    return links
+
+def solve_network(root, node_map, pipes, all_pipe_db, loss_params, default_pipe_type=None,
+                  tol=DEFAULT_TOL_M3S, max_iter=DEFAULT_MAX_ITER, max_velocity=None):
+    """ループを含む管網を解き、ノードの流量・流速・損失・累計損失を書き換える
+
+    calculate() と calculate_cumulative_loss() の後に呼ぶ。ループがなければ None。
+    返り値: {"iterations", "converged", "pipes", "loops", "links": [連絡管ごとの結果],
+             "over_velocity": [max_velocity を超えた網内区間・連絡管]}
+    """
+    links = collect_links(pipes, node_map)
+    if not links or not loss_params: return None
+    from scipy import sparse
+    from scipy.sparse.linalg import spsolve
+
+    # 網内ノード = 連絡管の両端からルートまでの経路上のノード
+    core = {}
+    for a, b, _ in links:
+        for n in _path_to_root(a, node_map) + _path_to_root(b, node_map):
+            core.setdefault(n.id, n)
+    if root.id not in core: return None
+    unknown = [n for n in core.values() if n is not root]
+    col = {n.id: i for i, n in enumerate(unknown)}
+    n_nodes = len(unknown)
+
+    # 需要 (網の外へ出る枝の設計流量。網内の末端は自身の流量)。
+    # 枝ごとの設計流量の単純和は同時使用を無視した過大値になるので、
+    # 合計が網に入る設計流量 (ルート直下の網内区間の和) と等しくなるよう比例配分する。
+    # ルート直下で網の外へ出る枝の流量は網を通らない
+    demand = np.zeros(n_nodes)
+    for n in unknown:
+        outside = [c for c in n.children if c.id not in core]
+        if n.children:
+            demand[col[n.id]] = sum(c.flow_lpm * c.repeat for c in outside) / 60000
+        else:
+            demand[col[n.id]] = n.flow_lpm / 60000
+    inflow = sum(c.flow_lpm * c.repeat for c in root.children if c.id in core) / 60000
+    if demand.sum() > 0:
+        demand *= inflow / demand.sum()
+
+    # 管: 網内の区間 (親 → 子) と連絡管
+    frm, to, r, sections, link_info = [], [], [], [], []
+    d_list, L_list, eps_list = [], [], []
+    fit_rate = loss_params.get("fitting", 1.2)
+    for n in unknown:
+        size_to_dmm, _ = get_pipe_catalog(all_pipe_db, n.used_pipe_type)
+        d_mm = size_to_dmm.get(n.size, 0.0)
+        frm.append(col.get(n.parent_id, -1)); to.append(col[n.id])
+        r.append(resistance(d_mm, n.length, n.equivalent_length, loss_params))
+        d_list.append(d_mm); L_list.append(n.length * fit_rate + n.equivalent_length); eps_list.append(roughness_mm(n.used_pipe_type, loss_params))
+        sections.append(n)
+    for a, b, link in links:
+        pipe_type = link.get("pipe_type") or a.used_pipe_type or default_pipe_type
+        size_to_dmm, _ = get_pipe_catalog(all_pipe_db, pipe_type)
+        size = link.get("size")
+        if size not in size_to_dmm:
+            # 口径未指定なら両端の区間のうち大きい方の口径
+            size = max((a.size, b.size), key=lambda s: size_to_dmm.get(s, 0.0))
+        d_mm = size_to_dmm.get(size, 0.0)
+        length = float(link.get("length", 2.0))
+        frm.append(col.get(a.id, -1)); to.append(col.get(b.id, -1))
+        r.append(resistance(d_mm, length, 0.0, loss_params))
+        d_list.append(d_mm); L_list.append(length * fit_rate); eps_list.append(roughness_mm(pipe_type, loss_params))
+        link_info.append((a, b, pipe_type, size, d_mm))
+    n_pipes = len(r)
+    r = np.array(r)
+    darcy = is_darcy(loss_params)
+    exponent = 2.0 if darcy else HW_EXPONENT
+    d_arr, L_arr = np.array(d_list), np.array(L_list)
+    temperature = loss_params.get("temperature", DEFAULT_TEMPERATURE_C)
+
+    def darcy_resistance(Q):
+        # h = f·L/D·v²/2g = r·Q² (f は全管まとめて求める)
+        q = np.maximum(np.abs(Q), MIN_FLOW_M3S)
+        return darcy_losses(q, d_arr, L_arr, eps_list, temperature) / (q * q)
+
+    def floor_resistance(r):
+        # 内径が決まらない管は損失0の短絡として扱えないので、ごく小さな抵抗を与える
+        return np.where(r > 0, r, 1e-6)
+
+    # 接続行列 A (管 × 未知ノード): 始点 +1, 終点 -1。ルートは水頭0の既知節点
+    rows, cols, vals = [], [], []
+    for k in range(n_pipes):
+        if frm[k] >= 0: rows.append(k); cols.append(frm[k]); vals.append(1.0)
+        if to[k] >= 0: rows.append(k); cols.append(to[k]); vals.append(-1.0)
+    A = sparse.csr_matrix((vals, (rows, cols)), shape=(n_pipes, n_nodes))
+    At = A.T.tocsr()
+
+    # 初期流量: 連絡管を0としたツリー上の流量 (末端側から需要を足し上げる)
+    Q = np.zeros(n_pipes)
+    acc = demand.copy()
+    for n in reversed(_preorder(root, core)):
+        if n is root: continue
+        Q[col[n.id]] = acc[col[n.id]]
+        if n.parent_id in col: acc[col[n.parent_id]] += acc[col[n.id]]
+    H = np.zeros(n_nodes)
+    r = floor_resistance(r)
+
+    converged = False
+    iterations = 0
+    for iterations in range(1, max_iter + 1):
+        if darcy: r = floor_resistance(darcy_resistance(Q))
+        absQ = np.maximum(np.abs(Q), MIN_FLOW_M3S)
+        g = exponent * r * absQ ** (exponent - 1)
+        f1 = r * Q * absQ ** (exponent - 1) - A @ H
+        f2 = At @ Q + demand
+        g_inv = 1.0 / g
+        M = (At @ sparse.diags(g_inv) @ A).tocsc()
+        dH = spsolve(M, At @ (g_inv * f1) - f2)
+        dQ = g_inv * (A @ dH - f1)
+        H += dH
+        Q += dQ
+        if np.max(np.abs(dQ)) < tol and np.max(np.abs(At @ Q + demand)) < tol * 10:
+            converged = True
+            break
+
+    # 結果の書き戻し (流量・流速・損失は網内区間のみ、累計損失は全ノード)
+    if darcy: r = floor_resistance(darcy_resistance(Q))
+    head_loss = r * Q * np.abs(Q) ** (exponent - 1)
+    over_velocity = []
+    for k, n in enumerate(sections):
+        q = float(Q[k])
+        n.flow_lpm = abs(q) * 60000
+        n.velocity = _velocity(q, d_list[k])
+        n.head_loss = round(float(head_loss[k]), 3)
+        n.calc_description += " [ループ網]" if q >= 0 else " [ループ網・逆流]"
+        if max_velocity is not None and n.velocity > max_velocity:
+            over_velocity.append({"id": n.id, "name": n.name, "size": n.size, "velocity": n.velocity})
+    cum = {root.id: root.cum_head_loss}
+    for n in unknown: cum[n.id] = root.cum_head_loss - float(H[col[n.id]])
+    for n in _preorder(root):
+        if n.id in cum:
+            n.cum_head_loss = cum[n.id]
+        else:
+            parent = node_map[n.parent_id]
+            n.cum_head_loss = parent.cum_head_loss + n.head_loss
+
+    link_results = []
+    for j, (a, b, pipe_type, size, d_mm) in enumerate(link_info):
+        k = len(sections) + j
+        q = float(Q[k])
+        velocity = _velocity(q, d_mm)
+        link_results.append({
+            "from": a.id, "to": b.id, "from_name": a.name, "to_name": b.name, "pipe_type": pipe_type, "size": size,
+            "flow_lpm": q * 60000, "velocity": velocity, "head_loss": round(float(head_loss[k]), 3),
+        })
+        if max_velocity is not None and velocity > max_velocity:
+            over_velocity.append({"id": f"{a.id}⇄{b.id}", "name": f"{a.name} ⇄ {b.name}", "size": size, "velocity": velocity})
+    return {"iterations": iterations, "converged": converged, "pipes": n_pipes,
+            "loops": len(links), "links": link_results, "over_velocity": over_velocity}
+
+def _velocity(q_m3s, d_mm):
+    return round(abs(q_m3s) / (math.pi * ((d_mm / 1000) / 2) ** 2), 2) if d_mm > 0 else 0.0
+
+def _preorder(root, only=None):
+    order, stack = [], [root]
+    while stack:
+        n = stack.pop()
+        order.append(n)
+        stack.extend(c for c in reversed(n.children) if only is None or c.id in only)
+    return order
@@ -0,0 +1,80 @@
+# node_index.py
+"""構成ノードの検索用索引 (接続先の選択・配下一覧のページ分け用)
+
+画面でノードごとにボタンを作ると、数千ノードでは rerun のほとんどがウィジェットの作成になる。
+NodeIndex は pipes から1回の走査で
+  - 名称と ID (小文字化) を並べた索引 → 前方一致を二分探索で引く
+  - 親 → 子の ID リスト (pipes の並び順)
+  - 種別ごとの ID リスト
+を作り、画面側は検索結果や子の一覧を page_size 件ずつ表示する。
+1ページのボタン数は構成の大きさによらず一定になる。
+"""
+from bisect import bisect_left
+
+PAGE_SIZE = 20
+BREADCRUMB_DEPTH = 4     # パンくずに並べる祖先の数 (それより上は省略)
+TYPE_ICONS = {"root": "🏭", "branch": "🔵", "system": "🏠", "fixture": "🚰"}
+
+def page_bounds(total, page, page_size=PAGE_SIZE):
+    """(開始, 終了, 範囲内に丸めたページ番号, ページ数)"""
+    pages = max(1, -(-total // page_size))
+    page = min(max(0, page), pages - 1)
+    start = page * page_size
+    return start, min(total, start + page_size), page, pages
+
+class NodeIndex:
+    def __init__(self, pipes):
+        self.position = {}
+        self.nodes = []
+        self.children = {}
+        self.by_type = {}
+        entries = []
+        for i, p in enumerate(pipes):
+            nid = p["id"]
+            self.position[nid] = i
+            self.nodes.append(p)
+            self.children.setdefault(p["parent"], []).append(nid)
+            self.by_type.setdefault(p["type"], []).append(nid)
+            entries.append((p["name"].casefold(), i))
+            entries.append((nid.casefold(), i))
+        entries.sort()
+        self._keys = [k for k, _ in entries]
+        self._rows = [i for _, i in entries]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, node_id):
+        return node_id in self.position
+
+    def get(self, node_id):
+        i = self.position.get(node_id)
+        return None if i is None else self.nodes[i]
+
+    def label(self, node_id):
+        p = self.get(node_id)
+        return f"{TYPE_ICONS.get(p['type'], '')} {p['name']}" if p else node_id
+
+    def children_of(self, node_id):
+        return self.children.get(node_id, [])
+
+    def search(self, text, types=None):
+        """名称または ID が text で始まるノードの ID (pipes の並び順)。text が空なら types の全ノード"""
+        prefix = text.strip().casefold()
+        if not prefix:
+            rows = sorted(self.position[nid] for t in types or self.by_type for nid in self.by_type.get(t, []))
+            return [self.nodes[i]["id"] for i in rows]
+        lo = bisect_left(self._keys, prefix)
+        hi = bisect_left(self._keys, prefix + "\U0010ffff", lo)
+        rows = sorted(set(self._rows[lo:hi]))
+        if types: rows = [i for i in rows if self.nodes[i]["type"] in types]
+        return [self.nodes[i]["id"] for i in rows]
+
+    def path(self, node_id):
+        """起点から node_id までの ID リスト (親が見つからない・循環する場合はそこで止める)"""
+        path, seen = [], set()
+        while node_id in self.position and node_id not in seen:
+            seen.add(node_id)
+            path.append(node_id)
+            node_id = self.nodes[self.position[node_id]]["parent"]
+        return path[::-1]
@@ -0,0 +1,272 @@
+# optimizer.py
+"""ポンプ全揚程の上限を満たす最小コストの口径選定
+
+calculate() 済みのツリーに対し、各区間の候補口径 (許容流速以下、SU は流量表の容量以上)
+から材料費が最小になる組合せを、全揚程 = 累計損失 + 実揚程 + 必要圧力 + 器具接続損失
+が全末端で上限以下となる条件で選ぶ。
+
+揚程を bins 段階に離散化した木DP で解く:
+    g_v(b) = min_s [ 単価(s) × 管長 + Σ_子 g_c(b - 損失_v(s)) ] × 台数
+を末端側から1回ずつ計算し、ルートの g(上限) から選択を逆にたどる。
+計算量は 区間数 × 候補口径数 × bins。離散化の丸めで上限を超えた場合は、
+超過分だけ上限を下げて解き直す。
+
+丸めのため、DP の解は bins の刻み (経路損失の最大値 / bins) の分だけ最適から外れることがある。
+DP の後に、上限を守ったまま1区間ずつ安い口径へ替える局所改善を行うが、
+厳密な最小コストは保証しない (近似解)。
+"""
+import math
+
+import numpy as np
+
+from constants import PIPE_UNIT_PRICES, SU_FLOW_CAPACITY, MPA_TO_HEAD_M
+from utils import get_pipe_catalog
+from friction import is_darcy, section_losses
+
+DEFAULT_BINS = 1000
+MAX_REPAIR = 5
+MAX_IMPROVE_PASSES = 10
+
+def hazen_williams_loss(q_m3s, d_mm, length, equivalent_length, loss_params):
+    """PipeSection.calculate と同じ式・丸めの区間損失 (m)。ダルシー・ワイスバッハ式は friction.section_losses"""
+    if not loss_params or d_mm <= 0 or q_m3s <= 0: return 0.0
+    C_val = loss_params.get("C", 130.0)
+    fit_rate = loss_params.get("fitting", 1.2)
+    L_eq = (length * fit_rate) + equivalent_length
+    return round(10.666 * (C_val ** -1.852) * ((d_mm / 1000.0) ** -4.87) * (q_m3s ** 1.852) * L_eq, 3)
+
+def unit_price(prices, pipe_type, size):
+    return (prices.get(pipe_type) or {}).get(size, 0.0)
+
+def section_options(node, all_pipe_db, max_velocity, loss_params, prices):
+    """区間の候補 [(口径, 1本分の材料費, 損失)]。手動指定・規格外は現在の口径のみ"""
+    pipe_type = node.used_pipe_type
+    length = node.length
+    if node.is_manual:
+        return [(node.size, unit_price(prices, pipe_type, node.size) * length, node.head_loss)]
+    size_to_dmm, sizes_by_diameter = get_pipe_catalog(all_pipe_db, pipe_type)
+    q_m3s = node.flow_lpm / 60000
+    candidates = []
+    if "SU" in pipe_type:
+        for size_name, cap_lpm in sorted(SU_FLOW_CAPACITY.items(), key=lambda x: x[1]):
+            if node.flow_lpm <= cap_lpm:
+                candidates.append((size_name, size_to_dmm.get(size_name, 0.0)))
+    else:
+        for size_name, d_mm in sizes_by_diameter:
+            area = math.pi * ((d_mm / 1000) / 2) ** 2
+            if area <= 0 or q_m3s / area > max_velocity: continue
+            candidates.append((size_name, d_mm))
+    if is_darcy(loss_params):
+        k = len(candidates)
+        losses = section_losses([q_m3s] * k, [d for _, d in candidates], [length] * k, [node.equivalent_length] * k,
+                                loss_params, [pipe_type] * k).tolist()
+    else:
+        losses = [hazen_williams_loss(q_m3s, d_mm, length, node.equivalent_length, loss_params) for _, d_mm in candidates]
+    options = [(size_name, unit_price(prices, pipe_type, size_name) * length, h) for (size_name, _), h in zip(candidates, losses)]
+    if not options:
+        options.append((node.size, unit_price(prices, pipe_type, node.size) * length, node.head_loss))
+    return options
+
+def _velocity(node, all_pipe_db, size):
+    size_to_dmm, _ = get_pipe_catalog(all_pipe_db, node.used_pipe_type)
+    d_mm = size_to_dmm.get(size, 0.0)
+    if d_mm <= 0 or node.flow_lpm <= 0: return 0.0
+    return round((node.flow_lpm / 60000) / (math.pi * ((d_mm / 1000) / 2) ** 2), 2)
+
+def _postorder(root):
+    order, stack = [], [root]
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        stack.extend(node.children)
+    order.reverse()
+    return order
+
+def constrained_terminals(root):
+    """揚程条件を課す末端 (手動指定の末端があればそれだけ。find_critical_node と同じ)"""
+    terminals = [n for n in _postorder(root) if not n.children]
+    manual = [t for t in terminals if t.is_manual_critical]
+    return manual or terminals
+
+def terminal_fixed_head(t, pressure_to_head=MPA_TO_HEAD_M):
+    return t.static_head + t.required_pressure * pressure_to_head + t.critical_inner_loss
+
+def critical_head(root, head_of, targets, pressure_to_head=MPA_TO_HEAD_M, all_paths=False):
+    """head_of(node) を区間損失とした場合の、targets 中の最大全揚程
+
+    all_paths=True では全末端の累計損失だけの最大値を返す。
+    """
+    target_ids = {t.id for t in targets}
+    best = 0.0
+    stack = [(root, 0.0)]
+    while stack:
+        node, cum = stack.pop()
+        cum += head_of(node)
+        if all_paths:
+            if not node.children: best = max(best, cum)
+        elif node.id in target_ids:
+            best = max(best, cum + terminal_fixed_head(node, pressure_to_head))
+        for child in node.children: stack.append((child, cum))
+    return best
+
+def _solve(order, options, fixed_k, budget, window, bins):
+    """離散化した木DP。返り値: (最小コスト, {id: 候補番号}) / 解なしは (inf, None)
+
+    残り揚程は budget - window 〜 budget の範囲 (window = 経路損失の最大値) にしか
+    ならないので、この幅だけを bins 段階に分ける。
+    """
+    low = budget - window
+    delta = window / bins if window > 0 else 1.0
+    size = bins + 1
+    g = {}
+    choice = {}
+    shifts = {}
+    for node in order:
+        down = np.zeros(size)
+        for child in node.children:
+            down += g.pop(child.id)
+        k0 = fixed_k(node, low, delta)
+        if k0 is not None:
+            down[:min(k0, size)] = np.inf
+        opts = options[node.id]
+        table = np.full((len(opts), size), np.inf)
+        node_shifts = [int(round(h / delta)) for _, _, h in opts]
+        for j, (_, cost, _) in enumerate(opts):
+            hk = node_shifts[j]
+            if hk < size:
+                table[j, hk:] = cost + down[:size - hk]
+        if len(opts) == 1:
+            best = table[0]
+            choice[node.id] = None
+        else:
+            arg = table.argmin(axis=0)
+            best = table[arg, np.arange(size)]
+            choice[node.id] = arg.astype(np.int16)
+        g[node.id] = best * node.repeat
+        shifts[node.id] = node_shifts
+    root = order[-1]
+    total = g[root.id][bins]
+    if not np.isfinite(total): return math.inf, None
+    picked = {}
+    stack = [(root, bins)]
+    while stack:
+        node, b = stack.pop()
+        arg = choice[node.id]
+        j = 0 if arg is None else int(arg[b])
+        picked[node.id] = j
+        for child in node.children: stack.append((child, b - shifts[node.id][j]))
+    return float(total), picked
+
+def _improve(order, options, picked, target_ids, budget, pressure_to_head):
+    """全揚程の上限を守る範囲で、1区間ずつ安い候補へ替える (picked を書き換える)。改善がなくなるまで繰り返す
+
+    区間の余裕 = 配下の制約末端の (上限 - 全揚程) の最小値。区間の損失を余裕以内で増やしても
+    上限は守られる。根から順に替え、替えた損失の増分は配下の区間の余裕から差し引く。
+    """
+    for _ in range(MAX_IMPROVE_PASSES):
+        cum = {}
+        for node in reversed(order):
+            cum[node.id] = cum.get(node.parent_id, 0.0) + options[node.id][picked[node.id]][2]
+        slack = {}
+        for node in order:
+            s = min((slack[c.id] for c in node.children), default=math.inf)
+            if node.id in target_ids:
+                s = min(s, budget - cum[node.id] - terminal_fixed_head(node, pressure_to_head))
+            slack[node.id] = s
+        improved = False
+        used = {}
+        for node in reversed(order):
+            opts = options[node.id]
+            j = picked[node.id]
+            room = slack[node.id] - used.get(node.parent_id, 0.0)
+            best, best_cost = j, opts[j][1]
+            for k, (_, cost, h) in enumerate(opts):
+                if cost < best_cost and h - opts[j][2] <= room + 1e-9:
+                    best, best_cost = k, cost
+            if best != j:
+                picked[node.id] = best
+                improved = True
+            used[node.id] = used.get(node.parent_id, 0.0) + opts[best][2] - opts[j][2]
+        if not improved: break
+    return picked
+
+def optimize_sizes(root, all_pipe_db, max_velocity, loss_params, head_budget, prices=None, bins=DEFAULT_BINS,
+                   pressure_to_head=MPA_TO_HEAD_M):
+    """全揚程 head_budget (m) 以下で材料費をできるだけ小さくする口径を選ぶ
+
+    木DP (揚程を bins 段階に離散化) の後に局所改善をかけた近似解で、bins の刻みの分だけ
+    最小コストから外れることがある。calculate() と calculate_cumulative_loss() の後に呼ぶ。ツリーは変更しない。
+    返り値の dict: feasible, budget, cost, head, greedy_cost, greedy_head, min_head, sizes, changes
+    """
+    prices = PIPE_UNIT_PRICES if prices is None else prices
+    order = _postorder(root)
+    targets = constrained_terminals(root)
+    target_ids = {t.id for t in targets}
+    options = {n.id: section_options(n, all_pipe_db, max_velocity, loss_params, prices) for n in order}
+
+    # 現在 (貪欲法) の口径のコストと全揚程
+    multiplicity = {root.id: root.repeat}
+    for node in reversed(order):
+        for child in node.children: multiplicity[child.id] = multiplicity[node.id] * child.repeat
+    greedy_cost = sum(unit_price(prices, n.used_pipe_type, n.size) * n.length * multiplicity[n.id] for n in order)
+    greedy_head = critical_head(root, lambda n: n.head_loss, targets, pressure_to_head)
+    min_head = critical_head(root, lambda n: min(h for _, _, h in options[n.id]), targets, pressure_to_head)
+
+    result = {"feasible": False, "budget": head_budget, "cost": None, "head": None,
+              "greedy_cost": greedy_cost, "greedy_head": greedy_head, "min_head": min_head, "sizes": {}, "changes": []}
+    if min_head > head_budget + 1e-9:
+        return result
+
+    def fixed_k(node, low, delta):
+        if node.id not in target_ids: return None
+        return max(0, int(math.ceil((terminal_fixed_head(node, pressure_to_head) - low) / delta - 1e-9)))
+
+    # どの経路でも損失はこれ以下 (各区間で最も損失の大きい候補を選んだ場合)
+    window = critical_head(root, lambda n: max(h for _, _, h in options[n.id]), [], pressure_to_head, all_paths=True)
+
+    effective = head_budget
+    picked = None
+    for _ in range(MAX_REPAIR):
+        cost, picked = _solve(order, options, fixed_k, effective, window, bins)
+        if picked is None: break
+        head = critical_head(root, lambda n: options[n.id][picked[n.id]][2], targets, pressure_to_head)
+        if head <= head_budget + 1e-9: break
+        # 丸め誤差で超過した分だけ上限を下げて解き直す
+        effective -= (head - head_budget) + window / bins
+        picked = None
+    if picked is None:
+        return result
+    # 現在の口径で上限を満たし、かつ安い場合は現在の口径を解とする (離散化の丸め対策)
+    if greedy_head <= head_budget + 1e-9:
+        greedy_pick = {n.id: next((j for j, o in enumerate(options[n.id]) if o[0] == n.size), None) for n in order}
+        if None not in greedy_pick.values() and greedy_cost <= sum(options[nid][j][1] * multiplicity[nid] for nid, j in picked.items()):
+            picked = greedy_pick
+    picked = _improve(order, options, picked, target_ids, head_budget, pressure_to_head)
+    head = critical_head(root, lambda n: options[n.id][picked[n.id]][2], targets, pressure_to_head)
+
+    sizes = {nid: options[nid][j][0] for nid, j in picked.items()}
+    cost = sum(options[nid][j][1] * multiplicity[nid] for nid, j in picked.items())
+    changes = []
+    for node in order[::-1]:
+        new_size = sizes[node.id]
+        if new_size == node.size: continue
+        new_head = options[node.id][picked[node.id]][2]
+        changes.append({
+            "id": node.id, "name": node.name, "pipe_type": node.used_pipe_type, "flow_lpm": node.flow_lpm,
+            "greedy_size": node.size, "size": new_size,
+            "greedy_velocity": node.velocity, "velocity": _velocity(node, all_pipe_db, new_size),
+            "greedy_head_loss": node.head_loss, "head_loss": new_head,
+            "cost_diff": (options[node.id][picked[node.id]][1] - unit_price(prices, node.used_pipe_type, node.size) * node.length) * multiplicity[node.id],
+        })
+    result.update(feasible=True, cost=cost, head=head, sizes=sizes, changes=changes)
+    return result
+
+def changes_table(result):
+    """変更区間の表示用行 (get_excel_data と同じく日本語の列名)"""
+    return [{
+        "区間": c["name"], "管種": c["pipe_type"], "流量 (L/min)": round(c["flow_lpm"], 1),
+        "現在口径": c["greedy_size"], "最適口径": c["size"],
+        "流速 (m/s)": f"{c['greedy_velocity']} → {c['velocity']}",
+        "単独損失 (m)": f"{c['greedy_head_loss']} → {c['head_loss']}",
+        "コスト差 (円)": round(c["cost_diff"]),
+    } for c in result["changes"]]
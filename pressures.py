@@ -0,0 +1,55 @@
+# pressures.py
+"""全末端の残存圧力
+
+最遠ルートで決めたポンプ全揚程を与えたとき、各末端 (系統・器具) で使える圧力を
+calculate_cumulative_loss() 後の累計損失から配列演算でまとめて求める。
+    残存圧力 (MPa) = (全揚程 - 累計損失 - 実揚程 - 器具接続損失) / 102
+必要圧力を下回る末端は「不足」、上限を超える末端は「過大」(減圧弁の検討対象) とする。
+"""
+import numpy as np
+import pandas as pd
+
+from constants import MPA_TO_HEAD_M
+
+DEFAULT_MAX_PRESSURE_MPA = 0.4
+TYPE_LABELS = {"branch": "分岐", "system": "系統(PS)", "fixture": "器具"}
+
+def terminal_arrays(nodes):
+    """末端ノードの属性を配列にまとめる (ノードを1回ずつ見るだけ)"""
+    terms = [n for n in nodes if not n.children]
+    k = len(terms)
+    return terms, {
+        "cum": np.fromiter((t.cum_head_loss for t in terms), float, k),
+        "static": np.fromiter((t.static_head for t in terms), float, k),
+        "inner": np.fromiter((t.critical_inner_loss for t in terms), float, k),
+        "required": np.fromiter((t.required_pressure for t in terms), float, k),
+    }
+
+def residual_pressures(nodes, pump_head, max_pressure=DEFAULT_MAX_PRESSURE_MPA, pressure_to_head=MPA_TO_HEAD_M):
+    """全末端の残存圧力表 (DataFrame、余裕の小さい順)
+
+    nodes は計算済み PipeSection の反復可能オブジェクト (node_map.values() など)。
+    """
+    terms, a = terminal_arrays(nodes)
+    residual = (pump_head - a["cum"] - a["static"] - a["inner"]) / pressure_to_head
+    margin = residual - a["required"]
+    status = np.where(margin < -1e-6, "不足", np.where(residual > max_pressure + 1e-6, "過大", "適正"))
+    df = pd.DataFrame({
+        "末端": [t.name for t in terms],
+        "種別": [TYPE_LABELS.get(t.type, t.type) for t in terms],
+        "接続元": [t.parent_name for t in terms],
+        "累計損失 (m)": a["cum"].round(3),
+        "実揚程 (m)": a["static"],
+        "器具接続損失 (m)": a["inner"].round(3),
+        "必要圧力 (MPa)": a["required"],
+        "残存圧力 (MPa)": residual.round(3),
+        "余裕 (MPa)": margin.round(3),
+        "減圧量 (MPa)": np.maximum(residual - max_pressure, 0.0).round(3),
+        "判定": status,
+    }, index=[t.id for t in terms])
+    return df.sort_values("余裕 (MPa)", kind="stable")
+
+def summarize(df):
+    """判定ごとの件数"""
+    counts = df["判定"].value_counts()
+    return {label: int(counts.get(label, 0)) for label in ("不足", "過大", "適正")}
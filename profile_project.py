@@ -0,0 +1,136 @@
+# profile_project.py
+"""保存済みプロジェクト (pipe_config.json) のプロファイル取得
+
+calculate → 累計損失 → 最遠末端 → Excel行 → DOT の各段階を cProfile と
+tracemalloc の下で実行し、関数別の所要時間とメモリ確保箇所のレポートを書き出す。
+選択しなかった前段の段階は計測外で実行される。
+
+    python profile_project.py pipe_config.json --stages calculate --repeat 5 --out profile_out
+"""
+import argparse
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+
+from benchmark import STAGE_NAMES, make_context, run_pipeline
+from templates import unpack_project
+
+BUILDING_TYPES = ["一般・事務所 (負荷単位法)", "集合住宅 (BL基準)", "集合住宅 (人数基準)", "一戸建て (総水栓数法)"]
+
+def load_project(path):
+    """保存ファイルから (ノードリスト, テンプレート) を読み込む"""
+    with open(path, encoding="utf-8") as f:
+        return unpack_project(json.load(f))
+
+_SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+]
+
+def profile_pipeline(pipes, building_type, is_fv, stages, repeat=1, settings=None, trace_memory=True, trace_frames=10, templates=None):
+    """選択した段階だけを計測しながらパイプラインを repeat 回実行する
+
+    メモリは最後の1回についてのみ、段階ごとの前後スナップショット差分と
+    段階開始時点からのピーク増分を取る。
+    返り値: (pstats.Stats, {段階: (差分リスト, ピーク増分bytes)}, {段階: 所要時間リスト})
+    """
+    profiler = cProfile.Profile()
+    timings = {name: [] for name in stages}
+    allocations = {}
+    if trace_memory: tracemalloc.start(trace_frames)
+    try:
+        for rep in range(repeat):
+            is_last = (rep == repeat - 1)
+            def hook(name, func, ctx):
+                if name not in timings:
+                    func(ctx)
+                    return
+                snap_before = None
+                if trace_memory and is_last:
+                    snap_before = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+                    tracemalloc.reset_peak()
+                    base = tracemalloc.get_traced_memory()[0]
+                t0 = time.perf_counter()
+                profiler.enable()
+                try:
+                    func(ctx)
+                finally:
+                    profiler.disable()
+                timings[name].append(time.perf_counter() - t0)
+                if snap_before is not None:
+                    peak = tracemalloc.get_traced_memory()[1] - base
+                    snap_after = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+                    allocations[name] = (snap_after.compare_to(snap_before, "lineno"), peak)
+            run_pipeline(make_context(pipes, building_type, is_fv, settings, templates), stages, hook)
+    finally:
+        if trace_memory: tracemalloc.stop()
+    return pstats.Stats(profiler), allocations, timings
+
+def format_hot_functions(stats, sort_keys=("cumulative", "tottime"), top=40):
+    buf = io.StringIO()
+    for key in sort_keys:
+        buf.write(f"===== sort: {key} (上位 {top}) =====\n")
+        stats.stream = buf
+        stats.sort_stats(key).print_stats(top)
+    return buf.getvalue()
+
+def format_allocations(allocations, top=30):
+    lines = []
+    for name, (diffs, peak) in allocations.items():
+        lines.append(f"===== {name}: ピーク増分 {peak / 1024:.1f} KiB, 確保増分の上位 {top} 行 =====")
+        diffs = sorted(diffs, key=lambda d: d.size_diff, reverse=True)
+        for i, d in enumerate(diffs[:top], 1):
+            lines.append(f"#{i} {d.size_diff / 1024:+.1f} KiB ({d.count_diff:+d} blocks)  {d.traceback}")
+    return "\n".join(lines) + "\n"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="プロジェクトファイルのプロファイル取得")
+    parser.add_argument("project", help="pipe_config.json のパス")
+    parser.add_argument("--stages", nargs="+", default=STAGE_NAMES, choices=STAGE_NAMES, help="計測する段階 (既定: すべて)")
+    parser.add_argument("--repeat", type=int, default=1, help="繰り返し回数")
+    parser.add_argument("--building-type", default=BUILDING_TYPES[0], choices=BUILDING_TYPES)
+    parser.add_argument("--pipe-type", default=None, help="基本の管種 (既定: SGP-VB)")
+    parser.add_argument("--max-velocity", type=float, default=2.0)
+    parser.add_argument("--fv", action="store_true", help="洗浄弁方式で計算する")
+    parser.add_argument("--no-memory", action="store_true", help="tracemalloc を使わない (時間計測のみ)")
+    parser.add_argument("--top", type=int, default=40, help="レポートに載せる上位件数")
+    parser.add_argument("--out", default="profile_out", help="レポートの出力ディレクトリ")
+    args = parser.parse_args(argv)
+
+    pipes, templates = load_project(args.project)
+    settings = {"max_velocity": args.max_velocity}
+    if args.pipe_type: settings["pipe_type"] = args.pipe_type
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+
+    stats, allocations, timings = profile_pipeline(pipes, args.building_type, args.fv, args.stages, args.repeat, settings,
+                                                   trace_memory=not args.no_memory, templates=templates)
+
+    os.makedirs(args.out, exist_ok=True)
+    stats.dump_stats(os.path.join(args.out, "profile.prof"))
+    with open(os.path.join(args.out, "hot_functions.txt"), "w", encoding="utf-8") as f:
+        f.write(format_hot_functions(stats, top=args.top))
+    if allocations:
+        with open(os.path.join(args.out, "allocations.txt"), "w", encoding="utf-8") as f:
+            f.write(format_allocations(allocations, top=args.top))
+    summary = {
+        "project": args.project, "nodes": len(pipes), "repeat": args.repeat,
+        "stages_s": {k: [round(v, 6) for v in vals] for k, vals in timings.items()},
+        "peak_kb": {k: round(peak / 1024, 1) for k, (_, peak) in allocations.items()},
+    }
+    with open(os.path.join(args.out, "timings.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    print(f"{len(pipes)} ノード, {args.repeat} 回")
+    for name, vals in timings.items():
+        if vals: print(f"  {name:>10}: 平均 {sum(vals) / len(vals):.4f} s")
+    print(f"レポート出力先: {os.path.abspath(args.out)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+# pumps.py
+"""ポンプカタログからの機種選定
+
+カタログ (CSV / XLSX) は 1行 = 性能曲線上の1点 (型式, 流量, 揚程, 効率) の縦持ちの表で、
+同じ型式の行を流量順に並べて Q-H 曲線・効率曲線とする。読込時に全機種の曲線を
+(機種 × 点) の配列に詰め、最大流量の昇順に並べた索引を作っておく。
+
+選定は 設計点 (流量 Q_d, 全揚程 H_d) に対して
+  1. 最大流量が Q_d 以上の機種を索引の二分探索で絞り、
+  2. 締切揚程と Q_d での揚程が H_d 以上の機種を配列演算で選び、
+  3. 抵抗曲線 H = 実揚程分 + 摩擦分 × (Q/Q_d)^n との交点 (運転点) を
+     全候補まとめて二分法で求め、運転点の効率から軸動力を出して順位付けする。
+軸動力は画面の概算と同じ P = 0.163 × Q(m³/min) × H / η (kW)。
+"""
+import os
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from importer import iter_csv_rows, iter_xlsx_rows, CSV_ENCODINGS
+
+COLUMN_ALIASES = {
+    "model": ("model", "型式", "機種", "形式", "品番"),
+    "maker": ("maker", "メーカー", "製造者"),
+    "flow": ("flow", "流量", "流量(l/min)", "q", "q(l/min)"),
+    "head": ("head", "揚程", "揚程(m)", "全揚程", "h", "h(m)"),
+    "efficiency": ("efficiency", "効率", "効率(%)", "η", "eta"),
+    "motor_kw": ("motor_kw", "電動機", "電動機(kw)", "出力", "出力(kw)", "motor"),
+}
+DEFAULT_EFFICIENCY = 0.55     # 効率の記載がない機種 (画面の概算と同じ)
+POWER_COEF = 0.163
+MOTOR_MARGIN = 1.1
+BEP_RANGE = (0.7, 1.2)        # 最高効率点に対する運転点流量の推奨範囲
+BISECT_ITER = 40
+
+def _normalize(label):
+    return unicodedata.normalize("NFKC", str(label)).replace(" ", "").replace("　", "").lower()
+
+_ALIAS_INDEX = {_normalize(a): field for field, aliases in COLUMN_ALIASES.items() for a in aliases}
+
+def shaft_power_kw(q_lpm, head_m, efficiency):
+    return POWER_COEF * (q_lpm / 1000.0) * head_m / efficiency
+
+class PumpCatalog:
+    """性能曲線の配列表現と最大流量の索引
+
+    q, h, eta は (機種 × 点) の配列。点数の少ない機種は最後の点を繰り返して詰める。
+    """
+    def __init__(self, models, makers, curves, motor_kw=None):
+        self.models = list(models)
+        self.makers = list(makers)
+        n = len(self.models)
+        width = max((len(c) for c in curves), default=1)
+        self.q = np.zeros((n, width)); self.h = np.zeros((n, width)); self.eta = np.full((n, width), np.nan)
+        for i, points in enumerate(curves):
+            points = sorted(points)
+            pad = points + [points[-1]] * (width - len(points))
+            self.q[i], self.h[i], self.eta[i] = zip(*pad)
+        self.motor_kw = np.array(motor_kw if motor_kw is not None else [np.nan] * n, dtype=float)
+        self.q_max = self.q[:, -1]
+        self.h_shutoff = self.h.max(axis=1)
+        has_eta = ~np.isnan(self.eta).all(axis=1)
+        best = np.where(has_eta, np.argmax(np.where(np.isnan(self.eta), -np.inf, self.eta), axis=1), width - 1)
+        self.q_bep = np.where(has_eta, self.q[np.arange(n), best], np.nan)
+        # 最大流量の昇順の索引
+        self.by_q_max = np.argsort(self.q_max, kind="stable")
+        self.q_max_sorted = self.q_max[self.by_q_max]
+
+    def __len__(self):
+        return len(self.models)
+
+    def candidates(self, q_lpm, head_m):
+        """最大流量 ≥ Q かつ締切揚程 ≥ H の機種番号"""
+        rows = self.by_q_max[np.searchsorted(self.q_max_sorted, q_lpm, side="left"):]
+        return rows[self.h_shutoff[rows] >= head_m]
+
+    def head_at(self, rows, q_lpm):
+        """機種 rows の流量 q での揚程 (曲線の折れ線補間。q は機種ごとの配列でもよい)"""
+        return _interp_rows(self.q[rows], self.h[rows], q_lpm)
+
+    def efficiency_at(self, rows, q_lpm):
+        eta = _interp_rows(self.q[rows], self.eta[rows], q_lpm)
+        return np.where(np.isnan(eta), DEFAULT_EFFICIENCY, eta)
+
+def _interp_rows(x, y, at):
+    """行ごとの折れ線補間 (x は行ごとに昇順、範囲外は端の値)"""
+    at = np.broadcast_to(np.asarray(at, dtype=float), (x.shape[0],))
+    k = np.clip((x <= at[:, None]).sum(axis=1) - 1, 0, x.shape[1] - 2) if x.shape[1] > 1 else np.zeros(x.shape[0], dtype=np.int64)
+    r = np.arange(x.shape[0])
+    if x.shape[1] == 1: return y[:, 0].copy()
+    x0, x1, y0, y1 = x[r, k], x[r, k + 1], y[r, k], y[r, k + 1]
+    t = np.clip(np.divide(at - x0, x1 - x0, out=np.zeros_like(x0), where=x1 > x0), 0.0, 1.0)
+    return y0 + (y1 - y0) * t
+
+def build_catalog(rows):
+    """見出し行つきの行イテレータから PumpCatalog を作る。列の不足・数値の不正は ValueError"""
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        raise ValueError("表が空です")
+    col = {}
+    for i, label in enumerate(header):
+        if label is None: continue
+        field = _ALIAS_INDEX.get(_normalize(label))
+        if field and field not in col: col[field] = i
+    missing = {"model", "flow", "head"} - set(col)
+    if missing:
+        raise ValueError(f"必須列がありません: {', '.join(sorted(missing))}")
+    curves, makers, motors, problems = {}, {}, {}, []
+    for line, row in enumerate(rows, start=2):
+        def cell(field):
+            i = col.get(field)
+            if i is None or i >= len(row) or row[i] is None: return ""
+            return str(row[i]).strip()
+        model = cell("model")
+        if not model: continue
+        try:
+            q, h = float(cell("flow")), float(cell("head"))
+            eta = float(cell("efficiency")) if cell("efficiency") else np.nan
+        except ValueError:
+            problems.append(f"{line}行目: 流量・揚程・効率は数値で入力してください")
+            continue
+        curves.setdefault(model, []).append((q, h, eta))
+        makers.setdefault(model, cell("maker"))
+        if cell("motor_kw"):
+            try: motors[model] = float(cell("motor_kw"))
+            except ValueError: problems.append(f"{line}行目: 電動機出力は数値で入力してください")
+    if problems:
+        raise ValueError("\n".join(problems[:20]))
+    if not curves:
+        raise ValueError("ポンプの性能点がありません")
+    # 効率の単位は列全体で1回だけ決める (行ごとに判定すると % 表記の締切点 1% などが 100% になる)
+    if any(eta > 1.0 for points in curves.values() for _, _, eta in points):
+        curves = {m: [(q, h, eta / 100.0) for q, h, eta in points] for m, points in curves.items()}
+    names = list(curves)
+    return PumpCatalog(names, [makers[m] for m in names], [curves[m] for m in names], [motors.get(m, np.nan) for m in names])
+
+def load_pump_catalog(source, filename=None, sheet_name=None):
+    """CSV / XLSX (パスまたはバイナリのファイルオブジェクト) から PumpCatalog を作る"""
+    if isinstance(source, (str, os.PathLike)):
+        filename = filename or os.fspath(source)
+        with open(source, "rb") as f:
+            return load_pump_catalog(f, filename, sheet_name)
+    name = (filename or getattr(source, "name", "") or "").lower()
+    if name.endswith((".xlsx", ".xlsm")):
+        return build_catalog(iter_xlsx_rows(source, sheet_name))
+    start = source.tell()
+    for encoding in CSV_ENCODINGS:
+        source.seek(start)
+        try:
+            return build_catalog(iter_csv_rows(source, encoding))
+        except UnicodeDecodeError:
+            continue
+    raise ValueError("CSVの文字コードを判別できません (UTF-8 または Shift_JIS で保存してください)")
+
+def system_curve(q_lpm, design_q_lpm, static_head, friction_head, exponent=1.852):
+    """抵抗曲線の揚程 (m)。摩擦分は設計流量のときの値を流量の exponent 乗で比例させる"""
+    ratio = np.asarray(q_lpm, dtype=float) / design_q_lpm if design_q_lpm > 0 else 0.0
+    return static_head + friction_head * ratio ** exponent
+
+def select_pumps(catalog, q_lpm, head_m, friction_head, exponent=1.852, limit=None):
+    """設計点 (q_lpm, head_m) を満たす機種の運転点と軸動力の表
+
+    最高効率点比が推奨範囲内の機種を先に、それぞれ軸動力の小さい順に並べる。
+    friction_head は head_m のうち流量で変わる分 (管摩擦損失 + 器具接続損失)。
+    """
+    static_head = head_m - friction_head
+    rows = catalog.candidates(q_lpm, head_m)
+    if len(rows):
+        rows = rows[catalog.head_at(rows, q_lpm) >= head_m - 1e-9]
+    columns = ["型式", "メーカー", "運転点流量 (L/min)", "運転点揚程 (m)", "効率 (%)", "軸動力 (kW)",
+               "所要電動機 (kW)", "電動機 (kW)", "揚程余裕 (m)", "最高効率点比"]
+    if not len(rows):
+        return pd.DataFrame(columns=columns)
+
+    # 運転点: ポンプ揚程 - 抵抗曲線 が0になる流量 (Q_d と最大流量の間、全候補まとめて二分法)
+    lo = np.full(len(rows), float(q_lpm))
+    hi = catalog.q_max[rows].astype(float)
+    for _ in range(BISECT_ITER):
+        mid = (lo + hi) / 2
+        above = catalog.head_at(rows, mid) - system_curve(mid, q_lpm, static_head, friction_head, exponent) >= 0
+        lo = np.where(above, mid, lo)
+        hi = np.where(above, hi, mid)
+    q_op = lo
+    h_op = catalog.head_at(rows, q_op)
+    eta = catalog.efficiency_at(rows, q_op)
+    power = shaft_power_kw(q_op, h_op, eta)
+    df = pd.DataFrame({
+        "型式": [catalog.models[i] for i in rows],
+        "メーカー": [catalog.makers[i] for i in rows],
+        "運転点流量 (L/min)": q_op.round(1),
+        "運転点揚程 (m)": h_op.round(2),
+        "効率 (%)": (eta * 100).round(1),
+        "軸動力 (kW)": power.round(2),
+        "所要電動機 (kW)": (power * MOTOR_MARGIN).round(2),
+        "電動機 (kW)": catalog.motor_kw[rows],
+        "揚程余裕 (m)": (catalog.head_at(rows, q_lpm) - head_m).round(2),
+        "最高効率点比": (q_op / catalog.q_bep[rows]).round(2),
+    })
+    # 電動機出力が分かる機種は、運転点の所要動力を満たさないものを除く
+    df = df[~(df["電動機 (kW)"] < df["所要電動機 (kW)"])]
+    in_range = df["最高効率点比"].between(*BEP_RANGE)
+    df = df.assign(_rank=~in_range).sort_values(["_rank", "軸動力 (kW)", "揚程余裕 (m)"], kind="stable").drop(columns="_rank")
+    df = df.reset_index(drop=True)
+    return df.head(limit) if limit else df
@@ -0,0 +1,57 @@
+# reports.py
+"""計算書 (Excel) と全揚程の集計
+
+画面と計算サービス (service.py) の両方から使う。どれも calculate() →
+calculate_cumulative_loss() → find_critical_node() 済みのツリーを受け取る。
+"""
+import io
+
+import pandas as pd
+
+from constants import MPA_TO_HEAD_M
+from friction import is_darcy
+from models import get_route
+
+def total_dynamic_head(critical_node, pressure_to_head=MPA_TO_HEAD_M):
+    """最遠末端までの必要全揚程 (m) = 累計損失 + 実揚程 + 末端必要圧 + 器具接続損失"""
+    if critical_node is None: return 0.0
+    return (critical_node.cum_head_loss + critical_node.static_head
+            + critical_node.required_pressure * pressure_to_head + critical_node.critical_inner_loss)
+
+def critical_route_rows(critical_node, node_map):
+    """最遠ルート計算書の行 (ルート → 末端の順、ルート自身は除く)"""
+    rows = []
+    if critical_node is None: return rows
+    for p in get_route(critical_node, node_map):
+        if p.id == "root": continue
+        c_val = "-" if is_darcy(p.loss_params_used) else p.loss_params_used.get("C", "")
+        rows.append({
+            "区間": f"{p.parent_name} -> {p.name}",
+            "流量 (L/min)": round(p.flow_lpm, 1),
+            "管種": p.used_pipe_type,
+            "口径": p.size,
+            "流速 (m/s)": p.velocity,
+            "流速係数": c_val,
+            "継手割増": p.loss_params_used.get("fitting", ""),
+            "管長 (m)": p.length,
+            "加算等価長 (m)": p.equivalent_length,
+            "単独損失 (m)": p.head_loss,
+            "累計損失 (m)": round(p.cum_head_loss, 3),
+            "器具接続損失(m)": round(p.critical_inner_loss, 3) if p.type == "system" else 0
+        })
+    return rows
+
+def excel_workbook(root_node, node_map, critical_node):
+    """全区間一覧と最遠ルート計算書の Excel ファイル (bytes)"""
+    return excel_from_rows(root_node.get_excel_data(), critical_route_rows(critical_node, node_map))
+
+def excel_from_rows(all_rows, route_rows):
+    """get_excel_data() と critical_route_rows() の行から Excel ファイルを作る (バックグラウンド実行用)"""
+    df_all = pd.DataFrame(all_rows)
+    df_crit = pd.DataFrame(route_rows)
+    with io.BytesIO() as buffer:
+        with pd.ExcelWriter(buffer) as writer:
+            df_all.to_excel(writer, index=False, sheet_name="全区間一覧")
+            if not df_crit.empty:
+                df_crit.to_excel(writer, index=False, sheet_name="最遠ルート計算書")
+        return buffer.getvalue()
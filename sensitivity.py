@@ -0,0 +1,111 @@
+# sensitivity.py
+"""各区間を1サイズ上げたときの必要全揚程の変化 (感度分析)
+
+区間 v の口径を変えても流量は変わらず、変わるのは v の損失だけで、
+影響を受けるのは v の配下の末端だけである。末端を行きがけ順に並べると
+v の配下は連続した範囲 [入, 出) になるので、
+    新しい全揚程 = max(範囲外の末端の最大値, 範囲内の最大値 + 損失の変化)
+を前後からの累積最大と配下最大から区間ごとに O(1) で求められる (全体で O(n))。
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+from constants import PIPE_UNIT_PRICES, SU_FLOW_CAPACITY, MPA_TO_HEAD_M
+from utils import get_pipe_catalog
+from optimizer import unit_price, terminal_fixed_head
+from friction import section_losses
+
+def size_steps(all_pipe_db, pipe_type):
+    """口径の昇順リストと サイズ→内径 の dict (SU は流量表の容量順)"""
+    size_to_dmm, sizes_by_diameter = get_pipe_catalog(all_pipe_db, pipe_type)
+    if "SU" in pipe_type:
+        names = [name for name, _ in sorted(SU_FLOW_CAPACITY.items(), key=lambda x: x[1])]
+    else:
+        names = [name for name, _ in sizes_by_diameter]
+    return {name: i for i, name in enumerate(names)}, names, size_to_dmm
+
+def next_size(node, all_pipe_db, steps_cache=None):
+    """1サイズ上の (口径, 内径mm)。最大口径・規格外なら None"""
+    if steps_cache is None: steps_cache = {}
+    steps = steps_cache.get(node.used_pipe_type)
+    if steps is None:
+        steps = steps_cache[node.used_pipe_type] = size_steps(all_pipe_db, node.used_pipe_type)
+    position, names, size_to_dmm = steps
+    i = position.get(node.size)
+    if i is None or i + 1 >= len(names): return None
+    up = names[i + 1]
+    return up, size_to_dmm.get(up, 0.0)
+
+def upsize_sensitivity(root, all_pipe_db, loss_params, prices=None, pressure_to_head=MPA_TO_HEAD_M):
+    """全区間の「1サイズアップ時の必要全揚程の変化」表 (DataFrame、低減量の大きい順)
+
+    calculate() と calculate_cumulative_loss() の後に呼ぶ。ツリーは変更しない。
+    揚程条件は find_critical_node と同じく、手動指定の末端があればそれだけを対象とする。
+    """
+    prices = PIPE_UNIT_PRICES if prices is None else prices
+    # 行きがけ順で末端に番号を振り、各ノードの配下末端の範囲 [入, 出) を求める
+    terminals, span, sections = [], {}, []
+    multiplicity = {root.id: root.repeat}
+    stack = [(root, False)]
+    while stack:
+        node, done = stack.pop()
+        if done:
+            span[node.id] = (span[node.id], len(terminals))
+            continue
+        span[node.id] = len(terminals)
+        sections.append(node)
+        if not node.children: terminals.append(node)
+        stack.append((node, True))
+        for child in reversed(node.children):
+            multiplicity[child.id] = multiplicity[node.id] * child.repeat
+            stack.append((child, False))
+
+    manual = any(t.is_manual_critical for t in terminals)
+    totals = np.array([
+        t.cum_head_loss + terminal_fixed_head(t, pressure_to_head) if (t.is_manual_critical or not manual) else -np.inf
+        for t in terminals
+    ], dtype=float)
+    # 配下の末端の最大全揚程 (行きがけ順の逆 = 子が親より先)
+    sub_max = {t.id: totals[i] for i, t in enumerate(terminals)}
+    for node in reversed(sections):
+        if node.children: sub_max[node.id] = max(sub_max[c.id] for c in node.children)
+    # prefix[i] = max(totals[:i]), suffix[i] = max(totals[i:])
+    k = len(totals)
+    prefix = np.full(k + 1, -np.inf)
+    suffix = np.full(k + 1, -np.inf)
+    if k:
+        prefix[1:] = np.maximum.accumulate(totals)
+        suffix[:k] = np.maximum.accumulate(totals[::-1])[::-1]
+    critical = float(totals.max()) if k else 0.0
+
+    rows = []
+    starts, ends, inside, up_sections, up_dmms = [], [], [], [], []
+    steps_cache = {}
+    for node in sections:
+        up = next_size(node, all_pipe_db, steps_cache)
+        if up is None or node.flow_lpm <= 0: continue
+        up_size, up_dmm = up
+        a, b = span[node.id]
+        starts.append(a); ends.append(b); inside.append(sub_max[node.id])
+        up_sections.append(node); up_dmms.append(up_dmm)
+        d_cost = (unit_price(prices, node.used_pipe_type, up_size) - unit_price(prices, node.used_pipe_type, node.size)) * node.length * multiplicity[node.id]
+        rows.append((node.id, node.name, node.used_pipe_type, node.size, up_size, node.head_loss, d_cost))
+
+    # 1サイズ上げた損失は全区間まとめて求める
+    new_loss = section_losses([n.flow_lpm / 60000 for n in up_sections], up_dmms, [n.length for n in up_sections],
+                              [n.equivalent_length for n in up_sections], loss_params, [n.used_pipe_type for n in up_sections])
+    # 範囲外の最大と (範囲内の最大 + 損失の変化) の大きい方が新しい全揚程
+    d_loss = new_loss - np.array([n.head_loss for n in up_sections], dtype=float)
+    outside = np.maximum(prefix[np.array(starts, dtype=np.int64)], suffix[np.array(ends, dtype=np.int64)])
+    d_head = np.maximum(outside, np.array(inside, dtype=float) + d_loss) - critical
+
+    df = pd.DataFrame(rows, columns=["id", "区間", "管種", "現在口径", "変更後口径", "単独損失 (m)",
+                                     "材料費の増加 (円)"]).set_index("id")
+    df.insert(5, "変更後損失 (m)", new_loss)
+    df.insert(6, "損失の変化 (m)", d_loss.round(3))
+    df.insert(7, "全揚程の変化 (m)", d_head.round(3))
+    reduction = -df["全揚程の変化 (m)"]
+    df["1m低減あたり費用 (円/m)"] = np.where(reduction > 0, (df["材料費の増加 (円)"] / reduction.where(reduction > 0, 1)).round(), math.nan)
+    return df.sort_values(["全揚程の変化 (m)", "材料費の増加 (円)"], kind="stable")
@@ -0,0 +1,290 @@
+# service.py
+"""計算サービス (ローカル HTTP)
+
+画面以外のツールから計算エンジンを呼ぶための HTTP サーバ。既定で 127.0.0.1 のみで待ち受ける。
+    POST /calculate  計算結果 (JSON: 必要全揚程・最遠末端・全区間一覧・最遠ルート・ループ網)
+    POST /excel      計算書 (xlsx、画面の「Excelデータを作成」と同じ内容)
+    POST /dot        系統図の DOT ソース
+    POST /pdf        系統図 PDF
+    GET  /status     ワーカー・待ち行列の状態 (JSON)
+リクエスト本文は JSON
+    {"project": 保存データ (リスト形式 / テンプレート形式), "building_type": "...", "is_fv": false,
+     "settings": {"pipe_type", "max_velocity", "person_calc_params", "loss_params"},
+     "diagram": 系統図オプション, "caption": "..."}
+で、settings の省略した項目は benchmark.DEFAULT_SETTINGS を使う。
+
+  - 計算はワーカープロセスのプールで実行する。PDF 描画は別の小さなプールに分けるので、
+    重い描画がたまっても計算・Excel・DOT のワーカーは取られない。
+  - 本文のハッシュ (SHA-256) と種別が同じリクエストが実行中なら、新しく計算せずに
+    その結果を待って同じ応答を返す (実行中リクエストのまとめ)。
+  - 種別ごとの実行中 + 待機中の件数が上限に達したら、503 と Retry-After を返す。
+
+    python service.py --port 8765 --workers 4 --render-workers 1
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_MAX_BODY = 64 * 1024 * 1024
+RETRY_AFTER_S = 1
+
+# 種別 → (実行するプール, 応答の Content-Type)
+JOB_KINDS = {
+    "calculate": ("calc", "application/json; charset=utf-8"),
+    "excel": ("calc", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "dot": ("calc", "text/vnd.graphviz; charset=utf-8"),
+    "pdf": ("render", "application/pdf"),
+}
+
+class JobError(ValueError):
+    """リクエスト内容の誤り (400 で返す)"""
+
+# --- ワーカープロセス側 ---
+def _init_worker():
+    # 初回リクエストの待ち時間に読込時間が乗らないよう、起動時に計算エンジンを読み込んでおく
+    import benchmark, reports, diagram  # noqa: F401
+
+def calculate_project(request):
+    """リクエスト dict を計算し、(ctx, ループ網の結果) を返す"""
+    from benchmark import make_context, stage_build, stage_calculate, stage_cumulative, stage_critical
+    from constants import PIPE_DATABASES
+    from network import has_loops, solve_network
+    from templates import unpack_project
+    if not isinstance(request, dict) or "project" not in request:
+        raise JobError("project がありません")
+    try:
+        pipes, templates = unpack_project(request["project"])
+    except ValueError as e:
+        raise JobError(str(e)) from None
+    building_type = request.get("building_type", "一般・事務所 (負荷単位法)")
+    is_fv = bool(request.get("is_fv", False))
+    ctx = make_context(pipes, building_type, is_fv, request.get("settings"), templates)
+    try:
+        stage_build(ctx)
+    except (KeyError, TypeError, AttributeError) as e:
+        # ノードの項目の不足・型違い (name / parent / fixtures など) は入力の誤り
+        raise JobError(f"ノードの形式が正しくありません: {type(e).__name__}: {e}") from None
+    if ctx["root"] is None:
+        raise JobError("ルートノード (parent が null) がありません")
+    stage_calculate(ctx)
+    stage_cumulative(ctx)
+    loops = None
+    if has_loops(pipes):
+        s = ctx["settings"]
+        loops = solve_network(ctx["root"], ctx["node_map"], pipes, PIPE_DATABASES, s["loss_params"], s["pipe_type"],
+                              max_velocity=s["max_velocity"])
+    stage_critical(ctx)
+    return ctx, loops
+
+def render_diagram(request, ctx, loops):
+    from diagram import build_diagram
+    from models import get_route
+    critical = ctx["critical"]
+    route = get_route(critical, ctx["node_map"]) if critical else []
+    options = dict(request.get("diagram") or {})
+    options.setdefault("max_velocity", ctx["settings"]["max_velocity"])
+    return build_diagram(ctx["root"], ctx["building_type"], ctx["settings"]["pipe_type"],
+                         caption=request.get("caption", ""), critical_node=critical,
+                         critical_path_ids={n.id for n in route}, options=options,
+                         loop_links=loops["links"] if loops else None)
+
+def run_job(kind, body):
+    """1件分の処理 (ワーカープロセスで実行)。応答本文の bytes を返す"""
+    from reports import critical_route_rows, excel_workbook, total_dynamic_head
+    try:
+        request = json.loads(body)
+    except ValueError as e:
+        raise JobError(f"JSON を読み込めません: {e}") from None
+    ctx, loops = calculate_project(request)
+    root, critical = ctx["root"], ctx["critical"]
+    if kind == "calculate":
+        result = {
+            "total_head": round(total_dynamic_head(critical), 3),
+            "root_flow_lpm": round(root.flow_lpm, 1),
+            "critical": {"id": critical.id, "name": critical.name} if critical else None,
+            "sections": root.get_excel_data(),
+            "route": critical_route_rows(critical, ctx["node_map"]),
+            "loops": loops,
+        }
+        return json.dumps(result, ensure_ascii=False, default=float).encode("utf-8")
+    if kind == "excel":
+        return excel_workbook(root, ctx["node_map"], critical)
+    graph = render_diagram(request, ctx, loops)
+    if kind == "dot":
+        return graph.source.encode("utf-8")
+    return graph.pipe(format="pdf")
+
+# --- サーバ側 ---
+class Lane:
+    """ワーカープールと、その実行中 + 待機中の件数の上限"""
+    def __init__(self, name, workers, max_pending):
+        self.name = name
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor = None
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def start(self):
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=_init_worker)
+
+    def stats(self):
+        return {"workers": self.workers, "pending": self.pending, "max_pending": self.max_pending,
+                "completed": self.completed, "rejected": self.rejected}
+
+class Busy(Exception):
+    pass
+
+class CalcService:
+    def __init__(self, workers=None, render_workers=1, max_pending=None, max_render_pending=None,
+                 max_body=DEFAULT_MAX_BODY):
+        workers = workers or max(1, (os.cpu_count() or 2) - render_workers)
+        self.lanes = {
+            "calc": Lane("calc", workers, max_pending or workers * 8),
+            "render": Lane("render", render_workers, max_render_pending or render_workers * 2),
+        }
+        self.max_body = max_body
+        self.inflight = {}
+        self.requests = 0
+        self.coalesced = 0
+        self.started = time.time()
+
+    def start(self):
+        for lane in self.lanes.values(): lane.start()
+
+    def shutdown(self):
+        for lane in self.lanes.values():
+            if lane.executor: lane.executor.shutdown(wait=True, cancel_futures=True)
+
+    def status(self):
+        return {"uptime_s": round(time.time() - self.started, 1), "requests": self.requests,
+                "coalesced": self.coalesced, "inflight": len(self.inflight),
+                "lanes": {name: lane.stats() for name, lane in self.lanes.items()}}
+
+    async def submit(self, kind, body):
+        """実行中の同じリクエストがあればその結果を、なければワーカーで実行した結果を返す"""
+        key = (kind, hashlib.sha256(body).hexdigest())
+        future = self.inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+        lane = self.lanes[JOB_KINDS[kind][0]]
+        if lane.pending >= lane.max_pending:
+            lane.rejected += 1
+            raise Busy(lane.name)
+        lane.pending += 1
+        future = asyncio.get_running_loop().run_in_executor(lane.executor, run_job, kind, body)
+        self.inflight[key] = future
+        def done(_):
+            # 最初の依頼元が切断しても、計算が終わるまでは待っている他の依頼元に共有し続ける
+            lane.pending -= 1
+            lane.completed += 1
+            self.inflight.pop(key, None)
+        future.add_done_callback(done)
+        return await asyncio.shield(future)
+
+    async def dispatch(self, method, path, body):
+        """(ステータス, Content-Type, 本文, 追加ヘッダ)"""
+        path = path.split("?", 1)[0].rstrip("/") or "/"
+        if method == "GET" and path == "/status":
+            return HTTPStatus.OK, JOB_KINDS["calculate"][1], json.dumps(self.status()).encode(), {}
+        kind = path.lstrip("/")
+        if kind not in JOB_KINDS:
+            return _error(HTTPStatus.NOT_FOUND, f"不明なパス: {path}")
+        if method != "POST":
+            return _error(HTTPStatus.METHOD_NOT_ALLOWED, "POST で送信してください")
+        self.requests += 1
+        try:
+            payload = await self.submit(kind, body)
+        except Busy as e:
+            status = _error(HTTPStatus.SERVICE_UNAVAILABLE, f"{e} の待ち行列が一杯です")
+            status[3]["Retry-After"] = str(RETRY_AFTER_S)
+            return status
+        except JobError as e:
+            return _error(HTTPStatus.BAD_REQUEST, str(e))
+        except Exception as e:
+            return _error(HTTPStatus.INTERNAL_SERVER_ERROR, f"{type(e).__name__}: {e}")
+        return HTTPStatus.OK, JOB_KINDS[kind][1], payload, {}
+
+    async def handle(self, reader, writer):
+        """HTTP/1.1 の接続1本分 (keep-alive 対応)"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip(): break
+                method, path = request_line.decode("latin-1").split()[:2]
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""): break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length") or 0)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                if length > self.max_body:
+                    response = _error(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "リクエストが大きすぎます")
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    response = await self.dispatch(method.upper(), path, body)
+                await _write_response(writer, *response, keep_alive=keep_alive)
+                if not keep_alive: break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+def _error(status, message):
+    body = json.dumps({"error": message}, ensure_ascii=False).encode("utf-8")
+    return status, JOB_KINDS["calculate"][1], body, {}
+
+async def _write_response(writer, status, content_type, body, headers, keep_alive=True):
+    lines = [f"HTTP/1.1 {status.value} {status.phrase}", f"Content-Type: {content_type}",
+             f"Content-Length: {len(body)}", f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    lines += [f"{k}: {v}" for k, v in headers.items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+
+async def serve(service, host=DEFAULT_HOST, port=DEFAULT_PORT, ready=None):
+    service.start()
+    server = await asyncio.start_server(service.handle, host, port)
+    if ready: ready(server)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.shutdown()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="給水管計算のローカル計算サービス")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="待ち受けアドレス (既定: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=None, help="計算ワーカー数 (既定: CPU数 - 描画ワーカー数)")
+    parser.add_argument("--render-workers", type=int, default=1, help="PDF 描画ワーカー数")
+    parser.add_argument("--max-pending", type=int, default=None, help="計算の実行中 + 待機の上限 (既定: ワーカー数 × 8)")
+    parser.add_argument("--max-render-pending", type=int, default=None, help="PDF 描画の実行中 + 待機の上限 (既定: 描画ワーカー数 × 2)")
+    args = parser.parse_args(argv)
+
+    service = CalcService(args.workers, args.render_workers, args.max_pending, args.max_render_pending)
+    def ready(server):
+        lanes = ", ".join(f"{name} {lane.workers}" for name, lane in service.lanes.items())
+        print(f"計算サービス: http://{args.host}:{args.port} (ワーカー: {lanes})", file=sys.stderr)
+    try:
+        asyncio.run(serve(service, args.host, args.port, ready))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+# startup_profile.py
+"""起動時インポート時間の計測 (python -X importtime)
+
+計算系モジュールを別プロセスで読み込み、インポート時間と
+重い任意依存 (matplotlib / graphviz / openpyxl) の読み込み有無を確認する。
+予算超過や遅延読み込みの崩れがあれば終了コード 1 を返すので CI で使える。
+
+    python startup_profile.py --budget-ms 1500
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+DEFAULT_MODULES = ["constants", "utils", "models"]
+# 初回使用時まで読み込まない約束の任意依存
+LAZY_MODULES = ["matplotlib", "graphviz", "openpyxl"]
+
+def measure_import_time(modules, cwd=None):
+    """別プロセスで modules をインポートし、パッケージごとの累計時間(ms)を返す
+
+    返り値の各値はそのパッケージが最初に読み込まれた時の累計時間。
+    """
+    cwd = cwd or os.path.dirname(os.path.abspath(__file__))
+    code = "import " + ", ".join(modules)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=cwd, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr else "import failed")
+
+    cumulative = {}
+    for line in proc.stderr.splitlines():
+        # 例: "import time:       123 |       4567 |   pandas"
+        if not line.startswith("import time:"): continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit(): continue
+        top = parts[2].strip().split(".")[0]
+        ms = int(parts[1]) / 1000.0
+        # 子モジュールが先に出力されるため、最大値がパッケージ全体の時間になる
+        if ms > cumulative.get(top, -1.0):
+            cumulative[top] = ms
+    return cumulative
+
+def check_startup(modules=None, budget_ms=None, cwd=None):
+    """インポート時間と遅延読み込みの状態を検査して結果 dict を返す"""
+    modules = modules or DEFAULT_MODULES
+    cumulative = measure_import_time(modules, cwd)
+    total_ms = sum(cumulative.get(m, 0.0) for m in modules)
+    eager = [m for m in LAZY_MODULES if m in cumulative]
+    problems = []
+    if eager:
+        problems.append(f"起動時に読み込まれている任意依存: {', '.join(eager)}")
+    if budget_ms is not None and total_ms > budget_ms:
+        problems.append(f"インポート時間 {total_ms:.0f} ms が予算 {budget_ms:.0f} ms を超過")
+    return {
+        "modules": modules, "total_ms": round(total_ms, 1), "budget_ms": budget_ms,
+        "eager_optional": eager, "problems": problems,
+        "top": sorted(((k, round(v, 1)) for k, v in cumulative.items() if v > 0), key=lambda x: -x[1]),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="起動時インポート時間の計測")
+    parser.add_argument("modules", nargs="*", help=f"計測するモジュール (既定: {' '.join(DEFAULT_MODULES)})")
+    parser.add_argument("--budget-ms", type=float, default=None, help="許容するインポート時間の合計 (ms)")
+    parser.add_argument("--top", type=int, default=15, help="表示する上位パッケージ数")
+    parser.add_argument("--json", action="store_true", help="結果を JSON で出力")
+    args = parser.parse_args(argv)
+
+    result = check_startup(args.modules or None, args.budget_ms)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print(f"対象: {' '.join(result['modules'])}  合計: {result['total_ms']:.1f} ms")
+        for name, ms in result["top"][:args.top]:
+            print(f"  {ms:9.1f} ms  {name}")
+        for p in result["problems"]:
+            print(f"NG: {p}")
+    return 1 if result["problems"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,333 @@
+# store.py
+"""プロジェクトの保存先 (SQLite)
+
+テーブル
+  projects  1プロジェクト1行 (名前・設計条件・テンプレート・ノードの並び順 (ID の配列) と、
+            計算結果の要約: ルート口径・流量・全揚程)
+  nodes     1ノード1行 (保存形式の dict を JSON で持ち、親・種別・名称は列にも持つ)
+  results   ノードごとの計算結果 (流量・管種・口径・流速・損失・累計損失)
+projects.root_size, results.velocity, results.size には索引があり、
+「ルート口径が規格外のプロジェクト」「流速 2.0 m/s 超の区間」などを全プロジェクト横断で引ける。
+
+保存は差分のみ書く: ノード dict の JSON のハッシュを前回と比べ、変わったノードだけを
+INSERT / UPDATE し、なくなったノードを DELETE する (1トランザクション)。並び順は
+プロジェクト行に ID の配列で持つので、途中のノードを追加・削除しても後ろのノードは書き換えない。
+計算結果も値の変わった行だけ書き換える。
+
+    python store.py projects.db import pipe_config.json --name "A棟"
+    python store.py projects.db list
+    python store.py projects.db calc "A棟"
+    python store.py projects.db query --min-velocity 2.0
+    python store.py projects.db query --root-size 規格外
+    python store.py projects.db export "A棟" out.json
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+from datetime import datetime
+
+import pandas as pd
+
+from templates import pack_project, unpack_project, PROJECT_FORMAT
+
+DEFAULT_DB_PATH = os.environ.get("WATER_PIPE_DB", "projects.db")
+_PREFIX_END = "\U0010ffff"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    building_type TEXT NOT NULL DEFAULT '',
+    is_fv INTEGER NOT NULL DEFAULT 0,
+    settings TEXT NOT NULL DEFAULT '{}',
+    templates TEXT NOT NULL DEFAULT '{}',
+    node_order TEXT NOT NULL DEFAULT '[]',
+    node_count INTEGER NOT NULL DEFAULT 0,
+    root_size TEXT,
+    root_flow_lpm REAL,
+    total_head REAL,
+    critical_id TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    calculated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_projects_root_size ON projects(root_size);
+CREATE TABLE IF NOT EXISTS nodes (
+    project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+    node_id TEXT NOT NULL,
+    parent_id TEXT,
+    type TEXT NOT NULL,
+    name TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (project_id, node_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_nodes_parent ON nodes(project_id, parent_id);
+CREATE TABLE IF NOT EXISTS results (
+    project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+    node_id TEXT NOT NULL,
+    flow_lpm REAL,
+    pipe_type TEXT,
+    size TEXT,
+    velocity REAL,
+    head_loss REAL,
+    cum_head_loss REAL,
+    PRIMARY KEY (project_id, node_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_results_velocity ON results(velocity);
+CREATE INDEX IF NOT EXISTS idx_results_size ON results(size);
+"""
+RESULT_COLUMNS = ("flow_lpm", "pipe_type", "size", "velocity", "head_loss", "cum_head_loss")
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+def _node_json(p):
+    return json.dumps(p, ensure_ascii=False, sort_keys=True, default=str)
+
+def _match(column, value, prefix):
+    """列の一致条件 (prefix=True は前方一致。索引が効く範囲条件にする)"""
+    if prefix: return f"{column} >= ? AND {column} < ?", [value, value + _PREFIX_END]
+    return f"{column} = ?", [value]
+
+def result_rows(nodes):
+    """計算済みノードから results の値 {ノードID: (流量, 管種, 口径, 流速, 損失, 累計損失)}"""
+    return {n.id: (round(n.flow_lpm, 1), n.used_pipe_type, n.size, n.velocity, n.head_loss, round(n.cum_head_loss, 3))
+            for n in nodes}
+
+class ProjectStore:
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self._migrate()
+        self.conn.executescript(SCHEMA)
+
+    def _migrate(self):
+        # 旧形式 (nodes.seq で並び順を持つ) の DB を projects.node_order へ移す
+        columns = {r[1] for r in self.conn.execute("PRAGMA table_info(nodes)")}
+        if "seq" not in columns: return
+        with self.conn:
+            self.conn.execute("ALTER TABLE projects ADD COLUMN node_order TEXT NOT NULL DEFAULT '[]'")
+            orders = {}
+            for pid, nid in self.conn.execute("SELECT project_id, node_id FROM nodes ORDER BY project_id, seq"):
+                orders.setdefault(pid, []).append(nid)
+            self.conn.executemany("UPDATE projects SET node_order = ? WHERE id = ?",
+                                  [(json.dumps(ids, ensure_ascii=False), pid) for pid, ids in orders.items()])
+            self.conn.execute("ALTER TABLE nodes DROP COLUMN seq")
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _project_id(self, name):
+        row = self.conn.execute("SELECT id FROM projects WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise ValueError(f"プロジェクト「{name}」がありません")
+        return row[0]
+
+    def list_projects(self):
+        """全プロジェクトの一覧 (更新日時の新しい順)"""
+        return pd.read_sql_query(
+            "SELECT name AS 名称, building_type AS 用途, node_count AS ノード数, root_size AS ルート口径, "
+            "root_flow_lpm AS \"ルート流量 (L/min)\", total_head AS \"全揚程 (m)\", updated_at AS 更新日時, "
+            "calculated_at AS 計算日時 FROM projects ORDER BY updated_at DESC, name", self.conn)
+
+    def names(self):
+        return [r[0] for r in self.conn.execute("SELECT name FROM projects ORDER BY name")]
+
+    def load(self, name):
+        """{"pipes", "templates", "building_type", "is_fv", "settings"}"""
+        pid, building_type, is_fv, settings, templates, order = self.conn.execute(
+            "SELECT id, building_type, is_fv, settings, templates, node_order FROM projects WHERE name = ?",
+            (name,)).fetchone() or (None,) * 6
+        if pid is None:
+            raise ValueError(f"プロジェクト「{name}」がありません")
+        by_id = {nid: d for nid, d in self.conn.execute("SELECT node_id, data FROM nodes WHERE project_id = ?", (pid,))}
+        order = [nid for nid in json.loads(order) if nid in by_id]
+        order += sorted(by_id.keys() - set(order))   # 並び順にないノード (通常はない) は末尾へ
+        pipes = [json.loads(by_id[nid]) for nid in order]
+        templates = json.loads(templates)
+        data = {"format": PROJECT_FORMAT, "templates": templates, "pipes": pipes} if templates else pipes
+        pipes, templates = unpack_project(data)
+        return {"pipes": pipes, "templates": templates, "building_type": building_type, "is_fv": bool(is_fv),
+                "settings": json.loads(settings)}
+
+    def save(self, name, pipes, templates=None, building_type=None, is_fv=None, settings=None):
+        """変わったノードだけを書き込む。{"inserted", "updated", "deleted"} の件数を返す"""
+        packed = pack_project(pipes, templates or {})
+        nodes = packed["pipes"] if isinstance(packed, dict) else packed
+        used_templates = packed["templates"] if isinstance(packed, dict) else {}
+        counts = {"inserted": 0, "updated": 0, "deleted": 0}
+        now = _now()
+        with self.conn:
+            row = self.conn.execute("SELECT id, node_order FROM projects WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                pid = self.conn.execute("INSERT INTO projects (name, created_at, updated_at) VALUES (?, ?, ?)",
+                                        (name, now, now)).lastrowid
+                stored, stored_order = {}, None
+            else:
+                pid, stored_order = row
+                stored = dict(self.conn.execute("SELECT node_id, digest FROM nodes WHERE project_id = ?", (pid,)))
+            inserts, updates = [], []
+            for p in nodes:
+                text = _node_json(p)
+                digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+                old = stored.pop(p["id"], None)
+                if old == digest: continue
+                values = (p.get("parent"), p.get("type", ""), p.get("name", ""), digest, text)
+                if old is None: inserts.append((pid, p["id"]) + values)
+                else: updates.append(values + (pid, p["id"]))
+            self.conn.executemany("INSERT INTO nodes (project_id, node_id, parent_id, type, name, digest, data) "
+                                  "VALUES (?, ?, ?, ?, ?, ?, ?)", inserts)
+            self.conn.executemany("UPDATE nodes SET parent_id = ?, type = ?, name = ?, digest = ?, data = ? "
+                                  "WHERE project_id = ? AND node_id = ?", updates)
+            removed = [(pid, nid) for nid in stored]
+            self.conn.executemany("DELETE FROM nodes WHERE project_id = ? AND node_id = ?", removed)
+            self.conn.executemany("DELETE FROM results WHERE project_id = ? AND node_id = ?", removed)
+            fields = {"templates": json.dumps(used_templates, ensure_ascii=False), "node_count": len(nodes), "updated_at": now}
+            order = json.dumps([p["id"] for p in nodes], ensure_ascii=False)
+            if order != stored_order: fields["node_order"] = order
+            if building_type is not None: fields["building_type"] = building_type
+            if is_fv is not None: fields["is_fv"] = int(bool(is_fv))
+            if settings is not None: fields["settings"] = json.dumps(settings, ensure_ascii=False)
+            self.conn.execute(f"UPDATE projects SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                              list(fields.values()) + [pid])
+            counts.update(inserted=len(inserts), updated=len(updates), deleted=len(removed))
+        return counts
+
+    def save_results(self, name, nodes, root=None, critical=None, total_head=None):
+        """計算済みノードの結果を書き込む (値の変わった行だけ)。書き換えた行数を返す"""
+        pid = self._project_id(name)
+        rows = result_rows(nodes)
+        with self.conn:
+            stored = {r[0]: tuple(r[1:]) for r in self.conn.execute(
+                f"SELECT node_id, {', '.join(RESULT_COLUMNS)} FROM results WHERE project_id = ?", (pid,))}
+            changed = [(pid, nid) + values for nid, values in rows.items() if stored.get(nid) != values]
+            self.conn.executemany(f"INSERT OR REPLACE INTO results (project_id, node_id, {', '.join(RESULT_COLUMNS)}) "
+                                  f"VALUES (?, ?, {', '.join('?' * len(RESULT_COLUMNS))})", changed)
+            stale = [(pid, nid) for nid in stored.keys() - rows.keys()]
+            self.conn.executemany("DELETE FROM results WHERE project_id = ? AND node_id = ?", stale)
+            self.conn.execute("UPDATE projects SET root_size = ?, root_flow_lpm = ?, total_head = ?, critical_id = ?, "
+                              "calculated_at = ? WHERE id = ?",
+                              (root.size if root else None, round(root.flow_lpm, 1) if root else None,
+                               round(total_head, 3) if total_head is not None else None,
+                               critical.id if critical else None, _now(), pid))
+        return len(changed) + len(stale)
+
+    def delete(self, name):
+        with self.conn:
+            self.conn.execute("DELETE FROM projects WHERE id = ?", (self._project_id(name),))
+
+    def find_projects(self, root_size=None, prefix=False, min_total_head=None):
+        """条件に合うプロジェクトの一覧 (root_size は prefix=True で前方一致: "規格外" → "規格外(過大)" も含む)"""
+        where, params = [], []
+        if root_size is not None:
+            cond, p = _match("root_size", root_size, prefix); where.append(cond); params += p
+        if min_total_head is not None:
+            where.append("total_head > ?"); params.append(min_total_head)
+        sql = ("SELECT name AS 名称, building_type AS 用途, root_size AS ルート口径, root_flow_lpm AS \"ルート流量 (L/min)\", "
+               "total_head AS \"全揚程 (m)\", calculated_at AS 計算日時 FROM projects")
+        if where: sql += " WHERE " + " AND ".join(where)
+        return pd.read_sql_query(sql + " ORDER BY name", self.conn, params=params)
+
+    def find_sections(self, min_velocity=None, size=None, prefix=False, project=None, limit=None):
+        """全プロジェクト横断の区間検索 (流速の大きい順)"""
+        where, params = [], []
+        if min_velocity is not None:
+            where.append("r.velocity > ?"); params.append(min_velocity)
+        if size is not None:
+            cond, p = _match("r.size", size, prefix); where.append(cond); params += p
+        if project is not None:
+            where.append("r.project_id = ?"); params.append(self._project_id(project))
+        sql = ("SELECT p.name AS プロジェクト, r.node_id AS ID, n.name AS 区間, r.flow_lpm AS \"流量 (L/min)\", "
+               "r.pipe_type AS 管種, r.size AS 口径, r.velocity AS \"流速 (m/s)\", r.head_loss AS \"単独損失 (m)\", "
+               "r.cum_head_loss AS \"累計損失 (m)\" FROM results r JOIN projects p ON p.id = r.project_id "
+               "JOIN nodes n ON n.project_id = r.project_id AND n.node_id = r.node_id")
+        if where: sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY r.velocity DESC"
+        if limit: sql += f" LIMIT {int(limit)}"
+        return pd.read_sql_query(sql, self.conn, params=params)
+
+def calculate_stored(store, name):
+    """保存済みの設計条件でプロジェクトを計算し、結果を書き込む
+
+    最遠末端の選び方・全揚程は画面と同じ (find_critical_node / reports.total_dynamic_head。末端必要圧は MPa → m 換算)。
+    画面から保存した結果と calc で書き直した結果は一致する。
+    """
+    from reports import total_dynamic_head
+    from service import calculate_project
+    project = store.load(name)
+    ctx, _ = calculate_project({"project": {"format": PROJECT_FORMAT, "templates": project["templates"], "pipes": project["pipes"]},
+                                "building_type": project["building_type"] or "一般・事務所 (負荷単位法)",
+                                "is_fv": project["is_fv"], "settings": project["settings"]})
+    critical = ctx["critical"]
+    return store.save_results(name, ctx["node_map"].values(), ctx["root"], critical, total_dynamic_head(critical))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="プロジェクトDB (SQLite) の操作")
+    parser.add_argument("db", nargs="?", default=DEFAULT_DB_PATH, help="DBファイル (既定: WATER_PIPE_DB または projects.db)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="プロジェクト一覧")
+    p_import = sub.add_parser("import", help="保存データ (JSON) を取り込む")
+    p_import.add_argument("files", nargs="+")
+    p_import.add_argument("--name", help="プロジェクト名 (省略時はファイル名。複数ファイルでは無視)")
+    p_import.add_argument("--building-type", default=None)
+    p_export = sub.add_parser("export", help="保存データ (JSON) に書き出す")
+    p_export.add_argument("name")
+    p_export.add_argument("output")
+    p_calc = sub.add_parser("calc", help="計算して結果を保存する")
+    p_calc.add_argument("names", nargs="*", help="省略時は全プロジェクト")
+    p_query = sub.add_parser("query", help="区間・プロジェクトの検索")
+    p_query.add_argument("--min-velocity", type=float, help="流速がこの値を超える区間")
+    p_query.add_argument("--size", help="口径が一致する区間 (前方一致)")
+    p_query.add_argument("--root-size", help="ルート口径が一致するプロジェクト (前方一致)")
+    p_query.add_argument("--project", help="区間検索の対象プロジェクト")
+    p_query.add_argument("--limit", type=int, default=None)
+    p_delete = sub.add_parser("delete", help="プロジェクトを削除する")
+    p_delete.add_argument("name")
+    args = parser.parse_args(argv)
+
+    pd.set_option("display.width", 200)
+    with ProjectStore(args.db) as store:
+        try:
+            if args.command == "list":
+                print(store.list_projects().to_string(index=False))
+            elif args.command == "import":
+                for path in args.files:
+                    with open(path, encoding="utf-8") as f:
+                        pipes, templates = unpack_project(json.load(f))
+                    name = args.name if args.name and len(args.files) == 1 else os.path.splitext(os.path.basename(path))[0]
+                    counts = store.save(name, pipes, templates, building_type=args.building_type)
+                    print(f"{name}: 追加 {counts['inserted']} / 更新 {counts['updated']} / 削除 {counts['deleted']}")
+            elif args.command == "export":
+                project = store.load(args.name)
+                with open(args.output, "w", encoding="utf-8") as f:
+                    json.dump(pack_project(project["pipes"], project["templates"]), f, ensure_ascii=False, indent=2)
+            elif args.command == "calc":
+                for name in args.names or store.names():
+                    print(f"{name}: 結果 {calculate_stored(store, name)} 行を更新")
+            elif args.command == "query":
+                if args.root_size is not None:
+                    print(store.find_projects(args.root_size, prefix=True).to_string(index=False))
+                if args.min_velocity is not None or args.size is not None or args.root_size is None:
+                    print(store.find_sections(args.min_velocity, args.size, prefix=True, project=args.project,
+                                              limit=args.limit).to_string(index=False))
+            elif args.command == "delete":
+                store.delete(args.name)
+        except ValueError as e:
+            print(f"エラー: {e}", file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+# synthetic.py
+"""ベンチマーク用の合成プロジェクト生成
+
+どの生成関数も保存形式 (pipe_config.json と同じノード dict のリスト) を返す。
+乱数は seed で固定されるので、同じ引数なら毎回同じツリーになる。
+ツリーの深さは計算エンジンの再帰上限に掛からないよう数百段以内に抑えている。
+"""
+import random
+from constants import PRESETS, FIXTURE_SPECS
+from builders import make_node, make_root
+
+# 1本の立管に積む最大階数 (これを超える規模は立管を増やす)
+MAX_FLOORS_PER_RISER = 60
+
+class _Builder:
+    """ID採番とノード追加をまとめる小さなヘルパー"""
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.pipes = [make_root()]
+        self.branch_counter = 0
+        self.system_counter = 0
+
+    def branch(self, parent, **fields):
+        self.branch_counter += 1
+        node = make_node(f"node_branch_{self.branch_counter}", f"分岐-{self.branch_counter}", "branch", parent, **fields)
+        self.pipes.append(node)
+        return node["id"]
+
+    def system(self, parent, preset_name, **fields):
+        self.system_counter += 1
+        preset = PRESETS[preset_name]
+        node = make_node(
+            f"node_system_{self.system_counter}", f"系統 ({preset_name})-{self.system_counter}", "system", parent,
+            fixtures=dict(preset["fixtures"]), dwelling_count=preset.get("dw", 1), person_count=preset.get("person", 1)
+        )
+        node.update(fields)
+        self.pipes.append(node)
+        return node["id"]
+
+    def fixture(self, parent, fixture_type, **fields):
+        self.branch_counter += 1
+        node = make_node(f"node_fixture_{self.branch_counter}", f"器具-{self.branch_counter}", "fixture", parent,
+                         dwelling_count=0, person_count=0, fixture_type=fixture_type, **fields)
+        self.pipes.append(node)
+        return node["id"]
+
+    def __len__(self):
+        return len(self.pipes)
+
+def _risers(b, n_nodes, units_per_floor, floor_height, add_unit, nodes_per_unit=1.0):
+    """立管 (階ごとの分岐の連なり) を n_nodes に達するまで追加する"""
+    nodes_per_floor = int(units_per_floor * nodes_per_unit) + 1
+    floors_total = max(1, (n_nodes - 1) // nodes_per_floor)
+    n_risers = max(1, -(-floors_total // MAX_FLOORS_PER_RISER))
+    floors_left = floors_total
+    for r in range(n_risers):
+        floors = min(MAX_FLOORS_PER_RISER, -(-floors_left // (n_risers - r)))
+        floors_left -= floors
+        parent = "root"
+        for f in range(floors):
+            parent = b.branch(parent, length=3.0 if f else 10.0 + r)
+            for _ in range(units_per_floor):
+                if len(b) >= n_nodes: return
+                add_unit(parent, (f + 1) * floor_height)
+            if len(b) >= n_nodes: return
+
+def tower(n_nodes, units_per_floor=8, seed=0):
+    """N階建て集合住宅: 立管ごとに各階の分岐と住戸系統をぶら下げる"""
+    b = _Builder(seed)
+    presets = ["単身住戸 (1R)", "ファミリー (3LDK)"]
+    def add_unit(parent, head):
+        b.system(parent, b.rng.choice(presets), length=round(b.rng.uniform(1.0, 8.0), 1),
+                 static_head=head, required_pressure=0.1)
+    _risers(b, n_nodes, units_per_floor, 3.0, add_unit)
+    return b.pipes
+
+def bl_apartment(n_nodes, units_per_floor=10, seed=0):
+    """BL基準の大規模集合住宅: 系統ごとに複数戸を担当させる"""
+    b = _Builder(seed)
+    def add_unit(parent, head):
+        b.system(parent, "ファミリー (3LDK)", dwelling_count=b.rng.randint(1, 4),
+                 length=round(b.rng.uniform(1.0, 6.0), 1), static_head=head, required_pressure=0.1)
+    _risers(b, n_nodes, units_per_floor, 2.9, add_unit)
+    return b.pipes
+
+def campus(n_nodes, fanout=4, seed=0):
+    """キャンパス型: 分岐が多段に広がり、葉に系統が付く"""
+    b = _Builder(seed)
+    presets = list(PRESETS.keys())
+    # 幅優先で分岐を展開し、最後の段を系統にする
+    n_branches = max(1, (n_nodes - 1) // (fanout + 1))
+    frontier = ["root"]
+    queue_idx = 0
+    while len(b) - 1 < n_branches:
+        parent = frontier[queue_idx]; queue_idx += 1
+        for _ in range(fanout):
+            if len(b) - 1 >= n_branches: break
+            frontier.append(b.branch(parent, length=round(b.rng.uniform(5.0, 60.0), 1)))
+    leaves = frontier[queue_idx:] or ["root"]
+    i = 0
+    while len(b) < n_nodes:
+        b.system(leaves[i % len(leaves)], b.rng.choice(presets), length=round(b.rng.uniform(2.0, 20.0), 1),
+                 static_head=round(b.rng.uniform(0.0, 15.0), 1), required_pressure=0.1)
+        i += 1
+    return b.pipes
+
+def public_building(n_nodes, fixtures_per_toilet=12, seed=0):
+    """器具の多い公共建築: 各階のトイレ分岐に器具ノードを個別に並べる"""
+    b = _Builder(seed)
+    public_fixtures = [k for k in FIXTURE_SPECS if "(公)" in k]
+    def add_toilet(parent, head):
+        if b.rng.random() < 0.3:
+            b.system(parent, "公共トイレ (大)", length=3.0, static_head=head, required_pressure=0.1)
+            return
+        toilet = b.branch(parent, length=4.0)
+        for _ in range(fixtures_per_toilet):
+            if len(b) >= n_nodes: return
+            b.fixture(toilet, b.rng.choice(public_fixtures), length=round(b.rng.uniform(0.5, 3.0), 1),
+                      static_head=head + 1.0, required_pressure=0.07)
+    _risers(b, n_nodes, 3, 4.0, add_toilet, nodes_per_unit=0.3 + 0.7 * (fixtures_per_toilet + 1))
+    return b.pipes
+
+# シナリオ名 → (生成関数, 建物用途, 洗浄弁方式)
+SCENARIOS = {
+    "tower": (tower, "集合住宅 (人数基準)", False),
+    "bl_apartment": (bl_apartment, "集合住宅 (BL基準)", False),
+    "campus": (campus, "一般・事務所 (負荷単位法)", True),
+    "public_building": (public_building, "一般・事務所 (負荷単位法)", True),
+}
+
+def generate(scenario, n_nodes, seed=0):
+    """シナリオ名と概算ノード数からプロジェクトを生成する"""
+    if scenario not in SCENARIOS:
+        raise ValueError(f"未知のシナリオ: {scenario} (候補: {', '.join(SCENARIOS)})")
+    func, building_type, is_fv = SCENARIOS[scenario]
+    return func(n_nodes, seed=seed), building_type, is_fv
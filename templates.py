@@ -0,0 +1,91 @@
+# templates.py
+"""基準階テンプレート (同一系統の繰り返し)
+
+系統ノードは "template" にテンプレートIDを持つと、器具・戸数・人数・器具接続管長を
+テンプレートから引き継ぐ。"repeat" (台数) または "floors" (階名リスト) を指定すると
+同一系統がその数だけ並列に接続されているものとして計算される。
+
+保存ファイルはテンプレートを使っている場合のみ
+{"format": 2, "templates": {...}, "pipes": [...]} となり、
+テンプレート参照ノードからは引き継ぎ項目を省く。従来のリスト形式もそのまま読める。
+"""
+import copy
+
+TEMPLATE_FIELDS = ("fixtures", "dwelling_count", "person_count", "inner_pipe_length")
+PROJECT_FORMAT = 2
+
+def make_template(node, name=None):
+    """系統ノードの内容からテンプレート dict を作る"""
+    tpl = {"name": name or node["name"]}
+    for key in TEMPLATE_FIELDS:
+        tpl[key] = copy.deepcopy(node.get(key))
+    if tpl["fixtures"] is None: tpl["fixtures"] = {}
+    return tpl
+
+def new_template_id(templates):
+    n = len(templates) + 1
+    while f"tpl_{n}" in templates: n += 1
+    return f"tpl_{n}"
+
+def repeat_count(p):
+    """ノードの繰り返し数 (階名リストがあればその数)"""
+    floors = p.get("floors")
+    if floors: return len(floors)
+    try:
+        return max(1, int(p.get("repeat", 1) or 1))
+    except (TypeError, ValueError):
+        return 1
+
+def link_templates(pipes, templates):
+    """テンプレート参照ノードの引き継ぎ項目をテンプレートと同じオブジェクトにする
+
+    fixtures の dict を共有するので、画面でどちらを編集してもテンプレートに反映される。
+    """
+    for p in pipes:
+        tpl = templates.get(p.get("template")) if p.get("template") else None
+        if tpl is None: continue
+        for key in TEMPLATE_FIELDS:
+            p[key] = tpl[key]
+    return pipes
+
+def detach_template(node, templates):
+    """テンプレート参照を外し、現在の値をノード固有の値として複製する"""
+    tpl = templates.get(node.get("template"))
+    if tpl:
+        for key in TEMPLATE_FIELDS:
+            node[key] = copy.deepcopy(tpl[key])
+    node.pop("template", None)
+
+def sync_template_fields(node, templates):
+    """画面で編集したノードの値 (戸数・人数など) をテンプレートへ書き戻す"""
+    tpl = templates.get(node.get("template")) if node.get("template") else None
+    if tpl is None: return
+    for key in TEMPLATE_FIELDS:
+        if key in node and node[key] is not tpl[key]:
+            tpl[key] = node[key]
+    link_templates([node], templates)
+
+def pack_project(pipes, templates):
+    """保存用データを作る (テンプレート未使用なら従来のリスト形式)"""
+    used = {p["template"] for p in pipes if p.get("template") in (templates or {})}
+    if not used:
+        return pipes
+    packed = []
+    for p in pipes:
+        if p.get("template") in used:
+            p = {k: v for k, v in p.items() if k not in TEMPLATE_FIELDS}
+        packed.append(p)
+    return {"format": PROJECT_FORMAT, "templates": {k: templates[k] for k in sorted(used)}, "pipes": packed}
+
+def unpack_project(data):
+    """保存データ (リスト形式 / テンプレート形式) から (pipes, templates) を得る"""
+    if isinstance(data, list):
+        return data, {}
+    if not isinstance(data, dict) or "pipes" not in data:
+        raise ValueError("プロジェクトファイルの形式が不正です")
+    templates = data.get("templates") or {}
+    pipes = data["pipes"]
+    for p in pipes:
+        if p.get("template") and p["template"] not in templates:
+            raise ValueError(f"テンプレート {p['template']} が見つかりません ({p.get('id')})")
+    return link_templates(pipes, templates), templates
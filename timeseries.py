@@ -0,0 +1,160 @@
+# timeseries.py
+"""時系列の需要パターンによる全区間の流量・流速・損失
+
+各ノードの基準流量 = 自身の器具の平均使用流量 Σ 個数 × 使用確率 × 吐水量
+(FIXTURE_USAGE、ピーク時の平均) に、時刻別のパターン係数を掛けたものを需要とする。
+パターンは建物用途ごと、またはノード (系統) ごとに指定できる。
+
+パターンが K 種類なら、区間流量は
+    Q(区間, t) = Σ_k W[区間, k] · P[k, t]
+と書ける。W (区間 × K) は基準流量をパターン別に TreeArrays.subtree_sum で1回だけ
+足し上げたもの (calculate と同じツリー集約) なので、各時刻は行列積になる。
+時刻はメモリ上限に収まる幅のチャンクに分けて計算し、区間ごとの最大・平均と
+ルートの総流量・必要全揚程の時系列だけを残す (1分刻み1年分でも扱える)。
+口径は calculate() で決めた設計口径のまま、損失は loss_params の計算式で求める。
+"""
+import numpy as np
+import pandas as pd
+
+from constants import DEMAND_PATTERNS, MPA_TO_HEAD_M
+from tree_arrays import TreeArrays
+from montecarlo import own_fixtures, usage_of
+from optimizer import constrained_terminals, terminal_fixed_head
+from friction import is_darcy, darcy_losses, roughness_mm, DEFAULT_TEMPERATURE_C
+
+DEFAULT_STEP_MINUTES = 60
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+MINUTES_PER_DAY = 1440
+
+def default_pattern(building_type):
+    return "住宅" if ("住宅" in building_type or "一戸建て" in building_type) else "事務所"
+
+def expand_pattern(hourly, step_minutes=DEFAULT_STEP_MINUTES, days=1):
+    """時刻別 (24値) のパターンを step_minutes 刻み・days 日分に直線補間で展開する"""
+    hourly = np.asarray(hourly, dtype=float)
+    t_hours = np.arange(0, days * MINUTES_PER_DAY, step_minutes) / 60.0
+    hours = np.arange(len(hourly) + 1)
+    return np.interp(t_hours % len(hourly), hours, np.append(hourly, hourly[0]))
+
+def base_flow(node, usage=None):
+    """自身の器具の平均使用流量 (L/min)"""
+    total = 0.0
+    for name, qty in own_fixtures(node).items():
+        u = usage_of(name, usage)
+        total += qty * u["p"] * u["flow"]
+    return total
+
+class ProfileModel:
+    """時系列計算用の配列表現 (区間 × パターン の集約済み基準流量と管路定数)"""
+    def __init__(self, root, loss_params, pattern_names, pattern_of=None, default=None, usage=None,
+                 pressure_to_head=MPA_TO_HEAD_M):
+        pattern_of = pattern_of or {}
+        order, stack = [], [root]
+        while stack:
+            n = stack.pop()
+            order.append(n)
+            stack.extend(reversed(n.children))
+        self.nodes = order
+        self.tree = TreeArrays([n.id for n in order], [n.parent_id if n is not root else None for n in order],
+                               [1 if n is root else n.repeat for n in order])
+        column = {name: k for k, name in enumerate(pattern_names)}
+        default = default if default in column else pattern_names[0]
+        B = np.zeros((len(order), len(pattern_names)))
+        for i, n in enumerate(order):
+            B[i, column.get(pattern_of.get(n.id), column[default])] = base_flow(n, usage)
+        # 配下の基準流量をパターン別に集約 (L/min → m³/s)
+        self.W = self.tree.subtree_sum(B) / 60000
+
+        self.loss_params = loss_params or {}
+        fit_rate = self.loss_params.get("fitting", 1.2)
+        self.d_mm = np.array([n.inner_diameter for n in order], dtype=float)
+        self.L_eq = np.array([n.length * fit_rate + n.equivalent_length for n in order], dtype=float)
+        self.area = np.pi * (self.d_mm / 1000 / 2) ** 2
+        self.roughness = np.array([roughness_mm(n.used_pipe_type, self.loss_params) for n in order], dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            C_val = self.loss_params.get("C", 130.0)
+            self.hw_k = np.where(self.d_mm > 0, 10.666 * (C_val ** -1.852) * (self.d_mm / 1000.0) ** -4.87 * self.L_eq, 0.0)
+        index = self.tree.index
+        targets = constrained_terminals(root)
+        self.target_rows = np.array([index[t.id] for t in targets], dtype=np.int64)
+        self.target_fixed = np.array([terminal_fixed_head(t, pressure_to_head) for t in targets], dtype=float)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def head_loss(self, q_m3s):
+        """区間 × 時刻 の損失 (m)。口径が決まらない区間・流量0は0"""
+        if not self.loss_params: return np.zeros_like(q_m3s)
+        if is_darcy(self.loss_params):
+            return darcy_losses(q_m3s, self.d_mm[:, None], self.L_eq[:, None], self.roughness[:, None],
+                                self.loss_params.get("temperature", DEFAULT_TEMPERATURE_C), cache=None)
+        return self.hw_k[:, None] * q_m3s ** 1.852
+
+    def evaluate(self, P):
+        """P (パターン × 時刻) に対する (流量 m³/s, 流速 m/s, 損失 m, 必要全揚程 m)"""
+        q = self.W @ P
+        velocity = np.divide(q, self.area[:, None], out=np.zeros_like(q), where=self.area[:, None] > 0)
+        h = self.head_loss(q)
+        cum = np.empty_like(h)
+        levels = self.tree.levels
+        cum[levels[0]] = h[levels[0]]
+        for lvl in levels[1:]:
+            cum[lvl] = cum[self.tree.parent[lvl]] + h[lvl]
+        total_head = (cum[self.target_rows] + self.target_fixed[:, None]).max(axis=0) if len(self.target_rows) else np.zeros(q.shape[1])
+        return q, velocity, h, total_head
+
+    def chunk_size(self, max_bytes=DEFAULT_MAX_BYTES):
+        # 区間 × 時刻 の配列を5本程度同時に持つ
+        return max(1, int(max_bytes // (len(self) * 8 * 5)))
+
+def evaluate_profile(root, loss_params, patterns=None, building_type="", pattern_of=None, step_minutes=DEFAULT_STEP_MINUTES,
+                     days=1, usage=None, max_bytes=DEFAULT_MAX_BYTES, pressure_to_head=MPA_TO_HEAD_M):
+    """全区間・全時刻の流量・流速・損失を求め、区間ごとの集計とルートの時系列を返す
+
+    calculate() の後に呼ぶ。ツリーは変更しない。
+    返り値の dict: sections (区間ごとの DataFrame), series (時刻ごとの DataFrame),
+    peak_flow_lpm, peak_head, daily_max_m3, hourly_max_m3
+    """
+    patterns = DEMAND_PATTERNS if patterns is None else patterns
+    names = list(patterns)
+    model = ProfileModel(root, loss_params, names, pattern_of, default_pattern(building_type), usage, pressure_to_head)
+    P = np.vstack([expand_pattern(patterns[name], step_minutes, days) for name in names])
+    n, T = len(model), P.shape[1]
+    chunk = model.chunk_size(max_bytes)
+
+    max_q = np.zeros(n); argmax_q = np.zeros(n, dtype=np.int64); sum_q = np.zeros(n)
+    max_v = np.zeros(n); max_h = np.zeros(n)
+    root_q = np.empty(T); head = np.empty(T)
+    for start in range(0, T, chunk):
+        stop = min(T, start + chunk)
+        q, v, h, total_head = model.evaluate(P[:, start:stop])
+        arg = q.argmax(axis=1)
+        chunk_max = q[np.arange(n), arg]
+        better = chunk_max > max_q
+        max_q[better] = chunk_max[better]; argmax_q[better] = arg[better] + start
+        sum_q += q.sum(axis=1)
+        np.maximum(max_v, v.max(axis=1), out=max_v)
+        np.maximum(max_h, h.max(axis=1), out=max_h)
+        root_q[start:stop] = q[0]
+        head[start:stop] = total_head
+
+    hours = np.arange(T) * step_minutes / 60.0
+    sections = pd.DataFrame({
+        "区間": [nd.name for nd in model.nodes],
+        "設計流量 (L/min)": np.round([nd.flow_lpm for nd in model.nodes], 1),
+        "最大流量 (L/min)": (max_q * 60000).round(1),
+        "最大時刻 (h)": hours[argmax_q].round(2),
+        "平均流量 (L/min)": (sum_q / T * 60000).round(1),
+        "最大流速 (m/s)": max_v.round(2),
+        "最大損失 (m)": max_h.round(3),
+    }, index=[nd.id for nd in model.nodes])
+    series = pd.DataFrame({"経過時間 (h)": hours, "総流量 (L/min)": root_q * 60000, "必要全揚程 (m)": head})
+
+    volume_m3 = root_q * step_minutes * 60   # 各ステップの使用量 (m³)
+    steps_per_day = max(1, MINUTES_PER_DAY // step_minutes)
+    steps_per_hour = max(1, 60 // step_minutes)
+    daily = np.add.reduceat(volume_m3, np.arange(0, T, steps_per_day))
+    hourly = np.add.reduceat(volume_m3, np.arange(0, T, steps_per_hour))
+    return {"sections": sections, "series": series, "peak_flow_lpm": float(root_q.max() * 60000) if T else 0.0,
+            "peak_head": float(head.max()) if T else 0.0, "daily_max_m3": float(daily.max()) if T else 0.0,
+            "hourly_max_m3": float(hourly.max()) if T else 0.0}
@@ -0,0 +1,132 @@
+# tree_arrays.py
+"""ツリーと器具構成の配列表現
+
+TreeArrays はノードの親子関係を「親の行番号」と深さ別の行番号リストで持ち、
+配下合計を深い階層から1段ずつまとめて足し上げる (1回のツリー集約)。
+FixtureMatrix はノード×器具種別の疎行列 (行, 列, 個数 の3配列) で、
+各ノードの負荷単位は FIXTURE_SPECS の LU ベクトルとの行列ベクトル積で求まる。
+器具データを切り替えるときは LU ベクトルを作り直すだけでよい。
+"""
+import numpy as np
+
+from templates import repeat_count
+
+class TreeArrays:
+    """親子関係の配列表現 (行番号は pipes の並び順)"""
+    def __init__(self, ids, parent_ids, repeat=None):
+        self.ids = list(ids)
+        self.index = {nid: i for i, nid in enumerate(self.ids)}
+        n = len(self.ids)
+        parent = [self.index.get(pid, -1) if pid else -1 for pid in parent_ids]
+        self.parent = np.array(parent, dtype=np.int64)
+        self.repeat = np.ones(n, dtype=np.int64) if repeat is None else np.asarray(repeat, dtype=np.int64)
+        # 親のないノードを起点に幅優先で深さを付ける (親が見つからないノードも深さ0の起点になる)
+        children = [[] for _ in range(n)]
+        level = []
+        for i, p in enumerate(parent):
+            if p >= 0: children[p].append(i)
+            else: level.append(i)
+        self.depth = np.full(n, -1, dtype=np.int64)
+        self.levels = []
+        d = 0
+        while level:
+            self.levels.append(np.array(level, dtype=np.int64))
+            self.depth[level] = d
+            level = [c for i in level for c in children[i]]
+            d += 1
+        self.children = children
+
+    @classmethod
+    def from_pipes(cls, pipes):
+        return cls([p["id"] for p in pipes], [p.get("parent") for p in pipes], [repeat_count(p) for p in pipes])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def subtree_sum(self, values):
+        """自身の値 + Σ(子の配下合計 × 子の繰り返し数) を全ノードについて求める
+
+        子の合計を先に足し、最後に自身の値へ加える順序は PipeSection.calculate と同じ。
+        values は (ノード,) または (ノード, 列) の配列 (列ごとに独立に集約する)。
+        """
+        values = np.asarray(values)
+        child_sum = np.zeros_like(values)
+        total = np.zeros_like(values)
+        trailing = (1,) * (values.ndim - 1)
+        for lvl in reversed(self.levels):
+            total[lvl] = values[lvl] + child_sum[lvl]
+            has_parent = lvl[self.parent[lvl] >= 0]
+            np.add.at(child_sum, self.parent[has_parent], total[has_parent] * self.repeat[has_parent].reshape(-1, *trailing))
+        return total
+
+class FixtureMatrix:
+    """ノード×器具種別の疎行列 (COO形式)
+
+    個別器具ノード (type == "fixture") の器具種別は別フラグの要素として持ち、
+    その器具が器具データにあれば負荷単位 = その LU、器具数 = 1 で上書きする。
+    """
+    def __init__(self, n_rows, names, rows, cols, qty, is_type_entry):
+        self.n_rows = n_rows
+        self.names = names
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.cols = np.asarray(cols, dtype=np.int64)
+        self.qty = np.asarray(qty, dtype=np.float64)
+        self.is_type_entry = np.asarray(is_type_entry, dtype=bool)
+        self.integral = bool(np.all(self.qty == np.floor(self.qty)))
+
+    @classmethod
+    def from_pipes(cls, pipes, templates=None):
+        templates = templates or {}
+        col_of = {}
+        rows, cols, qty, flags = [], [], [], []
+        for i, p in enumerate(pipes):
+            tpl = templates.get(p.get("template")) if p.get("template") else None
+            fixtures = (tpl.get("fixtures") if tpl else p.get("fixtures")) or {}
+            for name, q in fixtures.items():
+                if q > 0:
+                    rows.append(i); cols.append(col_of.setdefault(name, len(col_of))); qty.append(q); flags.append(False)
+            if p.get("type") == "fixture" and p.get("fixture_type"):
+                rows.append(i); cols.append(col_of.setdefault(p["fixture_type"], len(col_of))); qty.append(1); flags.append(True)
+        return cls(len(pipes), list(col_of), rows, cols, qty, flags)
+
+    def lu_vector(self, specs):
+        """列 (器具種別) ごとの LU。器具データにない種別は 0"""
+        return np.array([specs[name]["lu"] if name in specs else 0.0 for name in self.names], dtype=np.float64)
+
+    def node_stats(self, specs):
+        """各ノード自身の (負荷単位, 器具数) 配列"""
+        lu = self.lu_vector(specs)
+        base = ~self.is_type_entry
+        loads = np.bincount(self.rows[base], weights=self.qty[base] * lu[self.cols[base]], minlength=self.n_rows)
+        counts = np.bincount(self.rows[base], weights=self.qty[base], minlength=self.n_rows)
+        known = np.array([name in specs for name in self.names], dtype=bool)
+        override = self.is_type_entry & known[self.cols] if len(self.cols) else self.is_type_entry
+        loads[self.rows[override]] = lu[self.cols[override]]
+        counts[self.rows[override]] = 1
+        if self.integral: counts = counts.astype(np.int64)
+        return loads, counts
+
+class LoadTable:
+    """器具データごとのノード別・配下合計の負荷単位と器具数 (1回のツリー構築の間だけ使う)"""
+    def __init__(self, tree, matrix):
+        self.tree = tree
+        self.matrix = matrix
+        self._cache = {}
+
+    @classmethod
+    def from_pipes(cls, pipes, templates=None):
+        return cls(TreeArrays.from_pipes(pipes), FixtureMatrix.from_pipes(pipes, templates))
+
+    def stats(self, specs):
+        """{"load", "count", "subtree_load", "subtree_count"} の各リスト (行番号で引く)"""
+        cached = self._cache.get(id(specs))
+        if cached is not None and cached[0] is specs:
+            return cached[1]
+        loads, counts = self.matrix.node_stats(specs)
+        result = {
+            "load": loads.tolist(), "count": counts.tolist(),
+            "subtree_load": self.tree.subtree_sum(loads).tolist(),
+            "subtree_count": self.tree.subtree_sum(counts).tolist(),
+        }
+        self._cache[id(specs)] = (specs, result)
+        return result
@@ -3,27 +3,46 @@ import os
 import sys
 import platform
 import io
-import matplotlib.pyplot as plt
-import matplotlib.font_manager as fm
 from constants import FLOW_TABLE_FV, FLOW_TABLE_FT
 
+# matplotlib / graphviz は起動時間短縮のため初回使用時に読み込む
+_application_path = None
+_graphviz_path_ready = False
+
 def setup_environment(file_path):
-    """環境設定・パス設定"""
+    """環境設定・パス設定 (Graphviz の PATH 追加は初回使用時まで遅延)"""
+    global _application_path
     if getattr(sys, 'frozen', False):
         application_path = sys._MEIPASS
-        if platform.system() == "Windows":
-            graphviz_path = os.path.join(application_path, "Graphviz", "bin")
-            os.environ["PATH"] += os.pathsep + graphviz_path
     else:
         application_path = os.path.dirname(file_path)
-        if platform.system() == "Windows":
-            local_gv_path = os.path.join(application_path, "Graphviz", "bin")
-            if os.path.exists(local_gv_path):
-                os.environ["PATH"] += os.pathsep + local_gv_path
+    _application_path = application_path
     return application_path
 
+def ensure_graphviz_path(application_path=None):
+    """同梱の Graphviz/bin を PATH に追加 (プロセス内で1回のみ)"""
+    global _graphviz_path_ready
+    if _graphviz_path_ready:
+        return
+    base_path = application_path or _application_path
+    if base_path and platform.system() == "Windows":
+        gv_path = os.path.join(base_path, "Graphviz", "bin")
+        # exe 版は常に同梱、ソース実行時はフォルダがある場合のみ
+        if getattr(sys, 'frozen', False) or os.path.exists(gv_path):
+            if gv_path not in os.environ["PATH"].split(os.pathsep):
+                os.environ["PATH"] += os.pathsep + gv_path
+    _graphviz_path_ready = True
+
+def load_graphviz(application_path=None):
+    """graphviz モジュールを初回使用時に読み込む"""
+    ensure_graphviz_path(application_path)
+    import graphviz
+    return graphviz
+
 def setup_fonts():
     """グラフの日本語フォント設定"""
+    import matplotlib.pyplot as plt
+    import matplotlib.font_manager as fm
     # 利用可能なフォント一覧を取得
     available_fonts = set(f.name for f in fm.fontManager.ttflist)
 
@@ -92,6 +111,25 @@ def interpolate_flow(lu, is_fv=False):
             return table[x1] + (table[x2] - table[x1]) * (lu - x1) / (x2 - x1)
     return 0
 
+_catalog_cache = {}
+
+def get_pipe_catalog(all_pipe_db, pipe_type):
+    """管種の規格表を (サイズ→内径 dict, 内径昇順の [(サイズ, 内径)]) で返す
+
+    ノードごとに DataFrame を作らないよう、管種名でキャッシュする
+    (規格表 PIPE_DATABASES は定数で、実行中に書き換えない)。規格表にない管種は空で返し、キャッシュしない。
+    """
+    cached = _catalog_cache.get(pipe_type)
+    if cached is not None: return cached
+    rows = all_pipe_db.get(pipe_type)
+    if not rows: return {}, []
+    by_size = {}
+    for r in rows:
+        by_size.setdefault(r["サイズ"], r["内径(mm)"])
+    by_diameter = sorted(((r["サイズ"], r["内径(mm)"]) for r in rows), key=lambda x: x[1])
+    _catalog_cache[pipe_type] = (by_size, by_diameter)
+    return by_size, by_diameter
+
 def get_display_size(size_a, pipe_type):
     """表示用口径（A/Su/mm）の取得"""
     if "SGP" in pipe_type:
@@ -106,6 +144,7 @@ def get_display_size(size_a, pipe_type):
 
 def get_flow_curve_image(current_lu, current_flow, is_fv):
     """流量線図の画像を生成"""
+    import matplotlib.pyplot as plt
     # グラフ生成前にフォント設定を再適用して確実にする
     setup_fonts()
     
@@ -0,0 +1,349 @@
+# viewer.py
+"""大規模な系統図用の軽量ビューア (Streamlit カスタムコンポーネント)
+
+st.graphviz_chart は DOT 全体をブラウザで配置・描画するので、数千ノードを超えると
+タブが固まる。このビューアは Python 側で座標を決めて列ごとの配列で渡し、
+ブラウザ側では表示範囲にある節点・辺だけを SVG に描く。
+  - 座標: LAYOUT_CACHE に dot の配置があればそれを、なければ tree_layout()
+    (葉を順に並べて親を子の中央に置く、ノード数に比例する時間の配置) を使う。
+  - 描画: 座標を格子に分けた索引で表示範囲の節点・辺を引く。表示件数が DETAIL_LIMIT を
+    超える縮小表示では、節点・辺を色ごとに1本の path にまとめて描く (ラベルなし)。
+  - 操作: ドラッグで移動、ホイールで拡大縮小。クリックした節点の ID を返し、
+    画面側の on_select (set_parent) で選択する。最遠ルートは赤の太線で描く。
+"""
+import streamlit as st
+
+from diagram import edge_style, DEFAULT_DIAGRAM_OPTIONS
+
+VIEWER_NODE_THRESHOLD = 2000     # これを超える構成では既定でビューアを使う
+RANK_GAP = 240.0                 # 階層方向の間隔
+SIBLING_GAP = 64.0               # 兄弟方向の間隔
+DEFAULT_HEIGHT = 720
+NODE_FILLS = {"root": "#FFF9C4", "branch": "#E3F2FD", "system": "#E8F5E9", "fixture": "#F3E5F5"}
+
+def _preorder(root):
+    order, depth, stack = [], [], [(root, 0)]
+    while stack:
+        n, d = stack.pop()
+        order.append(n); depth.append(d)
+        stack.extend((c, d + 1) for c in reversed(n.children))
+    return order, depth
+
+def tree_layout(root, rankdir="LR", rank_gap=RANK_GAP, sibling_gap=SIBLING_GAP):
+    """行きがけ順のノードと (x, y) のリスト。葉を行きがけ順に並べ、親は最初と最後の子の中央に置く"""
+    order, depth = _preorder(root)
+    index = {id(n): i for i, n in enumerate(order)}
+    across = [0.0] * len(order)
+    slot = 0
+    for i, n in enumerate(order):
+        if not n.children:
+            across[i] = slot * sibling_gap
+            slot += 1
+    for i in range(len(order) - 1, -1, -1):
+        children = order[i].children
+        if children:
+            across[i] = (across[index[id(children[0])]] + across[index[id(children[-1])]]) / 2
+    along = [d * rank_gap for d in depth]
+    if rankdir == "LR": xy = list(zip(along, across))
+    elif rankdir == "BT": xy = list(zip(across, [-a for a in along]))
+    else: xy = list(zip(across, along))
+    return order, xy
+
+def graphviz_positions(layout, order):
+    """dot の配置 (compute_layout) から (x, y) のリスト。足りないノードがあれば None"""
+    xy = []
+    for n in order:
+        pos = layout["nodes"].get(n.id)
+        if pos is None: return None
+        x, y = pos.split(",")[:2]
+        xy.append((float(x), -float(y.rstrip("!"))))   # graphviz は上向きが正
+    return xy
+
+def viewer_data(root, options=None, critical_path_ids=None, selected_id=None, loop_links=None, layout=None,
+                height=DEFAULT_HEIGHT):
+    """ビューアへ渡す列ごとの配列 (JSON にできる dict)"""
+    opts = dict(DEFAULT_DIAGRAM_OPTIONS)
+    if options: opts.update(options)
+    critical_path_ids = critical_path_ids or set()
+    order, xy = tree_layout(root, opts["rankdir"])
+    source = "tree"
+    if layout:
+        positions = graphviz_positions(layout, order)
+        if positions: xy, source = positions, "graphviz"
+    index = {n.id: i for i, n in enumerate(order)}
+    parent, color, fontcolor, width, dash, edge_label = [], [], [], [], [], []
+    for n in order:
+        p = index.get(n.parent_id, -1) if n is not root else -1
+        parent.append(p)
+        if p < 0:
+            color.append(""); fontcolor.append(""); width.append(0); dash.append(0); edge_label.append("")
+            continue
+        c, fc, style, penwidth = edge_style(n.parent_id, n, opts["color_mode"], opts["max_velocity"], critical_path_ids)
+        color.append(c); fontcolor.append(fc); width.append(float(penwidth)); dash.append(1 if style == "dashed" else 0)
+        pipe_info = n.size + (f" ({n.specific_pipe_type})" if n.specific_pipe_type else "")
+        edge_label.append(f"{'🔒' if n.is_manual else ''}{pipe_info} {int(n.flow_lpm)} L/min")
+    links = [[index[l["from"]], index[l["to"]]] for l in loop_links or [] if l["from"] in index and l["to"] in index]
+    return {
+        "layout_key": f"{source}:{opts['rankdir']}:{len(order)}:{order[-1].id if order else ''}",
+        "rankdir": opts["rankdir"],
+        "height": height,
+        "id": [n.id for n in order],
+        "name": [n.name for n in order],
+        "kind": ["root" if n is root else n.type for n in order],
+        "flow": [int(n.flow_lpm) for n in order],
+        "tip": [n.calc_description or n.name for n in order],
+        "x": [round(x, 1) for x, _ in xy],
+        "y": [round(y, 1) for _, y in xy],
+        "parent": parent,
+        "critical": [1 if n.id in critical_path_ids else 0 for n in order],
+        "color": color, "fontcolor": fontcolor, "width": width, "dash": dash, "edge_label": edge_label,
+        "fills": NODE_FILLS,
+        "links": links,
+        "selected": index.get(selected_id, -1),
+    }
+
+_VIEWER_CSS = """
+.pv-host { position: relative; border: 1px solid #ddd; border-radius: 4px; overflow: hidden; background: #fff; touch-action: none; }
+.pv-svg { width: 100%; height: 100%; cursor: grab; user-select: none; }
+.pv-svg.pv-drag { cursor: grabbing; }
+.pv-bar { position: absolute; top: 6px; right: 6px; display: flex; gap: 4px; align-items: center; font-size: 12px; }
+.pv-bar button { border: 1px solid #ccc; background: #fafafa; border-radius: 3px; padding: 1px 8px; cursor: pointer; }
+.pv-info { color: #666; background: rgba(255,255,255,0.8); padding: 0 4px; }
+.pv-node { cursor: pointer; }
+"""
+
+_VIEWER_JS = """
+const DETAIL_LIMIT = 1500;   // 表示件数がこれ以下なら節点を個別に描く
+const NODE_W = 150, NODE_H = 40;
+const esc = (s) => String(s).replace(/[&<>"]/g, (c) => ({ "&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;" }[c]));
+
+export default function (component) {
+  const { data, setTriggerValue, parentElement } = component;
+  if (!data || !data.id || !data.id.length) return;
+  let host = parentElement.querySelector(".pv-host");
+  if (!host) {
+    host = document.createElement("div");
+    host.className = "pv-host";
+    host.innerHTML = '<svg class="pv-svg"><g class="pv-scene"></g></svg>' +
+      '<div class="pv-bar"><span class="pv-info"></span><button data-act="in">＋</button>' +
+      '<button data-act="out">－</button><button data-act="fit">全体</button></div>';
+    parentElement.appendChild(host);
+  }
+  if (host.__cleanup) host.__cleanup();
+  host.style.height = data.height + "px";
+  const svg = host.querySelector("svg"), scene = host.querySelector(".pv-scene"), info = host.querySelector(".pv-info");
+  const n = data.id.length, X = data.x, Y = data.y, P = data.parent;
+  const horizontal = data.rankdir === "LR";
+
+  // 格子の索引 (節点は中心のセル、辺は親子の外接矩形が掛かるセル)
+  let minX = Infinity, minY = Infinity, maxX = -Infinity, maxY = -Infinity;
+  for (let i = 0; i < n; i++) {
+    if (X[i] < minX) minX = X[i]; if (X[i] > maxX) maxX = X[i];
+    if (Y[i] < minY) minY = Y[i]; if (Y[i] > maxY) maxY = Y[i];
+  }
+  const spanX = maxX - minX + NODE_W, spanY = maxY - minY + NODE_H;
+  const cell = Math.max(NODE_W * 2, Math.sqrt((spanX * spanY) / n) * 3);
+  const cols = Math.ceil(spanX / cell) + 1, rows = Math.ceil(spanY / cell) + 1;
+  const cx = (x) => Math.min(cols - 1, Math.max(0, Math.floor((x - minX) / cell)));
+  const cy = (y) => Math.min(rows - 1, Math.max(0, Math.floor((y - minY) / cell)));
+  const nodeCells = Array.from({ length: cols * rows }, () => []);
+  const edgeCells = Array.from({ length: cols * rows }, () => []);
+  for (let i = 0; i < n; i++) {
+    nodeCells[cy(Y[i]) * cols + cx(X[i])].push(i);
+    const p = P[i];
+    if (p < 0) continue;
+    for (let r = cy(Math.min(Y[i], Y[p])); r <= cy(Math.max(Y[i], Y[p])); r++)
+      for (let c = cx(Math.min(X[i], X[p])); c <= cx(Math.max(X[i], X[p])); c++) edgeCells[r * cols + c].push(i);
+  }
+  const nodeStamp = new Uint32Array(n), edgeStamp = new Uint32Array(n);
+  let epoch = 0;
+
+  // 表示位置 (同じ配置なら再実行後も保つ)
+  const state = host.__pv && host.__pv.key === data.layout_key ? host.__pv : { key: data.layout_key, view: null };
+  host.__pv = state;
+  const fit = () => {
+    const W = host.clientWidth || 800, H = host.clientHeight || data.height;
+    const s = Math.min(W / (spanX + NODE_W), H / (spanY + NODE_H));
+    state.view = { s, tx: W / 2 - ((minX + maxX) / 2) * s, ty: H / 2 - ((minY + maxY) / 2) * s };
+  };
+  if (!state.view) fit();
+
+  const visible = () => {
+    const v = state.view, W = host.clientWidth, H = host.clientHeight;
+    const x0 = -v.tx / v.s - NODE_W, x1 = (W - v.tx) / v.s + NODE_W;
+    const y0 = -v.ty / v.s - NODE_H, y1 = (H - v.ty) / v.s + NODE_H;
+    const nodes = [], edges = [];
+    epoch++;
+    for (let r = cy(y0); r <= cy(y1); r++) {
+      for (let c = cx(x0); c <= cx(x1); c++) {
+        for (const i of nodeCells[r * cols + c]) {
+          if (nodeStamp[i] === epoch) continue;
+          nodeStamp[i] = epoch;
+          if (X[i] >= x0 && X[i] <= x1 && Y[i] >= y0 && Y[i] <= y1) nodes.push(i);
+        }
+        for (const i of edgeCells[r * cols + c]) {
+          if (edgeStamp[i] === epoch) continue;
+          edgeStamp[i] = epoch;
+          edges.push(i);
+        }
+      }
+    }
+    return { nodes, edges };
+  };
+
+  // 親 → 子の折れ線 (階層方向に半分進んでから兄弟方向へ)
+  const edgePath = (i, v) => {
+    const p = P[i];
+    const px = X[p] * v.s + v.tx, py = Y[p] * v.s + v.ty, qx = X[i] * v.s + v.tx, qy = Y[i] * v.s + v.ty;
+    if (horizontal) { const m = (px + qx) / 2; return `M${px.toFixed(1)},${py.toFixed(1)}H${m.toFixed(1)}V${qy.toFixed(1)}H${qx.toFixed(1)}`; }
+    const m = (py + qy) / 2;
+    return `M${px.toFixed(1)},${py.toFixed(1)}V${m.toFixed(1)}H${qx.toFixed(1)}V${qy.toFixed(1)}`;
+  };
+
+  const draw = () => {
+    const v = state.view, { nodes, edges } = visible();
+    const w = NODE_W * v.s, h = NODE_H * v.s, coarse = nodes.length > DETAIL_LIMIT || w < 24;
+    const parts = [];
+    const groups = new Map();
+    const seen = new Set();
+    const pixel = (x, y) => Math.round(x) * 65536 + Math.round(y);
+    for (const i of edges) {
+      if (coarse) {
+        // 縮小表示では同じ画素に収まる辺を1本にする
+        const p = P[i], a = pixel(X[p] * v.s + v.tx, Y[p] * v.s + v.ty), b = pixel(X[i] * v.s + v.tx, Y[i] * v.s + v.ty);
+        if (a === b || seen.has(a * 4294967296 + b)) continue;
+        seen.add(a * 4294967296 + b);
+      }
+      const k = `${data.color[i]}|${data.width[i]}|${data.dash[i]}`;
+      if (!groups.has(k)) groups.set(k, []);
+      groups.get(k).push(edgePath(i, v));
+    }
+    for (const [k, ds] of groups) {
+      const [color, width, dash] = k.split("|");
+      parts.push(`<path d="${ds.join("")}" fill="none" stroke="${color}" stroke-width="${width}"${dash === "1" ? ' stroke-dasharray="6,4"' : ""}/>`);
+    }
+    for (const [a, b] of data.links) {
+      parts.push(`<line x1="${X[a] * v.s + v.tx}" y1="${Y[a] * v.s + v.ty}" x2="${X[b] * v.s + v.tx}" y2="${Y[b] * v.s + v.ty}" stroke="#6A1B9A" stroke-dasharray="6,4"/>`);
+    }
+    if (coarse) {
+      // 縮小表示: 節点は種別ごとに小さな四角を1本の path にまとめる (同じ画素に重なるものは1つ)
+      const r = Math.max(1.5, Math.min(w, h) / 2);
+      const byKind = {};
+      seen.clear();
+      for (const i of nodes) {
+        const x = X[i] * v.s + v.tx, y = Y[i] * v.s + v.ty, key = pixel(x, y);
+        if (seen.has(key)) continue;
+        seen.add(key);
+        (byKind[data.kind[i]] = byKind[data.kind[i]] || []).push(`M${(x - r).toFixed(1)},${(y - r).toFixed(1)}h${2 * r}v${2 * r}h${-2 * r}z`);
+      }
+      for (const kind in byKind) parts.push(`<path d="${byKind[kind].join("")}" fill="${data.fills[kind] || "#eee"}" stroke="#555" stroke-width="0.5"/>`);
+      if (data.selected >= 0 && nodeStamp[data.selected] === epoch) {
+        const i = data.selected;
+        parts.push(`<rect x="${X[i] * v.s + v.tx - r - 3}" y="${Y[i] * v.s + v.ty - r - 3}" width="${2 * r + 6}" height="${2 * r + 6}" fill="none" stroke="red" stroke-width="2"/>`);
+      }
+    } else {
+      const font = Math.min(14, 11 * v.s);
+      if (font >= 6) {
+        for (const i of edges) {
+          const p = P[i];
+          const x = ((X[p] + X[i]) / 2) * v.s + v.tx, y = ((Y[p] + Y[i]) / 2) * v.s + v.ty;
+          parts.push(`<text x="${x.toFixed(1)}" y="${(y - 3).toFixed(1)}" font-size="${(font * 0.85).toFixed(1)}" fill="${data.fontcolor[i]}" text-anchor="middle">${esc(data.edge_label[i])}</text>`);
+        }
+      }
+      for (const i of nodes) {
+        const x = X[i] * v.s + v.tx - w / 2, y = Y[i] * v.s + v.ty - h / 2;
+        const sel = i === data.selected;
+        parts.push(`<g class="pv-node" data-i="${i}"><title>${esc(data.tip[i])}</title>` +
+          `<rect x="${x.toFixed(1)}" y="${y.toFixed(1)}" width="${w.toFixed(1)}" height="${h.toFixed(1)}" rx="${(4 * v.s).toFixed(1)}" ` +
+          `fill="${data.fills[data.kind[i]] || "#eee"}" stroke="${sel ? "red" : data.critical[i] ? "#D32F2F" : "#555"}" stroke-width="${sel ? 3 : 1}"/>`);
+        if (font >= 6) {
+          parts.push(`<text x="${(x + w / 2).toFixed(1)}" y="${(y + h * 0.42).toFixed(1)}" font-size="${font.toFixed(1)}" text-anchor="middle" font-weight="bold">${esc(data.name[i])}</text>` +
+            `<text x="${(x + w / 2).toFixed(1)}" y="${(y + h * 0.8).toFixed(1)}" font-size="${(font * 0.85).toFixed(1)}" text-anchor="middle">${data.flow[i]} L/min</text>`);
+        }
+        parts.push("</g>");
+      }
+    }
+    scene.innerHTML = parts.join("");
+    info.textContent = `${nodes.length} / ${n} 区間を表示 · ×${v.s.toFixed(2)}`;
+  };
+
+  let queued = false;
+  const schedule = () => { if (!queued) { queued = true; requestAnimationFrame(() => { queued = false; draw(); }); } };
+
+  // 表示範囲の節点から、クリック位置に重なるものを探す
+  const hit = (sx, sy) => {
+    const v = state.view, wx = (sx - v.tx) / v.s, wy = (sy - v.ty) / v.s;
+    const hw = Math.max(NODE_W / 2, 6 / v.s), hh = Math.max(NODE_H / 2, 6 / v.s);
+    let best = -1, bestD = Infinity;
+    for (let r = cy(wy - hh); r <= cy(wy + hh); r++)
+      for (let c = cx(wx - hw); c <= cx(wx + hw); c++)
+        for (const i of nodeCells[r * cols + c]) {
+          const dx = Math.abs(X[i] - wx), dy = Math.abs(Y[i] - wy);
+          if (dx <= hw && dy <= hh && dx + dy < bestD) { best = i; bestD = dx + dy; }
+        }
+    return best;
+  };
+
+  const ac = new AbortController(), opt = { signal: ac.signal };
+  let drag = null;
+  svg.addEventListener("pointerdown", (e) => {
+    drag = { x: e.clientX, y: e.clientY, tx: state.view.tx, ty: state.view.ty, moved: false };
+    svg.setPointerCapture(e.pointerId);
+    svg.classList.add("pv-drag");
+  }, opt);
+  svg.addEventListener("pointermove", (e) => {
+    if (!drag) return;
+    const dx = e.clientX - drag.x, dy = e.clientY - drag.y;
+    if (Math.abs(dx) + Math.abs(dy) > 4) drag.moved = true;
+    state.view.tx = drag.tx + dx; state.view.ty = drag.ty + dy;
+    schedule();
+  }, opt);
+  svg.addEventListener("pointerup", (e) => {
+    svg.classList.remove("pv-drag");
+    if (drag && !drag.moved) {
+      const rect = svg.getBoundingClientRect();
+      const i = hit(e.clientX - rect.left, e.clientY - rect.top);
+      if (i >= 0) { data.selected = i; schedule(); setTriggerValue("selected", data.id[i]); }
+    }
+    drag = null;
+  }, opt);
+  const zoom = (factor, sx, sy) => {
+    const v = state.view;
+    v.tx = sx - (sx - v.tx) * factor; v.ty = sy - (sy - v.ty) * factor; v.s *= factor;
+    schedule();
+  };
+  svg.addEventListener("wheel", (e) => {
+    e.preventDefault();
+    const rect = svg.getBoundingClientRect();
+    zoom(Math.exp(-e.deltaY * 0.0015), e.clientX - rect.left, e.clientY - rect.top);
+  }, { signal: ac.signal, passive: false });
+  host.querySelector(".pv-bar").addEventListener("click", (e) => {
+    const act = e.target.getAttribute && e.target.getAttribute("data-act");
+    if (act === "fit") { fit(); schedule(); }
+    else if (act === "in") zoom(1.5, host.clientWidth / 2, host.clientHeight / 2);
+    else if (act === "out") zoom(1 / 1.5, host.clientWidth / 2, host.clientHeight / 2);
+  }, opt);
+  const observer = new ResizeObserver(schedule);
+  observer.observe(host);
+  host.__cleanup = () => { ac.abort(); observer.disconnect(); host.__cleanup = null; };
+  schedule();
+  return host.__cleanup;
+}
+"""
+
+_component = None
+
+def _viewer_component():
+    global _component
+    if _component is None:
+        _component = st.components.v2.component("pipe_diagram_viewer", css=_VIEWER_CSS, js=_VIEWER_JS)
+    return _component
+
+def show_viewer(data, key="diagram_viewer", on_select=None):
+    """ビューアを表示する。on_select は節点がクリックされたときに呼ばれる (ID は selected_node_id() で取る)"""
+    return _viewer_component()(key=key, data=data, height=data["height"], on_selected_change=on_select or (lambda: None))
+
+def selected_node_id(key="diagram_viewer"):
+    """コールバック内で、ビューアでクリックされた節点の ID を取る"""
+    value = st.session_state.get(key)
+    return value.get("selected") if value is not None else None